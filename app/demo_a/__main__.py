@@ -0,0 +1,7 @@
+"""python -m app.demo_a エントリポイント"""
+
+import sys
+
+from app.demo_a.cli import main
+
+sys.exit(main())
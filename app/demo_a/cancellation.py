@@ -0,0 +1,91 @@
+"""処理の協調的な取消（キャンセルトークン）
+
+インデックス構築・抽出に CancelToken を渡しておくと、cancel() した時点で
+    - まだ送信していないバッチ・ステップは実行しない
+    - リトライ・レート制限の待機はすぐに終わる
+    - 送信中のHTTPリクエストは中断する（ストリームを閉じる）
+のいずれかで打ち切られ、OperationCancelledError が送出される。
+
+    cancel = CancelToken()
+    threading.Thread(target=lambda: build_index(pdf_path, cancel=cancel)).start()
+    ...
+    cancel.cancel()   # 文書の切り替え・セッション終了・ジョブの取消など
+
+cancel 引数はどの関数でも省略でき、その場合は取り消されない。
+"""
+
+import threading
+import time
+from collections.abc import Callable
+
+
+class OperationCancelledError(Exception):
+    """CancelToken により処理が取り消された。"""
+
+
+class CancelToken:
+    """取消の通知を受け取るトークン（スレッド間で共有する）。"""
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._callbacks: dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """取り消す。登録済みのコールバック（送信中リクエストの中断など）を呼ぶ。2回目以降は何もしない。"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self) -> None:
+        """取り消されていれば OperationCancelledError を送出する。"""
+        if self._event.is_set():
+            raise OperationCancelledError("処理が取り消されました")
+
+    def sleep(self, seconds: float) -> None:
+        """seconds 秒待つ。途中で取り消されたらすぐに OperationCancelledError を送出する。"""
+        if self._event.wait(seconds):
+            self.raise_if_cancelled()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """取消時に呼ぶコールバックを登録する。取消済みならその場で呼ぶ。
+
+        Returns:
+            登録を解除する関数（処理が終わったら呼ぶ）
+        """
+        with self._lock:
+            if not self._event.is_set():
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._remove(callback_id)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback_id: int) -> None:
+        with self._lock:
+            self._callbacks.pop(callback_id, None)
+
+
+def raise_if_cancelled(cancel: CancelToken | None) -> None:
+    """cancel が取り消されていれば OperationCancelledError を送出する（Noneなら何もしない）。"""
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+
+
+def cancellable_sleep(seconds: float, cancel: CancelToken | None) -> None:
+    """取消で中断できる time.sleep（cancel がNoneなら通常の time.sleep）。"""
+    if cancel is None:
+        time.sleep(seconds)
+    else:
+        cancel.sleep(seconds)
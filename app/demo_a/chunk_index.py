@@ -0,0 +1,152 @@
+"""Step 3後: チャンクインデックス（区間木）とバッチ境界の重複調停
+
+build_document_index の出力をページ区間で引けるようにする。
+    - ChunkIndex: page_start 順に並べたチャンクを区間木（配列上の暗黙二分木 + 部分木の最大 page_end）
+      で保持し、「ページNを含むチャンク」「ページA–Bと重なるチャンク」を O(log n + k) で返す
+    - reconcile_batch_chunks: オーバーラップ付きバッチで二重に生成されたチャンクを、
+      境界で切れた側を完全な側と統合する・完全な重複を捨てる・一部重複を切り詰める ことで1つにまとめる
+"""
+
+from bisect import bisect_left
+from collections.abc import Iterator, Sequence
+from typing import overload
+
+from app.demo_a.schemas import SemanticChunk
+
+
+class ChunkIndex(Sequence[SemanticChunk]):
+    """ページ区間で検索できるチャンクの列（page_start, page_end 順）。
+
+    list[SemanticChunk] と同様に len()・添字・スライス・反復で使える。
+
+    Args:
+        chunks: チャンクのリスト（順不同で可）
+    """
+
+    def __init__(self, chunks: list[SemanticChunk]) -> None:
+        self._chunks = sorted(chunks, key=lambda c: (c.page_start, c.page_end))
+        self._starts = [c.page_start for c in self._chunks]
+        self._by_id = {c.chunk_id: c for c in self._chunks}
+        # 区間木: 範囲 [lo, hi) の中央要素を節とし、その部分木の page_end 最大値を節の位置に持つ
+        self._max_end = [0] * len(self._chunks)
+        self._build(0, len(self._chunks))
+
+    def _build(self, lo: int, hi: int) -> int:
+        if lo >= hi:
+            return 0
+        mid = (lo + hi) // 2
+        self._max_end[mid] = max(self._chunks[mid].page_end, self._build(lo, mid), self._build(mid + 1, hi))
+        return self._max_end[mid]
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    @overload
+    def __getitem__(self, i: int) -> SemanticChunk: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> list[SemanticChunk]: ...
+
+    def __getitem__(self, i):
+        return self._chunks[i]
+
+    def __iter__(self) -> Iterator[SemanticChunk]:
+        return iter(self._chunks)
+
+    def get(self, chunk_id: str) -> SemanticChunk | None:
+        """chunk_id でチャンクを取得する。"""
+        return self._by_id.get(chunk_id)
+
+    def overlapping(self, page_start: int, page_end: int) -> list[SemanticChunk]:
+        """ページ範囲 [page_start, page_end] と1ページでも重なるチャンク（文書順）。"""
+        # page_start > page_end のチャンクは対象外なので、探索は先頭からその位置まで
+        hi = bisect_left(self._starts, page_end + 1)
+        found: list[int] = []
+        self._query(0, len(self._chunks), hi, page_start, found)
+        return [self._chunks[i] for i in sorted(found)]
+
+    def covering(self, page: int) -> list[SemanticChunk]:
+        """ページ番号 page を含むチャンク（文書順）。"""
+        return self.overlapping(page, page)
+
+    def _query(self, lo: int, hi: int, limit: int, page_start: int, found: list[int]) -> None:
+        if lo >= hi or lo >= limit:
+            return
+        mid = (lo + hi) // 2
+        # 部分木内のどのチャンクも page_start より前に終わっている
+        if self._max_end[mid] < page_start:
+            return
+        self._query(lo, mid, limit, page_start, found)
+        if mid < limit and self._chunks[mid].page_end >= page_start:
+            found.append(mid)
+        self._query(mid + 1, hi, limit, page_start, found)
+
+
+def reconcile_batch_chunks(
+    all_batch_chunks: list[list[SemanticChunk]],
+    batches: list[dict],
+) -> list[SemanticChunk]:
+    """オーバーラップ領域で重複したチャンクを調停し、chunk_idを通し番号で振り直す。
+
+    後続バッチのチャンクを、直前バッチで採用済みのチャンクと比べて:
+        - 採用済みチャンクに完全に含まれる → 重複として捨てる
+        - 直前バッチの末尾ページで切れている採用済みチャンクと重なる → 同じセクションとみなして統合
+          （範囲は和集合、説明はページ数の多い＝より全体を見ている側を採用）
+        - 直前バッチ内で完結している採用済みチャンクと一部重なる → 重なり以降に切り詰める
+
+    Args:
+        all_batch_chunks: バッチごとのチャンクリスト
+        batches: バッチ情報のリスト（page_start, page_end必須）
+
+    Returns:
+        調停済みのチャンクリスト（文書順）
+    """
+    accepted: list[SemanticChunk] = []
+    previous: list[int] = []  # 直前バッチ由来の採用済みチャンク（accepted内の添字）
+
+    for i, chunks in enumerate(all_batch_chunks):
+        current: list[int] = []
+        prev_end = batches[i - 1]["page_end"] if i > 0 else 0
+
+        for chunk in sorted(chunks, key=lambda c: (c.page_start, c.page_end)):
+            overlaps = [
+                j
+                for j in previous
+                if accepted[j].page_start <= chunk.page_end and chunk.page_start <= accepted[j].page_end
+            ]
+            if not overlaps:
+                current.append(len(accepted))
+                accepted.append(chunk.model_copy())
+                continue
+
+            if any(
+                accepted[j].page_start <= chunk.page_start and chunk.page_end <= accepted[j].page_end for j in overlaps
+            ):
+                continue
+
+            truncated = [j for j in overlaps if accepted[j].page_end >= prev_end]
+            if truncated:
+                j = truncated[0]
+                kept = accepted[j]
+                # 和集合を取っても、同時に重なる他の採用済みチャンクの範囲には食い込ませない
+                floor = max((accepted[k].page_end for k in overlaps if k != j), default=0) + 1
+                merged_start = max(min(kept.page_start, chunk.page_start), floor)
+                merged_end = max(kept.page_end, chunk.page_end)
+                # 他のチャンクが範囲を覆っていて何も残らない場合は統合せず、切り詰めとして扱う
+                if merged_start <= merged_end:
+                    text_from = chunk if chunk.page_end - chunk.page_start > kept.page_end - kept.page_start else kept
+                    accepted[j] = text_from.model_copy(update={"page_start": merged_start, "page_end": merged_end})
+                    current.append(j)
+                    continue
+
+            new_start = max(accepted[j].page_end for j in overlaps) + 1
+            if new_start <= chunk.page_end:
+                current.append(len(accepted))
+                accepted.append(chunk.model_copy(update={"page_start": new_start}))
+
+        previous = current
+
+    accepted.sort(key=lambda c: (c.page_start, c.page_end))
+    for idx, chunk in enumerate(accepted, 1):
+        chunk.chunk_id = f"chunk_{idx:03d}"
+    return accepted
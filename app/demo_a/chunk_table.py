@@ -0,0 +1,289 @@
+"""列指向・mmap読み出しのチャンクテーブル（多数文書のチャンクインデックスのアーカイブ）
+
+文書ごとの list[SemanticChunk] を Pydantic オブジェクトや整形JSONのまま大量に持つ代わりに、
+ページ範囲・文書番号は型付き配列、文字列はオフセット表付きのblobとして1ファイルに詰める。
+読み出しはmmap経由で、列は memoryview.cast() でコピーせずに参照し、
+SemanticChunk への変換は必要な行だけ行う。
+
+行は (文書番号, page_start, page_end) 順に並べて保存するため、
+文書での絞り込みは二分探索、ページ範囲での絞り込みはその文書の行の範囲内だけを走査する。
+
+ファイル形式（リトルエンディアン、各セクションは8バイト境界に整列）:
+    ヘッダ   : magic "DACT", version u16, flags u16, row_count u32, doc_count u32, reserved u32
+    列       : doc u32[n], page_start u32[n], page_end u32[n]
+    文字列表 : chunk_id / query / description それぞれ u64[n+1] のオフセット + UTF-8 blob
+    文書表   : u64[doc_count+1] のオフセット + UTF-8 blob（文書キー。文書番号の順）
+
+使用例:
+    python -m app.demo_a.chunk_table pack logs/*_chunk_index.json -o output/chunks.dct
+    python -m app.demo_a.chunk_table query output/chunks.dct --document contract.pdf --pages 40-60
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+from app.demo_a.schemas import SemanticChunk
+
+_MAGIC = b"DACT"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHHIII")
+_ALIGN = 8
+
+_STRING_COLUMNS = ("chunk_id", "query", "description")
+
+
+def _pad(size: int) -> int:
+    return -size % _ALIGN
+
+
+class ChunkTable:
+    """チャンクテーブル。from_chunks() でメモリ上に作るか、open() でファイルから読む。
+
+    行番号は保存順（文書番号, page_start, page_end 順）の0始まり。
+    """
+
+    def __init__(
+        self,
+        documents: list[str],
+        doc: Sequence[int],
+        page_start: Sequence[int],
+        page_end: Sequence[int],
+        strings: dict[str, tuple[Sequence[int], bytes | memoryview]],
+    ) -> None:
+        self.documents = documents
+        self.doc = doc
+        self.page_start = page_start
+        self.page_end = page_end
+        self._strings = strings
+        self._doc_numbers = {name: i for i, name in enumerate(documents)}
+        self._mm: mmap.mmap | None = None
+        self._file = None
+        self._views: list[memoryview] = []
+
+    @classmethod
+    def from_chunks(cls, entries: Iterable[tuple[str, Sequence[SemanticChunk]]]) -> "ChunkTable":
+        """(文書キー, チャンク列) の組からテーブルを作る。同じ文書キーは1つにまとめる。"""
+        by_doc: dict[str, list[SemanticChunk]] = {}
+        for document, chunks in entries:
+            by_doc.setdefault(document, []).extend(chunks)
+
+        documents = sorted(by_doc)
+        doc, page_start, page_end = array("I"), array("I"), array("I")
+        values: dict[str, list[bytes]] = {name: [] for name in _STRING_COLUMNS}
+        for number, document in enumerate(documents):
+            for chunk in sorted(by_doc[document], key=lambda c: (c.page_start, c.page_end)):
+                doc.append(number)
+                page_start.append(chunk.page_start)
+                page_end.append(chunk.page_end)
+                for name in _STRING_COLUMNS:
+                    values[name].append(getattr(chunk, name).encode("utf-8"))
+
+        strings = {}
+        for name, items in values.items():
+            offsets = array("Q", [0])
+            for item in items:
+                offsets.append(offsets[-1] + len(item))
+            strings[name] = (offsets, b"".join(items))
+        return cls(documents, doc, page_start, page_end, strings)
+
+    @classmethod
+    def open(cls, path: Path) -> "ChunkTable":
+        """ファイルをmmapで開く。列はコピーせずにファイル上を直接参照する。"""
+        f = open(path, "rb")
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            f.close()
+            raise
+        magic, version, _, rows, doc_count, _ = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            mm.close()
+            f.close()
+            raise ValueError(f"チャンクテーブルの形式が不正です: {path}")
+
+        views: list[memoryview] = []
+        offset = _HEADER.size + _pad(_HEADER.size)
+
+        def _column(fmt: str, count: int) -> memoryview:
+            nonlocal offset
+            size = struct.calcsize(fmt) * count
+            view = memoryview(mm)[offset : offset + size].cast(fmt)
+            views.append(view)
+            offset += size + _pad(size)
+            return view
+
+        def _blob(size: int) -> memoryview:
+            nonlocal offset
+            view = memoryview(mm)[offset : offset + size]
+            views.append(view)
+            offset += size + _pad(size)
+            return view
+
+        doc = _column("I", rows)
+        page_start = _column("I", rows)
+        page_end = _column("I", rows)
+        strings = {}
+        for name in _STRING_COLUMNS:
+            offsets = _column("Q", rows + 1)
+            strings[name] = (offsets, _blob(offsets[-1]))
+        doc_offsets = _column("Q", doc_count + 1)
+        doc_blob = _blob(doc_offsets[-1])
+        documents = [bytes(doc_blob[doc_offsets[i] : doc_offsets[i + 1]]).decode("utf-8") for i in range(doc_count)]
+
+        table = cls(documents, doc, page_start, page_end, strings)
+        table._mm, table._file, table._views = mm, f, views
+        return table
+
+    def write(self, path: Path) -> Path:
+        """テーブルをファイルに書き出す（一時ファイル経由で置き換え）。"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + f".{os.getpid()}.tmp")
+
+        def _write(f, data: bytes) -> None:
+            f.write(data)
+            f.write(b"\0" * _pad(len(data)))
+
+        doc_items = [d.encode("utf-8") for d in self.documents]
+        doc_offsets = array("Q", [0])
+        for item in doc_items:
+            doc_offsets.append(doc_offsets[-1] + len(item))
+
+        with open(tmp_path, "wb") as f:
+            _write(f, _HEADER.pack(_MAGIC, _VERSION, 0, len(self), len(self.documents), 0))
+            for column in (self.doc, self.page_start, self.page_end):
+                _write(f, array("I", column).tobytes())
+            for name in _STRING_COLUMNS:
+                offsets, blob = self._strings[name]
+                _write(f, array("Q", offsets).tobytes())
+                _write(f, bytes(blob))
+            _write(f, doc_offsets.tobytes())
+            _write(f, b"".join(doc_items))
+        os.replace(tmp_path, path)
+        return path
+
+    def __len__(self) -> int:
+        return len(self.doc)
+
+    def _string(self, name: str, row: int) -> str:
+        offsets, blob = self._strings[name]
+        return bytes(blob[offsets[row] : offsets[row + 1]]).decode("utf-8")
+
+    def document_of(self, row: int) -> str:
+        """行の文書キー。"""
+        return self.documents[self.doc[row]]
+
+    def chunk(self, row: int) -> SemanticChunk:
+        """行を SemanticChunk に変換する。"""
+        return SemanticChunk(
+            chunk_id=self._string("chunk_id", row),
+            page_start=self.page_start[row],
+            page_end=self.page_end[row],
+            query=self._string("query", row),
+            description=self._string("description", row),
+        )
+
+    def document_rows(self, document: str) -> range:
+        """文書の行範囲（二分探索）。未登録の文書は空の range。"""
+        number = self._doc_numbers.get(document)
+        if number is None:
+            return range(0)
+        return range(bisect_left(self.doc, number), bisect_right(self.doc, number))
+
+    def select(
+        self,
+        document: str | None = None,
+        page_start: int | None = None,
+        page_end: int | None = None,
+    ) -> list[int]:
+        """文書・ページ範囲で行を絞り込む。
+
+        ページ範囲は [page_start, page_end] と1ページでも重なる行を返す（片側省略可）。
+
+        Returns:
+            該当する行番号のリスト（保存順）
+        """
+        rows = self.document_rows(document) if document is not None else range(len(self))
+        lo, hi = rows.start, rows.stop
+
+        if page_end is not None and document is not None:
+            # 文書内では page_start 昇順なので、page_end より後に始まる行は二分探索で除外できる
+            hi = bisect_right(self.page_start, page_end, lo, hi)
+
+        rows = range(lo, hi)
+        if page_start is None and page_end is None:
+            return list(rows)
+        # 列をまとめてPythonの整数列に変換してから比較する（行ごとの添字アクセスより速い）
+        first = page_start if page_start is not None else 0
+        last = page_end if page_end is not None else 0xFFFFFFFF
+        starts = self.page_start[lo:hi].tolist()
+        ends = self.page_end[lo:hi].tolist()
+        return [row for row, s, e in zip(rows, starts, ends) if e >= first and s <= last]
+
+    def chunks(self, document: str) -> list[SemanticChunk]:
+        """文書の全チャンクを SemanticChunk のリストとして返す（ChunkIndex に渡せる）。"""
+        return [self.chunk(row) for row in self.document_rows(document)]
+
+    def close(self) -> None:
+        """ファイルから開いた場合、mmapを閉じる。"""
+        for view in self._views:
+            view.release()
+        self._views = []
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+
+
+def _parse_pages(value: str) -> tuple[int, int]:
+    start, _, end = value.partition("-")
+    return int(start), int(end or start)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.demo_a.chunk_table", description="チャンクテーブルの作成・検索"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pack = sub.add_parser("pack", help="chunk_index ログ（JSON）をチャンクテーブルにまとめる")
+    pack.add_argument("logs", nargs="+", type=Path, help="build_index が出力した *_chunk_index.json")
+    pack.add_argument("-o", "--output", type=Path, required=True, help="出力先（.dct）")
+
+    query = sub.add_parser("query", help="チャンクテーブルを文書・ページ範囲で検索する")
+    query.add_argument("table", type=Path)
+    query.add_argument("--document", default=None, help="文書キー（chunk_index ログの source_pdf）")
+    query.add_argument("--pages", type=_parse_pages, default=None, help="ページ範囲（例: 40-60）")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        entries = []
+        for log_path in args.logs:
+            data = json.loads(log_path.read_text(encoding="utf-8"))
+            entries.append((data["source_pdf"], [SemanticChunk.model_validate(c) for c in data["chunks"]]))
+        table = ChunkTable.from_chunks(entries)
+        table.write(args.output)
+        print(f"{len(table.documents)}文書 / {len(table)}チャンク → {args.output}", file=sys.stderr)
+        return 0
+
+    table = ChunkTable.open(args.table)
+    try:
+        page_start, page_end = args.pages if args.pages else (None, None)
+        for row in table.select(args.document, page_start, page_end):
+            record = {"document": table.document_of(row), **table.chunk(row).model_dump()}
+            print(json.dumps(record, ensure_ascii=False))
+    finally:
+        table.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,17 @@
 """Step 3: セマンティックチャンク生成（LLM使用・並列処理）"""
 
 import logging
-import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pymupdf
-from anthropic import BadRequestError
-
-from app.demo_a.llm_client import get_client
+from app.demo_a.cancellation import CancelToken, OperationCancelledError, cancellable_sleep, raise_if_cancelled
+from app.demo_a.chunk_index import ChunkIndex, reconcile_batch_chunks
+from app.demo_a.index_checkpoint import IndexCheckpoint
+from app.demo_a.llm_client import STAGE_CHUNK, get_client
+from app.demo_a.model_routing import StepModel, resolve_model_routing
+from app.demo_a.page_dedup import PageDedup, sub_batch
+from app.demo_a.page_store import PageTextStore
+from app.demo_a.pdf_workers import run_in_pdf_worker
+from app.demo_a.rate_governor import PRIORITY_BACKGROUND, backoff_delay
 from app.demo_a.schemas import BatchChunkResult, SemanticChunk
 
 logger = logging.getLogger(__name__)
@@ -18,14 +22,19 @@ MAX_PDF_RETRIES = 3
 def build_semantic_chunks(
     batch: dict,
     batch_index: int,
+    step: StepModel | None = None,
+    cancel: CancelToken | None = None,
 ) -> BatchChunkResult:
     """20ページPDFバッチをSonnetに見せてセマンティックチャンクを生成。
 
     Args:
         batch: バッチ情報（pdf_bytes, page_start, page_end）
         batch_index: バッチの通し番号（0始まり）
+        step: 使用するモデル設定（Noneならモデルルーティングテーブルの chunk）
+        cancel: 取消トークン（取り消されたら送信中のリクエストを中断する）
     """
     client = get_client()
+    step = step or resolve_model_routing().step(STAGE_CHUNK)
 
     messages = [
         {
@@ -56,24 +65,39 @@ def build_semantic_chunks(
     return client.structured_extract(
         messages=messages,
         output_format=BatchChunkResult,
+        model=step.model,
+        max_tokens=step.max_tokens,
+        priority=PRIORITY_BACKGROUND,
+        stage=STAGE_CHUNK,
+        cancel=cancel,
     )
 
 
-def _build_with_retry(batch: dict, batch_index: int) -> BatchChunkResult:
+def _build_with_retry(
+    batch: dict,
+    batch_index: int,
+    step: StepModel | None = None,
+    cancel: CancelToken | None = None,
+) -> BatchChunkResult:
     """リトライ付きでbuild_semantic_chunksを呼び出す。
 
     Claude APIの一時的なPDF処理エラーに対応するため、
-    MAX_PDF_RETRIES回までリトライする。
+    MAX_PDF_RETRIES回までリトライする。待ち時間はジッター付きにし、
+    並列バッチのリトライが同時刻に集中しないようにする。
+    取り消された場合は送信前・待機中ならその場で、送信中なら中断して OperationCancelledError を送出する。
     """
+    from anthropic import BadRequestError
+
     for attempt in range(MAX_PDF_RETRIES):
+        raise_if_cancelled(cancel)
         try:
-            return build_semantic_chunks(batch, batch_index)
+            return build_semantic_chunks(batch, batch_index, step, cancel)
         except BadRequestError as e:
             if "Could not process PDF" not in str(e) or attempt == MAX_PDF_RETRIES - 1:
                 raise
-            wait = 2 ** attempt
+            wait = backoff_delay(attempt + 1)
             logger.warning(
-                "バッチ %d (p.%d-%d) のPDF処理に失敗（試行 %d/%d）。%d秒後にリトライ: %s",
+                "バッチ %d (p.%d-%d) のPDF処理に失敗（試行 %d/%d）。%.1f秒後にリトライ: %s",
                 batch_index,
                 batch["page_start"],
                 batch["page_end"],
@@ -82,7 +106,7 @@ def _build_with_retry(batch: dict, batch_index: int) -> BatchChunkResult:
                 wait,
                 e,
             )
-            time.sleep(wait)
+            cancellable_sleep(wait, cancel)
     # unreachable, but for type checker
     raise RuntimeError("unreachable")
 
@@ -92,26 +116,33 @@ def _text_fallback_chunks(
     page_start: int,
     page_end: int,
     pages_per_chunk: int = 5,
+    page_store: PageTextStore | None = None,
 ) -> list[SemanticChunk]:
     """PDFバイト列からpymupdfでテキスト抽出し、簡易チャンクを生成する。
 
     Claude APIでPDF処理エラーが発生した場合のフォールバック。
+    page_store があればバッチPDFを再解析せず、ストアからページテキストを読む。
 
     Args:
         pdf_bytes: PDFバイト列
         page_start: バッチの開始ページ番号（1始まり）
         page_end: バッチの終了ページ番号
         pages_per_chunk: 1チャンクあたりのページ数
+        page_store: 元PDFのページテキストストア
     """
-    doc = pymupdf.open(stream=pdf_bytes, filetype="pdf")
-    total_pages = len(doc)
+    if page_store is not None:
+        page_texts = page_store.texts(page_start, page_end)
+    else:
+        page_texts = run_in_pdf_worker(_pdf_page_texts, pdf_bytes)
+
+    total_pages = len(page_texts)
     chunks: list[SemanticChunk] = []
 
     for start in range(0, total_pages, pages_per_chunk):
         end = min(start + pages_per_chunk - 1, total_pages - 1)
         text_parts = []
         for p in range(start, end + 1):
-            page_text = doc[p].get_text().strip()
+            page_text = page_texts[p].strip()
             if page_text:
                 text_parts.append(page_text)
 
@@ -132,8 +163,6 @@ def _text_fallback_chunks(
             )
         )
 
-    doc.close()
-
     # 空の場合でも最低1チャンクを返す
     if not chunks:
         chunks.append(
@@ -149,64 +178,116 @@ def _text_fallback_chunks(
     return chunks
 
 
-def _deduplicate_chunks(
-    all_batch_chunks: list[list[SemanticChunk]],
-    batches: list[dict],
-    overlap: int = 2,
-) -> list[SemanticChunk]:
-    """オーバーラップ部分の重複チャンクを除去し、chunk_idを通し番号で振り直す。
-
-    2番目以降のバッチについて、page_startがオーバーラップ領域内
-    （バッチ開始ページ + overlap未満）のチャンクを除去する。
-
-    Args:
-        all_batch_chunks: バッチごとのチャンクリスト
-        batches: バッチ情報のリスト（page_start必須）
-        overlap: オーバーラップページ数
-    """
-    deduped: list[SemanticChunk] = []
+def _pdf_page_texts(pdf_bytes: bytes) -> list[str]:
+    """PDFバイト列の各ページのテキスト（PDF処理のプロセスプールで実行する）。"""
+    import pymupdf
 
-    for i, chunks in enumerate(all_batch_chunks):
-        if i == 0:
-            deduped.extend(chunks)
-        else:
-            own_start = batches[i]["page_start"] + overlap
-            for chunk in chunks:
-                if chunk.page_start >= own_start:
-                    deduped.append(chunk)
-
-    # chunk_idを通し番号で振り直す
-    for idx, chunk in enumerate(deduped, 1):
-        chunk.chunk_id = f"chunk_{idx:03d}"
-
-    return deduped
+    doc = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+    page_texts = [page.get_text() for page in doc]
+    doc.close()
+    return page_texts
 
 
 def build_document_index(
     batches: list[dict],
-    overlap: int = 2,
-) -> list[SemanticChunk]:
+    page_store: PageTextStore | None = None,
+    step: StepModel | None = None,
+    cancel: CancelToken | None = None,
+    checkpoint: IndexCheckpoint | None = None,
+    fallback_on_error: bool = False,
+    metadata: dict | None = None,
+    dedup: PageDedup | None = None,
+) -> ChunkIndex:
     """全バッチを並列処理してセマンティックチャンクのインデックスを構築。
 
+    checkpoint を渡した場合、保存済みのバッチはAPIを呼ばずに再利用し、
+    残りのバッチは完了するたびに保存する（途中で失敗しても完了分は次回の構築で再利用される）。
+    全バッチをチャンク生成できたら、チェックポイントは消す。
+    dedup を渡した場合、ほかの索引済み文書と一致するページ区間はそのチャンクを再利用し、
+    残りのページだけをAPIに送る。
+
     Args:
         batches: バッチ情報のリスト
-        overlap: オーバーラップページ数（重複排除に使用）
+        page_store: 元PDFのページテキストストア（テキスト抽出フォールバックで使用）
+        step: チャンク生成に使うモデル設定（Noneならモデルルーティングテーブルの chunk）
+        cancel: 取消トークン。取り消されたら未送信のバッチは送信せず、送信中のリクエストは中断する
+        checkpoint: バッチ単位のチェックポイント（Noneなら保存・再利用しない）
+        fallback_on_error: PDF処理エラー以外で失敗したバッチも、構築全体を失敗させずに
+            テキスト抽出フォールバックに切り替えるか
+        metadata: 渡された場合、チェックポイントから再利用したバッチ数を "resumed_batches"、
+            テキスト抽出に切り替えたバッチ番号を "fallback_batches"、
+            ほかの文書からチャンクを再利用したページ数を "dedup_pages" キーに書き込む
+        dedup: ページ重複検出（Noneなら再利用しない）。全バッチを生成できたら、
+            調停済みのチャンクとともにこの文書を以降の構築の再利用元として登録する
 
     Returns:
-        全チャンクのリスト（重複除去・ID振り直し済み）
+        全チャンクの区間インデックス（バッチ境界の重複調停・ID振り直し済み）
+
+    Raises:
+        OperationCancelledError: cancel が取り消された
     """
+    from anthropic import BadRequestError
+
+    step = step or resolve_model_routing().step(STAGE_CHUNK)
     all_batch_chunks: list[list[SemanticChunk] | None] = [None] * len(batches)
+    if checkpoint is not None:
+        for i, batch in enumerate(batches):
+            all_batch_chunks[i] = checkpoint.load(batch)
+    resumed = sum(c is not None for c in all_batch_chunks)
+    if resumed:
+        logger.info("チェックポイントから %d/%d バッチを再利用", resumed, len(batches))
+    fallback_batches: list[int] = []
+
+    dedup_pages: set[int] = set()
+
+    def _run(batch: dict, batch_index: int) -> BatchChunkResult:
+        segments = dedup.plan(batch) if dedup is not None else []
+        if any(s.chunks is not None for s in segments):
+            chunks: list[SemanticChunk] = []
+            for segment in segments:
+                if segment.chunks is not None:
+                    logger.info(
+                        "バッチ %d: p.%d-%d は索引済み文書 %s のチャンクを再利用",
+                        batch_index,
+                        segment.page_start,
+                        segment.page_end,
+                        segment.source,
+                    )
+                    chunks.extend(segment.chunks)
+                    dedup_pages.update(range(segment.page_start, segment.page_end + 1))
+                else:
+                    part = sub_batch(batch, segment.page_start, segment.page_end)
+                    chunks.extend(_build_with_retry(part, batch_index, step, cancel).chunks)
+            result = BatchChunkResult(chunks=sorted(chunks, key=lambda c: (c.page_start, c.page_end)))
+        else:
+            result = _build_with_retry(batch, batch_index, step, cancel)
+        if checkpoint is not None:
+            checkpoint.save(batch, result.chunks)
+        return result
 
     with ThreadPoolExecutor(max_workers=4) as executor:
-        future_to_idx = {executor.submit(_build_with_retry, batch, i): i for i, batch in enumerate(batches)}
+        future_to_idx = {
+            executor.submit(_run, batch, i): i for i, batch in enumerate(batches) if all_batch_chunks[i] is None
+        }
         for future in as_completed(future_to_idx):
             idx = future_to_idx[future]
             batch = batches[idx]
             try:
                 result = future.result()
                 all_batch_chunks[idx] = result.chunks
-            except BadRequestError as e:
-                if "Could not process PDF" in str(e):
+            except OperationCancelledError:
+                # 実行待ちのバッチは開始させない（実行中のものは取消で中断される）
+                for pending in future_to_idx:
+                    pending.cancel()
+                done = sum(c is not None for c in all_batch_chunks)
+                logger.info("インデックス構築を取消（%d/%d バッチ完了）", done, len(batches))
+                raise
+            except Exception as e:
+                pdf_error = isinstance(e, BadRequestError) and "Could not process PDF" in str(e)
+                if not pdf_error and not fallback_on_error:
+                    # 残りのバッチは実行を続け、完了分はチェックポイントに保存される
+                    raise
+                if pdf_error:
                     logger.warning(
                         "バッチ %d (p.%d-%d) のPDF処理に%d回リトライ後も失敗。テキスト抽出にフォールバック: %s",
                         idx,
@@ -215,12 +296,33 @@ def build_document_index(
                         MAX_PDF_RETRIES,
                         e,
                     )
-                    all_batch_chunks[idx] = _text_fallback_chunks(
-                        batch["pdf_bytes"],
+                else:
+                    logger.warning(
+                        "バッチ %d (p.%d-%d) のチャンク生成に失敗。テキスト抽出にフォールバック: %s: %s",
+                        idx,
                         batch["page_start"],
                         batch["page_end"],
+                        type(e).__name__,
+                        e,
                     )
-                else:
-                    raise
-
-    return _deduplicate_chunks(all_batch_chunks, batches, overlap)
+                all_batch_chunks[idx] = _text_fallback_chunks(
+                    batch["pdf_bytes"],
+                    batch["page_start"],
+                    batch["page_end"],
+                    page_store=page_store,
+                )
+                fallback_batches.append(idx)
+
+    if metadata is not None:
+        metadata["resumed_batches"] = resumed
+        metadata["fallback_batches"] = sorted(fallback_batches)
+        metadata["dedup_pages"] = len(dedup_pages)
+
+    index = ChunkIndex(reconcile_batch_chunks(all_batch_chunks, batches))
+    if not fallback_batches:
+        # テキスト抽出に切り替えたバッチがあれば、次回の構築で生成済みのバッチを再利用できるよう残す
+        if dedup is not None:
+            dedup.register(list(index))
+        if checkpoint is not None:
+            checkpoint.clear()
+    return index
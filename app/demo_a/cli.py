@@ -0,0 +1,411 @@
+"""ヘッドレス一括処理CLI（文書 × スキーマ）
+
+Streamlit UIを介さずに、複数文書 × 複数スキーマの抽出をまとめて実行する。
+結果は (文書, スキーマ) ごとに1行のJSONLとして逐次出力する。
+
+使用例:
+    python -m app.demo_a resources/ --preset 引合概要 --preset 契約条件 -o results.jsonl
+    python -m app.demo_a contract.pdf --schema my_schema.json --concurrency 2
+    python -m app.demo_a contract.pdf --preset 引合概要 --model search=claude-sonnet-4-6
+    python -m app.demo_a resources/ -p 引合概要 -p 品目リスト -p 契約条件 --fused -o results.jsonl
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import TextIO
+
+from app.demo_a.converter import TextContent, ensure_pdf
+from app.demo_a.llm_client import load_env
+from app.demo_a.merger import DEFAULT_CONTEXT_TOKEN_BUDGET
+from app.demo_a.model_routing import resolve_model_routing
+from app.demo_a.pipeline import build_index, extract_all, extract_with_schema
+from app.demo_a.presets import get_preset
+
+logger = logging.getLogger(__name__)
+
+# ディレクトリ走査時に対象とする拡張子
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".xlsx", ".xlsm", ".pptx", ".xls"}
+
+# LibreOfficeは同一プロファイルでの同時起動に対応しないため、変換だけは直列化する
+_convert_lock = threading.Lock()
+
+
+def collect_inputs(paths: list[Path]) -> list[Path]:
+    """ファイル/ディレクトリ指定から処理対象ファイルの一覧を作る。
+
+    ディレクトリは再帰的に走査し、SUPPORTED_EXTENSIONS のファイルのみ対象とする。
+    復号時に生成される *_decrypted ファイルは除外する。
+
+    Args:
+        paths: ファイルまたはディレクトリのパス
+
+    Returns:
+        重複を除いたファイルパスのリスト（指定順、ディレクトリ内はパス順）
+    """
+    files: list[Path] = []
+    seen: set[Path] = set()
+    for path in paths:
+        if path.is_dir():
+            candidates = sorted(p for p in path.rglob("*") if p.is_file() and p.suffix.lower() in SUPPORTED_EXTENSIONS)
+        elif path.is_file():
+            candidates = [path]
+        else:
+            raise FileNotFoundError(f"入力が見つかりません: {path}")
+
+        for p in candidates:
+            if p.stem.endswith("_decrypted"):
+                continue
+            resolved = p.resolve()
+            if resolved not in seen:
+                seen.add(resolved)
+                files.append(p)
+    return files
+
+
+def load_schemas(preset_names: list[str], schema_files: list[Path]) -> list[dict]:
+    """プリセット名・スキーマJSONから抽出スキーマの一覧を作る。
+
+    スキーマJSONは以下のいずれかの形式を受け付ける:
+        - フィールド定義のリスト: [{"name", "type", "description"}, ...]
+        - {"name": str, "fields": [...]}
+
+    Returns:
+        list of {"name": str, "fields": list[dict]}
+    """
+    schemas = [{"name": name, "fields": get_preset(name)["fields"]} for name in preset_names]
+    for path in schema_files:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if isinstance(data, list):
+            schemas.append({"name": path.stem, "fields": data})
+        else:
+            schemas.append({"name": data.get("name", path.stem), "fields": data["fields"]})
+    return schemas
+
+
+def process_document(
+    file_path: Path,
+    schemas: list[dict],
+    output_dir: Path,
+    emit: Callable[[dict], None],
+    extract_options: dict | None = None,
+    fused: bool = False,
+) -> bool:
+    """1文書を変換・インデックス構築し、全スキーマで抽出してレコードを出力する。
+
+    インデックスは文書ごとに1回だけ構築し、全スキーマで再利用する。
+    fused=True の場合は全スキーマを extract_all() で一括抽出する。
+
+    Args:
+        file_path: 入力ファイルパス
+        schemas: load_schemas() の戻り値
+        output_dir: PDF変換の出力先
+        emit: 結果レコードを受け取るコールバック
+        extract_options: extract_with_schema に渡す追加オプション
+        fused: 全スキーマで検索・コンテキストを共有して一括抽出するか
+
+    Returns:
+        全スキーマの抽出に成功した場合True
+    """
+    started_at = datetime.now().isoformat(timespec="seconds")
+    timing: dict[str, float] = {}
+
+    def _record(schema: dict, **fields) -> dict:
+        return {
+            "document": str(file_path),
+            "schema": schema["name"],
+            "started_at": started_at,
+            **fields,
+        }
+
+    def _fail_all(stage: str, error: Exception) -> bool:
+        logger.error("%s: %s に失敗: %s", file_path, stage, error)
+        for schema in schemas:
+            emit(_record(schema, status="error", stage=stage, error=str(error), timing=dict(timing)))
+        return False
+
+    # Step 1: PDF変換
+    t0 = time.perf_counter()
+    try:
+        with _convert_lock:
+            pdf_result = ensure_pdf(file_path, output_dir=output_dir)
+    except Exception as e:
+        return _fail_all("convert", e)
+    timing["convert_s"] = round(time.perf_counter() - t0, 3)
+
+    if isinstance(pdf_result, TextContent):
+        return _fail_all("convert", ValueError("テキストファイルはPDFパイプラインに未対応"))
+
+    # Step 2-3: インデックス構築（全スキーマで共有）
+    t0 = time.perf_counter()
+    index_meta: dict = {}
+    try:
+        pdf_path, batches, chunk_index = build_index(
+            pdf_result,
+            1 if fused else len(schemas),
+            metadata=index_meta,
+            models=(extract_options or {}).get("models"),
+        )
+    except Exception as e:
+        return _fail_all("index", e)
+    timing["index_s"] = round(time.perf_counter() - t0, 3)
+
+    doc_info = {
+        "pdf_path": str(pdf_path),
+        "pages": batches[-1]["page_end"],
+        "batches": len(batches),
+        "chunks": len(chunk_index) if chunk_index is not None else None,
+        "route": index_meta.get("route"),
+        "resumed_batches": index_meta.get("resumed_batches"),
+        "fallback_batches": index_meta.get("fallback_batches"),
+        "dedup_pages": index_meta.get("dedup_pages"),
+    }
+
+    # Step 5-9: 全スキーマを一括抽出（検索・コンテキストを共有）
+    if fused and len(schemas) > 1:
+        t0 = time.perf_counter()
+        extract_meta: dict = {}
+        try:
+            all_results = extract_all(
+                pdf_path,
+                batches,
+                chunk_index,
+                schemas,
+                metadata=extract_meta,
+                **(extract_options or {}),
+            )
+        except Exception as e:
+            logger.error("%s: 一括抽出に失敗: %s", file_path, e)
+            timing["extract_s"] = round(time.perf_counter() - t0, 3)
+            for schema in schemas:
+                emit(_record(schema, status="error", stage="extract", error=str(e), **doc_info, timing=dict(timing)))
+            return False
+
+        timing["extract_s"] = round(time.perf_counter() - t0, 3)
+        for schema, results in zip(schemas, all_results):
+            emit(
+                _record(
+                    schema,
+                    status="ok",
+                    **doc_info,
+                    models={**index_meta.get("models", {}), **extract_meta.get("models", {})},
+                    fused_calls=extract_meta.get("fused_calls"),
+                    timing=dict(timing),
+                    values={r["field_name"]: r["value"] for r in results},
+                    results=results,
+                )
+            )
+        return True
+
+    # Step 5-9: スキーマごとに抽出
+    ok = True
+    for schema in schemas:
+        t0 = time.perf_counter()
+        extract_meta: dict = {}
+        try:
+            results = extract_with_schema(
+                pdf_path,
+                batches,
+                chunk_index,
+                schema["fields"],
+                metadata=extract_meta,
+                **(extract_options or {}),
+            )
+        except Exception as e:
+            logger.error("%s × %s: 抽出に失敗: %s", file_path, schema["name"], e)
+            ok = False
+            emit(
+                _record(
+                    schema,
+                    status="error",
+                    stage="extract",
+                    error=str(e),
+                    **doc_info,
+                    timing={**timing, "extract_s": round(time.perf_counter() - t0, 3)},
+                )
+            )
+            continue
+
+        emit(
+            _record(
+                schema,
+                status="ok",
+                **doc_info,
+                models={**index_meta.get("models", {}), **extract_meta.get("models", {})},
+                timing={**timing, "extract_s": round(time.perf_counter() - t0, 3)},
+                values={r["field_name"]: r["value"] for r in results},
+                results=results,
+            )
+        )
+    return ok
+
+
+def run(
+    inputs: list[Path],
+    schemas: list[dict],
+    out: TextIO,
+    concurrency: int = 4,
+    output_dir: Path = Path("output/converted"),
+    extract_options: dict | None = None,
+    fused: bool = False,
+) -> int:
+    """全入力を並列に処理し、JSONLを out に逐次書き出す。
+
+    Args:
+        inputs: 処理対象ファイルのリスト
+        schemas: 抽出スキーマのリスト
+        out: JSONLの出力先
+        concurrency: 同時に処理する文書数
+        output_dir: PDF変換の出力先
+        extract_options: extract_with_schema に渡す追加オプション
+        fused: 全スキーマを一括抽出するか
+
+    Returns:
+        失敗した文書数
+    """
+    write_lock = threading.Lock()
+
+    def emit(record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with write_lock:
+            out.write(line + "\n")
+            out.flush()
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            executor.submit(process_document, path, schemas, output_dir, emit, extract_options, fused): path
+            for path in inputs
+        }
+        for future in as_completed(futures):
+            try:
+                ok = future.result()
+            except Exception:
+                logger.exception("%s の処理中に予期しないエラー", futures[future])
+                ok = False
+            if not ok:
+                failures += 1
+    return failures
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.demo_a",
+        description="文書 × スキーマの構造化抽出を一括実行し、結果をJSONLで出力する",
+    )
+    parser.add_argument("inputs", nargs="+", type=Path, help="入力ファイルまたはディレクトリ")
+    parser.add_argument(
+        "-p",
+        "--preset",
+        action="append",
+        default=[],
+        help="プリセット名（複数指定可）",
+    )
+    parser.add_argument(
+        "-s",
+        "--schema",
+        action="append",
+        default=[],
+        type=Path,
+        help="スキーマ定義JSONファイル（複数指定可）",
+    )
+    parser.add_argument("-o", "--output", type=Path, default=None, help="JSONL出力先（省略時は標準出力）")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同時処理する文書数（デフォルト4）")
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path("output/converted"),
+        help="PDF変換の出力先ディレクトリ",
+    )
+    parser.add_argument(
+        "--context-tokens",
+        type=int,
+        default=DEFAULT_CONTEXT_TOKEN_BUDGET,
+        help=f"大きい文書の抽出コンテキストの入力トークン予算（デフォルト{DEFAULT_CONTEXT_TOKEN_BUDGET}）",
+    )
+    parser.add_argument(
+        "--max-contexts",
+        type=int,
+        default=1,
+        help="大きい文書で関連ページを分割するコンテキスト数の上限（2以上でmap-reduce抽出）",
+    )
+    parser.add_argument(
+        "--no-reconcile",
+        action="store_true",
+        help="map-reduce時、値が食い違ったフィールドをLLMで再判定しない（関連度の高い方を採用）",
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="複数スキーマを一括抽出する（検索・コンテキストを共有し、文書の送信をまとめる）",
+    )
+    parser.add_argument(
+        "--model",
+        action="append",
+        default=[],
+        metavar="STEP=MODEL",
+        help="ステップ別のモデル指定（複数指定可。STEPは chunk / group / search / extract）",
+    )
+    parser.add_argument("--log-level", default="WARNING", help="ログレベル（標準エラー出力）")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    """CLIエントリポイント。全件成功で0、失敗があれば1を返す。"""
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    load_env()
+
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        stream=sys.stderr,
+    )
+
+    if not args.preset and not args.schema:
+        parser.error("--preset または --schema を1つ以上指定してください")
+
+    try:
+        schemas = load_schemas(args.preset, args.schema)
+        inputs = collect_inputs(args.inputs)
+    except (KeyError, FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+
+    if not inputs:
+        parser.error("処理対象のファイルがありません")
+
+    logger.info("文書 %d件 × スキーマ %d件 を処理（並列数 %d）", len(inputs), len(schemas), args.concurrency)
+
+    models = {}
+    for item in args.model:
+        step, sep, model = item.partition("=")
+        if not sep or not model.strip():
+            parser.error(f"--model は STEP=MODEL の形式で指定してください: {item}")
+        models[step.strip()] = model.strip()
+    try:
+        resolve_model_routing(models)
+    except ValueError as e:
+        parser.error(str(e))
+
+    extract_options = {
+        "context_token_budget": args.context_tokens,
+        "max_contexts": args.max_contexts,
+        "reconcile": not args.no_reconcile,
+        "models": models or None,
+    }
+
+    if args.output is None:
+        failures = run(inputs, schemas, sys.stdout, args.concurrency, args.output_dir, extract_options, args.fused)
+    else:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with args.output.open("w", encoding="utf-8") as out:
+            failures = run(inputs, schemas, out, args.concurrency, args.output_dir, extract_options, args.fused)
+
+    return 1 if failures else 0
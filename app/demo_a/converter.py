@@ -5,8 +5,6 @@ import subprocess
 from dataclasses import dataclass
 from pathlib import Path
 
-import msoffcrypto
-
 
 @dataclass
 class TextContent:
@@ -80,6 +78,8 @@ def ensure_pdf(
 
 def _decrypt_if_needed(path: Path, password: str = "scaiagent") -> Path:
     """パスワード保護Excelの復号。保護されていなければそのまま返す。"""
+    import msoffcrypto
+
     with open(path, "rb") as f:
         office_file = msoffcrypto.OfficeFile(f)
         if office_file.is_encrypted():
@@ -0,0 +1,142 @@
+"""オープン済みpymupdf文書のLRUプール
+
+分割・コンテキスト統合・ページテキスト抽出が同じPDFを毎回ディスクから開き直さないよう、
+(パス, 更新時刻, サイズ) をキーにオープン済みの Document を保持する。
+pymupdfの Document はスレッドセーフでないため、borrow() 中は文書ごとのロックを保持する。
+
+borrow_document() を使う処理（分割・コンテキスト切り出し・ページテキスト抽出）は pdf_workers の
+子プロセスで実行されるため、プールも子プロセスごとに持つ（容量 DEMO_A_DOC_POOL_SIZE を子プロセス数で
+分ける）。呼び出し側のプロセスのプールは、プロセスプールを使わない場合にだけ作られる。
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pymupdf
+
+DEFAULT_CAPACITY = 8
+
+
+class _Entry:
+    def __init__(self, doc: "pymupdf.Document") -> None:
+        self.doc = doc
+        self.lock = threading.Lock()
+        self.users = 0
+        self.evicted = False
+
+
+class DocumentPool:
+    """オープン済み文書のLRUプール。
+
+    Args:
+        capacity: 保持する最大文書数（超えたら最も古いものを閉じる）
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.capacity = max(1, capacity)
+        self._entries: OrderedDict[tuple[str, int, int], _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def borrow(self, pdf_path: Path) -> Iterator["pymupdf.Document"]:
+        """文書を借りる。with ブロックの間は他スレッドから同じ文書を操作させない。
+
+        ファイルが更新されていればキーが変わるため、開き直した文書が返る。
+        """
+        import pymupdf  # インポートが重いため初回の借り出し時に読み込む
+
+        stat = pdf_path.stat()
+        key = (str(pdf_path.resolve()), stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                entry.users += 1
+
+        to_close: list[pymupdf.Document] = []
+        if entry is None:
+            # 大きい・遅い文書を開いている間も他の借り手を止めないよう、プールのロックの外で開く
+            doc = pymupdf.open(pdf_path)
+            with self._lock:
+                self.misses += 1
+                entry = self._entries.get(key)
+                if entry is not None:
+                    # 他のスレッドが先に開いて登録した場合はそちらを使い、開いた文書は閉じる
+                    self._entries.move_to_end(key)
+                    to_close.append(doc)
+                else:
+                    entry = _Entry(doc)
+                    self._entries[key] = entry
+                    # 同じパスの古い版と、容量超過分を取り除く
+                    evicted = [self._entries.pop(k) for k in list(self._entries) if k[0] == key[0] and k != key]
+                    while len(self._entries) > self.capacity:
+                        evicted.append(self._entries.popitem(last=False)[1])
+                    for old in evicted:
+                        old.evicted = True
+                        if old.users == 0:
+                            to_close.append(old.doc)
+                entry.users += 1
+
+        # 使用中の文書は閉じず、最後の借り手が返した時点で閉じる
+        for stale in to_close:
+            stale.close()
+
+        try:
+            with entry.lock:
+                yield entry.doc
+        finally:
+            with self._lock:
+                entry.users -= 1
+                close_now = entry.evicted and entry.users == 0
+            if close_now:
+                entry.doc.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            to_close = []
+            for entry in entries:
+                entry.evicted = True
+                if entry.users == 0:
+                    to_close.append(entry)
+        for entry in to_close:
+            entry.doc.close()
+
+
+# シングルトンインスタンス
+_pool: DocumentPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> DocumentPool:
+    """プロセス共有の文書プールを取得する（容量は環境変数 DEMO_A_DOC_POOL_SIZE）。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DocumentPool(int(os.getenv("DEMO_A_DOC_POOL_SIZE", DEFAULT_CAPACITY)))
+        return _pool
+
+
+def set_pool(pool: DocumentPool) -> None:
+    """文書プールを差し替える（PDF処理の子プロセスの初期化・テスト用）。"""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, pool
+    if old is not None and old is not pool:
+        old.clear()
+
+
+def borrow_document(pdf_path: Path):
+    """get_pool().borrow() の短縮形。"""
+    return get_pool().borrow(pdf_path)
@@ -1,14 +1,25 @@
 """Step 8: 構造化抽出（LLM使用）"""
 
+import json
+from collections.abc import Callable
+from typing import Any
+
 from pydantic import BaseModel
 
-from app.demo_a.llm_client import get_client
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.llm_client import STAGE_EXTRACT, get_client
+from app.demo_a.model_routing import StepModel, resolve_model_routing
+from app.demo_a.rate_governor import PRIORITY_INTERACTIVE
+from app.demo_a.schema_builder import build_extraction_schema
 
 
 def extract_structured_data(
     pdf_bytes: bytes,
     field_definitions: list[dict],
     extraction_model: type[BaseModel],
+    on_field: Callable[[str, Any], None] | None = None,
+    step: StepModel | None = None,
+    cancel: CancelToken | None = None,
 ) -> BaseModel:
     """PDFからStructured Outputで構造化抽出。
 
@@ -16,11 +27,16 @@ def extract_structured_data(
         pdf_bytes: PDFのバイト列
         field_definitions: フィールド定義リスト
         extraction_model: 動的生成されたPydanticモデルクラス
+        on_field: 指定した場合はストリーミングで受信し、値が確定したフィールドから
+            (フィールド名, 値) で呼ぶ
+        step: 使用するモデル設定（Noneならモデルルーティングテーブルの extract）
+        cancel: 取消トークン（取り消されたら送信中のリクエストを中断する）
 
     Returns:
         抽出結果のPydanticモデルインスタンス
     """
     client = get_client()
+    step = step or resolve_model_routing().step(STAGE_EXTRACT)
 
     fields_text = "\n".join(f"- {f['name']}: {f['description']}" for f in field_definitions)
 
@@ -42,10 +58,123 @@ def extract_structured_data(
         }
     ]
 
+    if on_field is not None:
+        return client.stream_extract(
+            messages=messages,
+            output_format=extraction_model,
+            on_field=on_field,
+            model=step.model,
+            max_tokens=step.max_tokens,
+            priority=PRIORITY_INTERACTIVE,
+            stage=STAGE_EXTRACT,
+            cancel=cancel,
+        )
+
     return client.structured_extract(
         messages=messages,
         output_format=extraction_model,
+        model=step.model,
+        max_tokens=step.max_tokens,
+        priority=PRIORITY_INTERACTIVE,
+        stage=STAGE_EXTRACT,
+        cancel=cancel,
+    )
+
+
+def _normalize(value):
+    """値の比較用に表記揺れ（空白）を吸収する。"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def reduce_extractions(
+    partials: list[BaseModel],
+    field_definitions: list[dict],
+    extraction_model: type[BaseModel],
+) -> tuple[BaseModel, dict[str, list[tuple[int, object]]]]:
+    """複数コンテキストの抽出結果をフィールドごとに1つにまとめる（map-reduceのreduce）。
+
+    partials は関連度の高いコンテキスト順に並んでいる前提で、各フィールドは
+    最初の非nullの値を採用する。非nullの値が食い違うフィールドは衝突として返す。
+
+    Args:
+        partials: コンテキストごとの抽出結果（関連度順）
+        field_definitions: フィールド定義リスト
+        extraction_model: 動的生成されたPydanticモデルクラス
+
+    Returns:
+        (統合した抽出結果, {フィールド名: [(コンテキスト番号, 値), ...]} の衝突一覧)
+    """
+    values: dict[str, object] = {}
+    conflicts: dict[str, list[tuple[int, object]]] = {}
+    for f in field_definitions:
+        name = f["name"]
+        candidates = [(i, getattr(p, name, None)) for i, p in enumerate(partials)]
+        candidates = [(i, v) for i, v in candidates if v is not None]
+        if not candidates:
+            continue
+        values[name] = candidates[0][1]
+        if len({json.dumps(_normalize(v), ensure_ascii=False) for _, v in candidates}) > 1:
+            conflicts[name] = candidates
+    return extraction_model(**values), conflicts
+
+
+def reconcile_conflicts(
+    conflicts: dict[str, list[tuple[int, object]]],
+    field_definitions: list[dict],
+    context_pages: list[list[tuple[int, int]]],
+    step: StepModel | None = None,
+    cancel: CancelToken | None = None,
+) -> dict[str, object]:
+    """値が食い違ったフィールドだけをLLMに渡し、正しい値を選ばせる。
+
+    文書は再送せず、候補値とその出典ページ範囲だけをテキストで渡す。
+
+    Args:
+        conflicts: reduce_extractions() が返した衝突一覧
+        field_definitions: フィールド定義リスト
+        context_pages: コンテキスト番号ごとの元PDFページ範囲
+        step: 使用するモデル設定（Noneならモデルルーティングテーブルの extract）
+        cancel: 取消トークン（取り消されたら送信中のリクエストを中断する）
+
+    Returns:
+        {フィールド名: 採用値}（LLMがnullを返したフィールドは含まない）
+    """
+    targets = [f for f in field_definitions if f["name"] in conflicts]
+    reconcile_model = build_extraction_schema(targets)
+    client = get_client()
+    step = step or resolve_model_routing().step(STAGE_EXTRACT)
+
+    sections = []
+    for f in targets:
+        lines = [f"### {f['name']}: {f['description']}"]
+        for i, value in conflicts[f["name"]]:
+            pages = ", ".join(f"p.{s}-{e}" if s != e else f"p.{s}" for s, e in context_pages[i])
+            lines.append(f"- 候補{i + 1}（{pages}）: {json.dumps(value, ensure_ascii=False)}")
+        sections.append("\n".join(lines))
+
+    messages = [
+        {
+            "role": "user",
+            "content": (
+                "同じ文書の異なる箇所から抽出した結果、以下の項目で値が食い違いました。\n"
+                "各項目について、契約・取引の条件として最終的に有効な値を候補から1つ選んでください。\n"
+                "判断できない項目は null にしてください。\n\n" + "\n\n".join(sections)
+            ),
+        }
+    ]
+
+    result = client.structured_extract(
+        messages=messages,
+        output_format=reconcile_model,
+        model=step.model,
+        max_tokens=step.max_tokens,
+        priority=PRIORITY_INTERACTIVE,
+        stage=STAGE_EXTRACT,
+        cancel=cancel,
     )
+    return {f["name"]: getattr(result, f["name"]) for f in targets if getattr(result, f["name"], None) is not None}
 
 
 def postprocess_result(
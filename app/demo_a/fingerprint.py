@@ -0,0 +1,43 @@
+"""ファイル内容・スキーマのフィンガープリント（ローカルキャッシュのキー）"""
+
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+# (path, mtime_ns, size) → フィンガープリント。同じファイルを何度もハッシュしない
+_cache: dict[tuple[str, int, int], str] = {}
+_lock = threading.Lock()
+
+
+def file_fingerprint(path: Path) -> str:
+    """ファイル内容のSHA-256（先頭16バイト分の16進）を返す。
+
+    パス・更新時刻・サイズが変わらない限り、プロセス内では再計算しない。
+    """
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    fingerprint = digest.hexdigest()[:32]
+
+    with _lock:
+        _cache[key] = fingerprint
+    return fingerprint
+
+
+def schema_fingerprint(field_definitions: list[dict]) -> str:
+    """フィールド定義リストのフィンガープリント（フィールド順も区別する）。"""
+    canonical = json.dumps(
+        [[f.get("name", ""), f.get("type", ""), f.get("description", "")] for f in field_definitions],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
@@ -1,19 +1,29 @@
 """Step 5: フィールドグルーピング + クエリ生成（LLM使用）"""
 
-from app.demo_a.llm_client import get_client
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.llm_client import STAGE_GROUP, get_client
+from app.demo_a.model_routing import StepModel, resolve_model_routing
+from app.demo_a.rate_governor import PRIORITY_NORMAL
 from app.demo_a.schemas import GroupingResult
 
 
-def group_fields(field_definitions: list[dict]) -> GroupingResult:
+def group_fields(
+    field_definitions: list[dict],
+    step: StepModel | None = None,
+    cancel: CancelToken | None = None,
+) -> GroupingResult:
     """フィールドを意味的にグルーピングし、各グループに検索クエリを生成。
 
     Args:
         field_definitions: [{"name": str, "type": str, "description": str}, ...]
+        step: 使用するモデル設定（Noneならモデルルーティングテーブルの group）
+        cancel: 取消トークン（取り消されたら送信中のリクエストを中断する）
 
     Returns:
         GroupingResult
     """
     client = get_client()
+    step = step or resolve_model_routing().step(STAGE_GROUP)
 
     fields_text = "\n".join(f"- {f['name']}: {f['description']}" for f in field_definitions)
 
@@ -35,4 +45,9 @@ def group_fields(field_definitions: list[dict]) -> GroupingResult:
     return client.structured_extract(
         messages=messages,
         output_format=GroupingResult,
+        model=step.model,
+        max_tokens=step.max_tokens,
+        priority=PRIORITY_NORMAL,
+        stage=STAGE_GROUP,
+        cancel=cancel,
     )
@@ -0,0 +1,117 @@
+"""ヘッジリクエスト用のレイテンシ統計とメトリクス
+
+ステージ（chunk / group / search / extract）ごとに直近のレイテンシを保持し、
+適応的なパーセンタイルを超えた呼び出しにだけ重複リクエスト（ヘッジ）を出す。
+ヘッジ数は呼び出し数に対する比率で上限を設ける。
+"""
+
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+
+# ヘッジ判定に使うパーセンタイル（これを超えて応答がない呼び出しにヘッジを出す）
+DEFAULT_HEDGE_QUANTILE = 0.9
+# 呼び出し数に対するヘッジ数の上限比率
+DEFAULT_MAX_HEDGE_RATIO = 0.1
+# パーセンタイル算出に必要な最小サンプル数（これ未満ならヘッジしない）
+MIN_SAMPLES = 8
+# ステージごとに保持する直近サンプル数
+WINDOW = 200
+
+
+@dataclass
+class _StageStats:
+    latencies: deque = field(default_factory=lambda: deque(maxlen=WINDOW))
+    # 閾値を超えた呼び出しの実レイテンシ（ヘッジで短縮できた時間の推定に使う）
+    tail: deque = field(default_factory=lambda: deque(maxlen=WINDOW))
+    calls: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    saved_seconds: float = 0.0
+
+
+class HedgeTracker:
+    """ステージ別レイテンシ分布とヘッジメトリクス。
+
+    Args:
+        quantile: ヘッジ閾値に使うパーセンタイル（0-1）
+        max_hedge_ratio: 呼び出し数に対するヘッジ数の上限比率
+    """
+
+    def __init__(
+        self,
+        quantile: float = DEFAULT_HEDGE_QUANTILE,
+        max_hedge_ratio: float = DEFAULT_MAX_HEDGE_RATIO,
+    ) -> None:
+        self.quantile = quantile
+        self.max_hedge_ratio = max_hedge_ratio
+        self._stages: dict[str, _StageStats] = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage: str) -> _StageStats:
+        if stage not in self._stages:
+            self._stages[stage] = _StageStats()
+        return self._stages[stage]
+
+    def threshold(self, stage: str) -> float | None:
+        """ステージの現在のヘッジ閾値（秒）。サンプル不足ならNone。"""
+        with self._lock:
+            samples = sorted(self._stage(stage).latencies)
+        if len(samples) < MIN_SAMPLES:
+            return None
+        idx = min(len(samples) - 1, int(self.quantile * len(samples)))
+        return samples[idx]
+
+    def begin_call(self, stage: str) -> None:
+        with self._lock:
+            self._stage(stage).calls += 1
+
+    def try_acquire_hedge(self, stage: str) -> bool:
+        """ヘッジ上限に余裕があればヘッジ数を加算してTrueを返す。"""
+        with self._lock:
+            s = self._stage(stage)
+            if s.hedges + 1 > s.calls * self.max_hedge_ratio:
+                return False
+            s.hedges += 1
+            return True
+
+    def record_latency(self, stage: str, seconds: float, threshold: float | None = None) -> None:
+        """完了した呼び出しのレイテンシを記録する。閾値超えはテール分布にも加える。"""
+        with self._lock:
+            s = self._stage(stage)
+            s.latencies.append(seconds)
+            if threshold is not None and seconds > threshold:
+                s.tail.append(seconds)
+
+    def record_hedge_win(self, stage: str, primary_elapsed: float) -> None:
+        """ヘッジ側が勝った場合に呼ぶ。
+
+        中断したプライマリの本来の完了時刻は分からないため、閾値超え呼び出しの
+        平均レイテンシをプライマリの推定完了時刻とし、その差を短縮時間として積算する。
+        """
+        with self._lock:
+            s = self._stage(stage)
+            s.hedge_wins += 1
+            if s.tail:
+                expected = sum(s.tail) / len(s.tail)
+                s.saved_seconds += max(0.0, expected - primary_elapsed)
+
+    def metrics(self) -> dict[str, dict]:
+        """ステージ別のヘッジメトリクス（チューニング用）。"""
+        with self._lock:
+            stages = {name: (s, sorted(s.latencies)) for name, s in self._stages.items()}
+        result = {}
+        for name, (s, samples) in stages.items():
+            threshold = None
+            if len(samples) >= MIN_SAMPLES:
+                threshold = samples[min(len(samples) - 1, int(self.quantile * len(samples)))]
+            result[name] = {
+                "calls": s.calls,
+                "hedges": s.hedges,
+                "hedge_rate": round(s.hedges / s.calls, 4) if s.calls else 0.0,
+                "hedge_wins": s.hedge_wins,
+                "saved_seconds_est": round(s.saved_seconds, 3),
+                "threshold_seconds": round(threshold, 3) if threshold is not None else None,
+                "p50_seconds": round(samples[len(samples) // 2], 3) if samples else None,
+            }
+        return result
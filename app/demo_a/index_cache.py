@@ -0,0 +1,272 @@
+"""構築済みインデックスのプロセス共有キャッシュと、プリセット文書の事前構築
+
+Step 1（PDF変換）〜 Step 3（チャンク生成）の結果を元ファイルの内容フィンガープリントと
+チャンク生成に使うモデルの組で保持し、
+UIの全セッション・ジョブサーバーで共有する。同じ文書の構築が同時に要求された場合は1回だけ構築し、
+後から来た側は完了を待って同じ結果を使う（待機中も取消トークンで抜けられる）。
+
+保持するのはバッチのPDFバイト列の合計が max_bytes（環境変数 DEMO_A_INDEX_CACHE_BYTES、
+既定 DEFAULT_MAX_BYTES）以下になる分だけで、超えたら最近使われていない文書から捨てる。
+
+prewarm_in_background() は起動時に指定文書（UIのプリセット文書など）を1件ずつ順に構築し、
+あわせてプリセットスキーマのグルーピングを事前計算する。
+UIでは環境変数 DEMO_A_PREWARM=1 のときだけ有効にする。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from app.demo_a.cancellation import CancelToken, OperationCancelledError, raise_if_cancelled
+from app.demo_a.chunk_index import ChunkIndex
+from app.demo_a.converter import TextContent, ensure_pdf
+from app.demo_a.fingerprint import file_fingerprint
+from app.demo_a.llm_client import STAGE_CHUNK
+from app.demo_a.model_routing import ModelRoutingTable, StepModel, resolve_model_routing
+from app.demo_a.pipeline import build_index
+from app.demo_a.schema_registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT_DIR = Path("output/converted")
+
+# 保持するバッチPDFの合計バイト数の既定値
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# 文書ごとの状態
+STATUS_IDLE = "idle"  # 未要求
+STATUS_QUEUED = "queued"  # 事前構築の順番待ち
+STATUS_BUILDING = "building"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+
+@dataclass
+class IndexEntry:
+    """構築済みインデックス。"""
+
+    source_path: Path
+    pdf_path: Path
+    batches: list[dict]
+    chunk_index: ChunkIndex | None
+    metadata: dict = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def size(self) -> int:
+        """保持しているバッチPDFの合計バイト数。"""
+        return sum(len(b["pdf_bytes"]) for b in self.batches)
+
+
+class IndexCache:
+    """元ファイル → 構築済みインデックスのキャッシュ（バイト数上限付きのLRU）。
+
+    LibreOfficeは同一プロファイルでの同時起動に対応しないため、変換はキャッシュ全体で直列化する。
+    上限を超える1文書は、構築した呼び出しには返すが保持しない。
+
+    Args:
+        max_bytes: 保持するバッチPDFの合計バイト数の上限
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, IndexEntry] = OrderedDict()
+        self._bytes = 0
+        self._status: dict[str, str] = {}
+        self._errors: dict[str, str] = {}
+        self._building: set[str] = set()
+        self._cond = threading.Condition()
+        self._convert_lock = threading.Lock()
+
+    def _key(self, file_path: Path, models: ModelRoutingTable | dict[str, str | StepModel] | None = None) -> str:
+        return f"{file_fingerprint(file_path)}.{resolve_model_routing(models).step(STAGE_CHUNK).model}"
+
+    def _wake(self) -> None:
+        """構築完了を待っている get_or_build() に取消を確認させる。"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _store(self, key: str, entry: IndexEntry) -> None:
+        """entry を保持し、上限を超えた分を古い順に捨てる（self._cond 保持中に呼ぶこと）。"""
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            self._status.pop(old_key, None)
+            logger.info("インデックスキャッシュから破棄: %s", old.source_path.name)
+
+    def get(
+        self,
+        file_path: Path,
+        models: ModelRoutingTable | dict[str, str | StepModel] | None = None,
+    ) -> IndexEntry | None:
+        """構築済みなら返す（構築はしない）。"""
+        if not file_path.exists():
+            return None
+        key = self._key(file_path, models)
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def status(self, file_path: Path) -> str:
+        """文書の状態（STATUS_*）。"""
+        if not file_path.exists():
+            return STATUS_IDLE
+        key = self._key(file_path)
+        with self._cond:
+            return self._status.get(key, STATUS_IDLE)
+
+    def error(self, file_path: Path) -> str | None:
+        """構築に失敗した場合のエラーメッセージ。"""
+        if not file_path.exists():
+            return None
+        key = self._key(file_path)
+        with self._cond:
+            return self._errors.get(key)
+
+    def get_or_build(
+        self,
+        file_path: Path,
+        output_dir: Path = DEFAULT_OUTPUT_DIR,
+        expected_schema_runs: int | None = None,
+        models: ModelRoutingTable | dict[str, str | StepModel] | None = None,
+        cancel: CancelToken | None = None,
+    ) -> IndexEntry:
+        """構築済みなら返し、なければ変換・インデックス構築して保持する。
+
+        Args:
+            file_path: 元ファイル
+            output_dir: PDF変換の出力先
+            expected_schema_runs: この文書に対する想定スキーマ実行回数（ルーティング判定用）
+            models: ステップ別モデルの上書き（チャンク生成のモデルはキャッシュのキーに含める）
+            cancel: 取消トークン（構築中・ほかの呼び出しの構築完了待ちのどちらでも有効。
+                この呼び出しの構築が取り消された文書は未要求の状態に戻す）
+
+        Raises:
+            ValueError: テキストファイルなどPDFパイプラインに未対応の形式、または未知のステップ名
+            OperationCancelledError: cancel が取り消された
+        """
+        key = self._key(file_path, models)
+        unregister = cancel.on_cancel(self._wake) if cancel is not None else None
+        try:
+            with self._cond:
+                # ほかの呼び出しが構築中なら完了を待つ（失敗・取消で終わったらこちらで構築する）
+                while key in self._building:
+                    raise_if_cancelled(cancel)
+                    self._cond.wait()
+                raise_if_cancelled(cancel)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry
+                self._building.add(key)
+                self._status[key] = STATUS_BUILDING
+                self._errors.pop(key, None)
+        finally:
+            if unregister is not None:
+                unregister()
+
+        t0 = time.perf_counter()
+        try:
+            with self._convert_lock:
+                pdf_result = ensure_pdf(file_path, output_dir=output_dir)
+            if isinstance(pdf_result, TextContent):
+                raise ValueError("テキストファイルはPDFパイプラインに未対応")
+            metadata: dict = {}
+            pdf_path, batches, chunk_index = build_index(
+                pdf_result, expected_schema_runs, metadata=metadata, models=models, cancel=cancel
+            )
+        except OperationCancelledError:
+            with self._cond:
+                self._building.discard(key)
+                self._status[key] = STATUS_IDLE
+                self._cond.notify_all()
+            raise
+        except BaseException as e:
+            with self._cond:
+                self._building.discard(key)
+                self._status[key] = STATUS_FAILED
+                self._errors[key] = str(e)
+                self._cond.notify_all()
+            raise
+
+        entry = IndexEntry(
+            source_path=file_path,
+            pdf_path=pdf_path,
+            batches=batches,
+            chunk_index=chunk_index,
+            metadata=metadata,
+            seconds=round(time.perf_counter() - t0, 3),
+        )
+        with self._cond:
+            self._building.discard(key)
+            self._status[key] = STATUS_READY
+            self._store(key, entry)
+            self._cond.notify_all()
+        return entry
+
+    def mark_queued(self, file_paths: list[Path]) -> None:
+        """未要求の文書を事前構築の順番待ちにする（状態表示用）。"""
+        keys = [self._key(p) for p in file_paths if p.exists()]
+        with self._cond:
+            for key in keys:
+                if self._status.get(key, STATUS_IDLE) == STATUS_IDLE:
+                    self._status[key] = STATUS_QUEUED
+
+    def prewarm(self, file_paths: list[Path], output_dir: Path = DEFAULT_OUTPUT_DIR) -> None:
+        """file_paths を1件ずつ順に構築する（失敗しても残りは続ける）。"""
+        paths = [p for p in file_paths if p.exists()]
+        self.mark_queued(paths)
+
+        for path in paths:
+            try:
+                entry = self.get_or_build(path, output_dir)
+                logger.info("事前構築完了: %s（%.1f秒）", path.name, entry.seconds)
+            except Exception as e:
+                logger.warning("事前構築に失敗: %s: %s", path.name, e)
+
+
+# シングルトンインスタンス（全セッションで共有）
+_cache: IndexCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_index_cache() -> IndexCache:
+    """プロセス共有のインデックスキャッシュを取得する。"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = IndexCache(int(os.getenv("DEMO_A_INDEX_CACHE_BYTES", DEFAULT_MAX_BYTES)))
+        return _cache
+
+
+def set_index_cache(cache: IndexCache) -> None:
+    """インデックスキャッシュを差し替える（テスト・負荷試験でのキャッシュの破棄用）。"""
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+def prewarm_in_background(file_paths: list[Path], output_dir: Path = DEFAULT_OUTPUT_DIR) -> threading.Thread:
+    """プリセットスキーマのグルーピングと file_paths のインデックスをバックグラウンドで事前構築する。
+
+    1スレッドで順に処理し、チャンク生成のLLM呼び出しはガバナーで最も低い優先度になるため、
+    ユーザーの抽出リクエストを妨げない。
+    """
+
+    def _run() -> None:
+        cache = get_index_cache()
+        cache.mark_queued(file_paths)
+        get_registry().warm_presets()
+        cache.prewarm(file_paths, output_dir)
+
+    thread = threading.Thread(target=_run, name="index-prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,102 @@
+"""チャンク生成（Step 3）のバッチ単位チェックポイント
+
+バッチのチャンク生成が終わるたびに、その結果（調停前のチャンク）を文書ごとのディレクトリに保存する。
+同じ文書・同じチャンク生成モデル・同じクライアントでインデックスを構築し直すと
+（失敗後の再実行・プロセス再起動後など）、保存済みのバッチはAPIを呼ばずに再利用し、未完了のバッチだけを送信する。
+
+    output/index_checkpoints/<PDFのフィンガープリント>.<モデル>.<クライアント識別子>/p0001-0020.json
+
+クライアント識別子（DemoAClient.identity）をキーに含めるため、スタブや擬似APIの応答を実APIの構築で再利用しない。
+バッチはページ範囲で識別する（同じPDFなら同じ範囲は同じ内容）。
+テキスト抽出フォールバックの結果は保存しない（次回の構築でLLMによるチャンク生成をやり直す）。
+構築が完了したら clear() で文書のチェックポイントを消す（再実行のためだけのもので、完了後は不要）。
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from app.demo_a.fingerprint import file_fingerprint
+from app.demo_a.llm_client import get_client
+from app.demo_a.model_routing import StepModel
+from app.demo_a.schemas import SemanticChunk
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = Path(__file__).parent.parent.parent / "output" / "index_checkpoints"
+
+
+class IndexCheckpoint:
+    """1文書 × チャンク生成モデル分のチェックポイント。
+
+    Args:
+        directory: 保存先ディレクトリ
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def _path(self, batch: dict) -> Path:
+        return self.directory / f"p{batch['page_start']:04d}-{batch['page_end']:04d}.json"
+
+    def load(self, batch: dict) -> list[SemanticChunk] | None:
+        """保存済みのバッチのチャンク。未保存・読めない場合はNone。"""
+        path = self._path(batch)
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            return [SemanticChunk.model_validate(c) for c in data["chunks"]]
+        except (ValueError, KeyError) as e:
+            logger.warning("チェックポイントを読めません（バッチを再生成します）: %s: %s", path, e)
+            return None
+
+    def save(self, batch: dict, chunks: list[SemanticChunk]) -> None:
+        """バッチのチャンクを保存する（書き込み途中のファイルを読まないよう置き換えで保存）。"""
+        path = self._path(batch)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(
+            json.dumps(
+                {
+                    "page_start": batch["page_start"],
+                    "page_end": batch["page_end"],
+                    "chunks": [c.model_dump() for c in chunks],
+                },
+                ensure_ascii=False,
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+        tmp.replace(path)
+
+    def clear(self) -> None:
+        """保存済みの全バッチを消す（構築の完了後に呼ぶ）。"""
+        for path in self.directory.glob("p*-*.json"):
+            path.unlink(missing_ok=True)
+        try:
+            self.directory.rmdir()
+        except OSError:
+            # 未作成、または並行する構築が書き込み中
+            pass
+
+
+def open_checkpoint(
+    pdf_path: Path,
+    step: StepModel,
+    checkpoint_dir: Path = CHECKPOINT_DIR,
+    client_id: str | None = None,
+) -> IndexCheckpoint:
+    """PDF・チャンク生成モデル・クライアントに対応するチェックポイントを返す。
+
+    Args:
+        pdf_path: 対象PDF
+        step: チャンク生成のモデル設定
+        checkpoint_dir: 保存先の親ディレクトリ
+        client_id: クライアント識別子（Noneなら get_client().identity）
+    """
+    if client_id is None:
+        client_id = get_client().identity
+    return IndexCheckpoint(checkpoint_dir / f"{file_fingerprint(pdf_path)}.{step.model}.{client_id}")
@@ -0,0 +1,325 @@
+"""優先度付きジョブキュー + ワーカープール（ジョブサーバー用）
+
+インデックス構築と抽出を別のジョブ種別として扱い、以下で対話的な抽出が
+長時間のインデックス構築の後ろで待たされないようにする:
+    - 優先度（小さいほど先）でキューから取り出す。抽出の既定優先度はインデックスより高い
+    - インデックスジョブの同時実行数を max_workers - 1 までに制限し、抽出用に常に1枠空ける
+
+実行中のジョブは job.cancel（CancelToken）をパイプラインに渡しておけば cancel() で中断できる。
+
+終了したジョブは job_ttl 秒保持したあと（または保持数が max_retained_jobs を超えたら古い順に）捨てる。
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+import traceback
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.demo_a.cancellation import CancelToken, OperationCancelledError
+
+logger = logging.getLogger(__name__)
+
+JOB_INDEX = "index"
+JOB_EXTRACT = "extract"
+
+# ジョブ種別ごとの既定優先度（小さいほど先に実行）
+DEFAULT_PRIORITIES = {JOB_EXTRACT: 0, JOB_INDEX: 10}
+
+TERMINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+
+# 終了したジョブを保持する秒数と、保持するジョブ数の上限
+DEFAULT_JOB_TTL = 3600.0
+DEFAULT_MAX_RETAINED_JOBS = 1000
+
+
+@dataclass
+class Job:
+    """キューに投入された1ジョブ。"""
+
+    job_id: str
+    job_type: str
+    params: dict
+    priority: int
+    seq: int
+    depends_on: "Job | None" = None
+    status: str = "queued"  # queued / running / succeeded / failed / cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: Any = None
+    error: str | None = None
+    version: int = 0
+    cancel: CancelToken = field(default_factory=CancelToken, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        data = {
+            "job_id": self.job_id,
+            "type": self.job_type,
+            "status": self.status,
+            "priority": self.priority,
+            "depends_on": self.depends_on.job_id if self.depends_on else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class JobManager:
+    """優先度付きキューと有界ワーカープール。
+
+    Args:
+        handlers: ジョブ種別 → 実行関数（Jobを受け取り、JSON化可能な結果を返す）
+        max_workers: ワーカースレッド数
+        max_index_workers: インデックスジョブの同時実行上限（Noneなら max_workers - 1、最低1）
+        job_ttl: 終了したジョブを保持する秒数（Noneなら期限なし）
+        max_retained_jobs: 保持するジョブ数の上限（超えたら終了が古いジョブから捨てる）
+        on_evict: ジョブを捨てたときに呼ぶ関数（ロック保持中に呼ぶため、すぐに戻ること）
+    """
+
+    def __init__(
+        self,
+        handlers: dict[str, Callable[[Job], Any]],
+        max_workers: int = 4,
+        max_index_workers: int | None = None,
+        job_ttl: float | None = DEFAULT_JOB_TTL,
+        max_retained_jobs: int = DEFAULT_MAX_RETAINED_JOBS,
+        on_evict: Callable[[Job], None] | None = None,
+    ) -> None:
+        self.handlers = handlers
+        self.max_workers = max(1, max_workers)
+        if max_index_workers is None:
+            max_index_workers = max(1, self.max_workers - 1)
+        self.type_limits = {JOB_INDEX: max_index_workers}
+        self.job_ttl = job_ttl
+        self.max_retained_jobs = max(1, max_retained_jobs)
+        self.on_evict = on_evict
+
+        self._jobs: dict[str, Job] = {}
+        self._heap: list[tuple[int, int, Job]] = []
+        self._running: dict[str, int] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.max_workers)
+        ]
+        for w in self._workers:
+            w.start()
+
+    # --- 投入・参照 ---
+
+    def submit(
+        self,
+        job_type: str,
+        params: dict,
+        priority: int | None = None,
+        depends_on: Job | None = None,
+    ) -> Job:
+        """ジョブをキューに投入する。depends_on が完了するまで実行されない。"""
+        if job_type not in self.handlers:
+            raise ValueError(f"未対応のジョブ種別: {job_type}")
+        if priority is None:
+            priority = DEFAULT_PRIORITIES.get(job_type, 5)
+        elif not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError(f"優先度は整数で指定してください: {priority!r}")
+
+        with self._cond:
+            self._prune()
+            job = Job(
+                job_id=uuid.uuid4().hex[:12],
+                job_type=job_type,
+                params=params,
+                priority=priority,
+                seq=next(self._seq),
+                depends_on=depends_on,
+            )
+            # ヒープへの投入が失敗しても、キューに入っていないジョブを登録したままにしない
+            heapq.heappush(self._heap, (job.priority, job.seq, job))
+            self._jobs[job.job_id] = job
+            self._cond.notify_all()
+        logger.info("ジョブ投入: %s (%s, priority=%d)", job.job_id, job_type, priority)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> list[Job]:
+        with self._cond:
+            return sorted(self._jobs.values(), key=lambda j: j.seq)
+
+    def find(self, predicate: Callable[[Job], bool]) -> Job | None:
+        """条件に合う最新のジョブを返す。"""
+        with self._cond:
+            for job in sorted(self._jobs.values(), key=lambda j: j.seq, reverse=True):
+                if predicate(job):
+                    return job
+        return None
+
+    def cancel(self, job_id: str) -> bool:
+        """ジョブを取り消す。完了済みの場合はFalse。
+
+        キュー待ちのジョブはその場で取消済みにし、実行中のジョブは job.cancel を取り消す
+        （ハンドラが OperationCancelledError で終了した時点で取消済みになる）。
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            running = job.status == "running"
+            if not running:
+                self._finish(job, "cancelled", error="キャンセルされました")
+        # 送信中リクエストの中断などのコールバックはロックの外で呼ぶ
+        job.cancel.cancel()
+        logger.info("ジョブ取消: %s（%s）", job.job_id, "実行中" if running else "キュー待ち")
+        return True
+
+    def wait_for_update(self, job: Job, version: int, timeout: float) -> int:
+        """job.version が version から変わるか timeout 秒経過するまで待つ。"""
+        with self._cond:
+            self._cond.wait_for(lambda: job.version != version or self._stopped, timeout=timeout)
+            return job.version
+
+    def stats(self) -> dict:
+        with self._cond:
+            counts: dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "workers": self.max_workers,
+                "type_limits": dict(self.type_limits),
+                "running": dict(self._running),
+                "queued": sum(1 for _, _, j in self._heap if j.status == "queued"),
+                "jobs": counts,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait:
+            for w in self._workers:
+                w.join()
+
+    # --- ワーカー ---
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: str | None = None) -> None:
+        """ジョブを終了状態にする（self._cond 保持中に呼ぶこと）。"""
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.version += 1
+        self._cond.notify_all()
+        self._prune()
+
+    def _prune(self) -> None:
+        """期限切れ・保持数超過の終了済みジョブを捨てる（self._cond 保持中に呼ぶこと）。
+
+        未完了のジョブが依存しているジョブは捨てない。
+        """
+        now = time.time()
+        excess = len(self._jobs) - self.max_retained_jobs
+        if self.job_ttl is None and excess <= 0:
+            return
+        needed = {j.depends_on.job_id for j in self._jobs.values() if not j.done and j.depends_on is not None}
+        for job in sorted((j for j in self._jobs.values() if j.done), key=lambda j: j.finished_at or 0.0):
+            expired = self.job_ttl is not None and now - (job.finished_at or now) > self.job_ttl
+            if not expired and excess <= 0:
+                # 終了時刻順なので、以降のジョブも期限内
+                break
+            if job.job_id in needed:
+                continue
+            del self._jobs[job.job_id]
+            excess -= 1
+            logger.debug("ジョブ破棄: %s", job.job_id)
+            if self.on_evict is not None:
+                self.on_evict(job)
+
+    def _next_runnable(self) -> Job | None:
+        """実行可能なジョブのうち最優先のものをヒープから取り出す（self._cond 保持中）。
+
+        依存ジョブ未完了のもの・種別ごとの同時実行上限に達しているものは飛ばす。
+        """
+        # 取消済みのジョブを先頭から掃除
+        while self._heap and self._heap[0][2].status != "queued":
+            heapq.heappop(self._heap)
+
+        for _, _, job in sorted(self._heap):
+            if job.status != "queued":
+                continue
+            dep = job.depends_on
+            if dep is not None and not dep.done:
+                continue
+            limit = self.type_limits.get(job.job_type)
+            if limit is not None and self._running.get(job.job_type, 0) >= limit:
+                continue
+            self._heap.remove((job.priority, job.seq, job))
+            heapq.heapify(self._heap)
+            return job
+        return None
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopped:
+                    try:
+                        job = self._next_runnable()
+                    except Exception:
+                        # 想定外のエラーでワーカーを終わらせない（少し待って選び直す）
+                        logger.exception("実行するジョブの選択に失敗しました")
+                        job = None
+                        self._cond.wait(timeout=1.0)
+                        continue
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+
+                dep = job.depends_on
+                if dep is not None and dep.status != "succeeded":
+                    self._finish(job, "failed", error=f"依存ジョブ {dep.job_id} が {dep.status}")
+                    continue
+
+                job.status = "running"
+                job.started_at = time.time()
+                job.version += 1
+                self._running[job.job_type] = self._running.get(job.job_type, 0) + 1
+                self._cond.notify_all()
+
+            try:
+                result = self.handlers[job.job_type](job)
+            except OperationCancelledError:
+                with self._cond:
+                    self._running[job.job_type] -= 1
+                    self._finish(job, "cancelled", error="キャンセルされました")
+                continue
+            except Exception as e:
+                logger.error("ジョブ %s が失敗: %s", job.job_id, e)
+                with self._cond:
+                    self._running[job.job_type] -= 1
+                    self._finish(job, "failed", error=f"{type(e).__name__}: {e}")
+                    job.result = {"traceback": traceback.format_exc()}
+                continue
+
+            with self._cond:
+                self._running[job.job_type] -= 1
+                self._finish(job, "succeeded", result=result)
@@ -1,29 +1,140 @@
 """Claude API共通クライアント（デモA用）"""
 
 import base64
+import hashlib
+import logging
 import os
+import queue
+import threading
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any
 
-from anthropic import Anthropic
-from dotenv import load_dotenv
 from pydantic import BaseModel
 
-# .envからAPIキーを読み込み
-load_dotenv()
+from app.demo_a.cancellation import CancelToken, OperationCancelledError, cancellable_sleep, raise_if_cancelled
+from app.demo_a.hedging import HedgeTracker
+from app.demo_a.partial_json import PartialObjectParser
+from app.demo_a.rate_governor import (
+    PRIORITY_NORMAL,
+    RateGovernor,
+    Ticket,
+    backoff_delay,
+    estimate_input_tokens,
+    get_governor,
+)
+
+if TYPE_CHECKING:
+    from anthropic import APIStatusError
+
+logger = logging.getLogger(__name__)
 
 MODEL = "claude-sonnet-4-6"
 
+# パイプラインステップ名（レイテンシ統計・ヘッジの単位）
+STAGE_CHUNK = "chunk"  # Step 3
+STAGE_GROUP = "group"  # Step 5
+STAGE_SEARCH = "search"  # Step 6
+STAGE_EXTRACT = "extract"  # Step 8
+
+# 1呼び出しあたりの最大試行回数（SDK側のリトライは無効化し、ガバナー経由でリトライする）
+MAX_ATTEMPTS = 6
+
+
+_env_loaded = False
+
+
+def load_env() -> None:
+    """.env を環境変数に読み込む（2回目以降は何もしない）。
+
+    インポート時には読み込まない。エントリポイント（CLI・サーバー・UI）と get_client() から呼ぶ。
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    _env_loaded = True
+
+
+def _retry_after(error: "APIStatusError") -> float | None:
+    """retry-after ヘッダ（秒）を取り出す。"""
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Attempt:
+    """1回分の送信。ヘッジで負けた側を別スレッドから中断できるようストリームを保持する。"""
+
+    def __init__(self) -> None:
+        self.stream = None
+        self.aborted = False
+        self._lock = threading.Lock()
+
+    def attach(self, stream) -> None:
+        with self._lock:
+            self.stream = stream
+            if self.aborted:
+                stream.close()
+
+    def abort(self) -> None:
+        with self._lock:
+            self.aborted = True
+            if self.stream is not None:
+                self.stream.close()
+
+
+class _AbortedError(Exception):
+    """ヘッジで負けて中断された送信。"""
+
 
 class DemoAClient:
     """デモA用のClaude APIクライアント。
 
     全LLM呼び出しで messages.parse() + output_format を使用し、
     Structured Output でPydanticモデルを返す。
+    送信はプロセス全体で共有する RateGovernor を経由し、429/529 のリトライもガバナーが調停する
+    （SDK独自のリトライは無効化し、リトライがバーストを増幅しないようにする）。
+
+    hedge を有効にすると、対象ステージの呼び出しが直近レイテンシのパーセンタイルを超えても
+    応答しない場合に重複リクエストを出し、先に返った有効な応答を採用する（負けた側は中断）。
+
+    Args:
+        api_key: APIキー（省略時は環境変数）
+        governor: レート制御（省略時はプロセス共有のもの）
+        hedge: ヘッジを有効にするか（Noneなら環境変数 DEMO_A_HEDGE=1 で有効）
+        hedge_stages: ヘッジ対象ステージ（Noneなら環境変数 DEMO_A_HEDGE_STAGES、既定はchunkのみ）
+        base_url: APIのベースURL（Noneなら環境変数 DEMO_A_API_BASE_URL。負荷試験で擬似APIに向ける場合など）
     """
 
-    def __init__(self, api_key: str | None = None) -> None:
+    def __init__(
+        self,
+        api_key: str | None = None,
+        governor: RateGovernor | None = None,
+        hedge: bool | None = None,
+        hedge_stages: set[str] | None = None,
+        base_url: str | None = None,
+    ) -> None:
+        # anthropic SDKはインポートが重いため、クライアント生成時に初めて読み込む
+        from anthropic import Anthropic
+
         if api_key is None:
             api_key = os.getenv("CLAUDE_API_KEY") or os.getenv("ANTHROPIC_API_KEY", "")
-        self.client = Anthropic(api_key=api_key, max_retries=5)
+        if base_url is None:
+            base_url = os.getenv("DEMO_A_API_BASE_URL") or None
+        self.client = Anthropic(api_key=api_key, base_url=base_url, max_retries=0)
+        self.governor = governor or get_governor()
+
+        if hedge is None:
+            hedge = os.getenv("DEMO_A_HEDGE", "") == "1"
+        if hedge_stages is None:
+            hedge_stages = set(filter(None, os.getenv("DEMO_A_HEDGE_STAGES", STAGE_CHUNK).split(",")))
+        self.hedge = hedge
+        self.hedge_stages = hedge_stages
+        self.hedge_tracker = HedgeTracker()
 
     def structured_extract(
         self,
@@ -32,6 +143,9 @@ class DemoAClient:
         model: str = MODEL,
         temperature: float = 0,
         max_tokens: int = 4096,
+        priority: int = PRIORITY_NORMAL,
+        stage: str | None = None,
+        cancel: CancelToken | None = None,
     ) -> BaseModel:
         """Structured OutputでPydanticモデルを返す。
 
@@ -41,19 +155,258 @@ class DemoAClient:
             model: モデルID
             temperature: 温度（デフォルト0）
             max_tokens: 最大トークン数
+            priority: 送信優先度（rate_governor.PRIORITY_*、小さいほど先）
+            stage: パイプラインステップ名（STAGE_*）。レイテンシ統計・ヘッジの単位
+            cancel: 取り消されたら送信前・待機中なら送信せず、送信中ならリクエストを中断する
 
         Returns:
             パースされたPydanticモデルインスタンス
+
+        Raises:
+            OperationCancelledError: cancel が取り消された
+        """
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": messages,
+            "output_format": output_format,
+        }
+        if stage is None:
+            return self._send(params, priority, cancel=cancel).parsed_output
+
+        self.hedge_tracker.begin_call(stage)
+        if self.hedge and stage in self.hedge_stages:
+            return self._hedged_send(params, priority, stage, cancel).parsed_output
+
+        start = time.monotonic()
+        response = self._send(params, priority, cancel=cancel)
+        self.hedge_tracker.record_latency(stage, time.monotonic() - start)
+        return response.parsed_output
+
+    def stream_extract(
+        self,
+        messages: list[dict],
+        output_format: type[BaseModel],
+        on_field: Callable[[str, Any], None],
+        model: str = MODEL,
+        temperature: float = 0,
+        max_tokens: int = 4096,
+        priority: int = PRIORITY_NORMAL,
+        stage: str | None = None,
+        cancel: CancelToken | None = None,
+    ) -> BaseModel:
+        """structured_extract のストリーミング版。値が確定したフィールドから on_field を呼ぶ。
+
+        応答のJSONを届いた順に増分パースし、トップレベルの各フィールドの値が
+        確定した時点で (フィールド名, 値) を通知する。リトライ時は先頭からやり直すため、
+        同じフィールドが再通知されることがある。ヘッジの対象にはしない。
+
+        Returns:
+            パースされたPydanticモデルインスタンス（最終応答）
         """
-        response = self.client.messages.parse(
-            model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            messages=messages,
-            output_format=output_format,
-        )
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": messages,
+            "output_format": output_format,
+        }
+        parser = PartialObjectParser(on_field)
+        if stage is not None:
+            self.hedge_tracker.begin_call(stage)
+        start = time.monotonic()
+        response = self._send(params, priority, text_listener=parser, cancel=cancel)
+        if stage is not None:
+            self.hedge_tracker.record_latency(stage, time.monotonic() - start)
         return response.parsed_output
 
+    def hedge_metrics(self) -> dict[str, dict]:
+        """ステージ別のレイテンシ・ヘッジ率・短縮時間推定。"""
+        return self.hedge_tracker.metrics()
+
+    @property
+    def identity(self) -> str:
+        """応答の出どころを表す識別子（チェックポイント・重複排除の保存キーに含める）。
+
+        送信先のベースURLから作るため、擬似APIやプロキシの応答が実APIの保存分と混ざらない。
+        """
+        base_url = str(self.client.base_url).rstrip("/")
+        return "url-" + hashlib.sha256(base_url.encode("utf-8")).hexdigest()[:12]
+
+    def _send(
+        self,
+        params: dict,
+        priority: int,
+        attempt_handle: _Attempt | None = None,
+        text_listener: PartialObjectParser | None = None,
+        cancel: CancelToken | None = None,
+    ):
+        """ガバナー経由で1リクエストを送信する（リトライ込み）。
+
+        attempt_handle を渡した場合はストリーミングで送信し、別スレッドから中断できるようにする。
+        text_listener を渡した場合もストリーミングで送信し、応答テキストを届いた順に渡す。
+        cancel を渡した場合もストリーミングで送信し、取り消されたら送信中のリクエストを閉じて
+        OperationCancelledError を送出する（ヘッダ受信前に取り消された場合は受信した時点で閉じる）。
+        """
+        from anthropic import APIConnectionError, APIStatusError
+
+        estimated = estimate_input_tokens(params["messages"])
+
+        if cancel is not None and attempt_handle is None:
+            # 取消時に送信中のリクエストを閉じられるよう、ストリーミングで送信する
+            attempt_handle = _Attempt()
+        unregister = cancel.on_cancel(attempt_handle.abort) if cancel is not None else None
+
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                raise_if_cancelled(cancel)
+                ticket = self.governor.acquire(estimated, priority, cancel)
+                sent = False
+                try:
+                    if attempt_handle is None and text_listener is None:
+                        response = self.client.messages.parse(**params)
+                    else:
+                        if attempt_handle is not None and attempt_handle.aborted:
+                            raise_if_cancelled(cancel)
+                            raise _AbortedError()
+                        sent = True
+                        with self.client.messages.stream(**params) as stream:
+                            if attempt_handle is not None:
+                                attempt_handle.attach(stream)
+                            if text_listener is not None:
+                                text_listener.reset()
+                                for text in stream.text_stream:
+                                    text_listener.feed(text)
+                            else:
+                                stream.until_done()
+                            response = stream.get_final_message()
+                except (APIStatusError, APIConnectionError) as e:
+                    self._settle_failed(ticket, sent, attempt_handle)
+                    status = e.status_code if isinstance(e, APIStatusError) else None
+                    # SDKの既定と同じく 408/409/429/5xx と接続エラーのみリトライ
+                    retryable = status is None or status in (408, 409, 429) or status >= 500
+                    if attempt_handle is not None and attempt_handle.aborted:
+                        raise_if_cancelled(cancel)
+                        raise _AbortedError() from e
+                    if not retryable or attempt == MAX_ATTEMPTS - 1:
+                        raise
+
+                    self.governor.record_retry()
+                    rate_limited = status in (429, 529)
+                    if rate_limited:
+                        # レート超過・過負荷はプロセス全体でクールダウン（次のacquireで待たされる）
+                        delay = self.governor.on_rate_limited(attempt, _retry_after(e))
+                    else:
+                        delay = backoff_delay(attempt)
+                    logger.warning(
+                        "APIエラー（%s）: %.1f秒後にリトライ（試行 %d/%d）",
+                        status or type(e).__name__,
+                        delay,
+                        attempt + 1,
+                        MAX_ATTEMPTS,
+                    )
+                    if not rate_limited:
+                        cancellable_sleep(delay, cancel)
+                    continue
+                except Exception as e:
+                    self._settle_failed(ticket, sent, attempt_handle)
+                    if attempt_handle is not None and attempt_handle.aborted:
+                        raise_if_cancelled(cancel)
+                        raise _AbortedError() from e
+                    raise
+
+                self.governor.settle(ticket, response.usage.input_tokens)
+                self.governor.on_success()
+                return response
+        finally:
+            if unregister is not None:
+                unregister()
+
+        # unreachable, but for type checker
+        raise RuntimeError("unreachable")
+
+    def _settle_failed(self, ticket: Ticket, sent: bool, attempt_handle: _Attempt | None) -> None:
+        """応答を得られなかった送信をガバナーに精算する。
+
+        送信後に中断した（ヘッジで負けた・取り消された）リクエストはAPI側で入力トークンを
+        消費しているため見積もり分を計上し、それ以外（エラー応答・送信前の中断）は返却する。
+        """
+        aborted = sent and attempt_handle is not None and attempt_handle.aborted
+        self.governor.settle(ticket, ticket.estimated_tokens if aborted else None)
+
+    def _hedged_send(self, params: dict, priority: int, stage: str, cancel: CancelToken | None = None):
+        """プライマリが閾値内に返らなければヘッジを出し、先に返った有効な応答を採用する。"""
+        threshold = self.hedge_tracker.threshold(stage)
+        results: queue.Queue = queue.Queue()
+        attempts: list[_Attempt] = []
+        start = time.monotonic()
+
+        def _run(handle: _Attempt, started: float) -> None:
+            try:
+                response = self._send(params, priority, handle, cancel=cancel)
+            except BaseException as e:
+                results.put((handle, None, e, time.monotonic() - started))
+            else:
+                results.put((handle, response, None, time.monotonic() - started))
+
+        def _launch() -> _Attempt:
+            handle = _Attempt()
+            attempts.append(handle)
+            threading.Thread(target=_run, args=(handle, time.monotonic()), daemon=True).start()
+            return handle
+
+        primary = _launch()
+        hedge: _Attempt | None = None
+        # ヘッジの上限・クールダウンで見送ったら以降は閾値で待たない（threshold は記録用に残す）
+        may_hedge = threshold is not None
+        pending = 1
+        errors: list[BaseException] = []
+
+        while pending:
+            # 閾値超過かつヘッジ未発行なら、閾値までだけ待つ
+            timeout = None
+            if hedge is None and may_hedge:
+                timeout = max(0.0, threshold - (time.monotonic() - start))
+            try:
+                handle, response, error, elapsed = results.get(timeout=timeout)
+            except queue.Empty:
+                # レート制限のクールダウン中は重複送信で悪化させない
+                if not self.governor.cooling_down and self.hedge_tracker.try_acquire_hedge(stage):
+                    logger.info("[hedge] %s: %.1f秒応答なし。ヘッジリクエストを送信", stage, threshold)
+                    hedge = _launch()
+                    pending += 1
+                else:
+                    may_hedge = False
+                continue
+
+            pending -= 1
+            if isinstance(error, OperationCancelledError):
+                for other in attempts:
+                    other.abort()
+                raise error
+            valid = error is None and response.parsed_output is not None
+            if not valid:
+                if error is not None and not isinstance(error, _AbortedError):
+                    errors.append(error)
+                continue
+
+            for other in attempts:
+                if other is not handle:
+                    other.abort()
+            if handle is primary:
+                self.hedge_tracker.record_latency(stage, elapsed, threshold)
+            else:
+                # 呼び出し元から見たレイテンシ（プライマリの送信から）を記録する
+                total = time.monotonic() - start
+                self.hedge_tracker.record_hedge_win(stage, total)
+                self.hedge_tracker.record_latency(stage, total)
+            return response
+
+        if errors:
+            raise errors[0]
+        raise ValueError("Structured Outputの応答をパースできませんでした")
+
     @staticmethod
     def build_pdf_content_block(pdf_bytes: bytes) -> dict:
         """PDFバイト列からClaude APIのdocumentコンテンツブロックを構築する。"""
@@ -69,17 +422,21 @@ class DemoAClient:
 
 # シングルトンインスタンス
 _client: DemoAClient | None = None
+_client_lock = threading.Lock()
 
 
 def get_client() -> DemoAClient:
-    """グローバルクライアントインスタンスを取得する。"""
+    """グローバルクライアントインスタンスを取得する（初回呼び出し時に生成）。"""
     global _client
-    if _client is None:
-        _client = DemoAClient()
-    return _client
+    with _client_lock:
+        if _client is None:
+            load_env()
+            _client = DemoAClient()
+        return _client
 
 
 def set_client(client: DemoAClient) -> None:
     """テスト用: クライアントを差し替える。"""
     global _client
-    _client = client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,254 @@
+"""負荷試験ドライバ（擬似APIに対して build_index + extract_with_schema を並列実行する）
+
+1インスタンスが捌ける同時ユーザー数・文書数の見積もり用。実APIは使わず、
+mock_api の擬似 Anthropic API にクライアントのベースURLだけを向けて実行する
+（--base-url を省略すると同じプロセス内で擬似APIを起動する）。
+
+報告する値:
+    - スループット（ワークロード/分、APIリクエスト/秒）
+    - ワークロード（インデックス構築・抽出・合計）のレイテンシ p50 / p90 / p99
+    - ステップ別のAPI呼び出しレイテンシ、リトライ数、擬似APIが注入したエラー数
+    - プロセスのメモリ（RSSの開始時・ピーク・終了時）
+
+使用例:
+    python -m app.demo_a.loadtest contract.pdf --users 8 --workloads 32 --preset 引合概要 \\
+        --latency lognormal:1.5:0.5 --stage-latency chunk=lognormal:8:0.4 --rate-429 0.05
+    python -m app.demo_a.loadtest contract.pdf --users 16 --base-url http://127.0.0.1:8780 --rpm 0 --tpm 0
+
+同一プロセスで擬似APIを起動した場合、擬似API側のスレッドもCPU・メモリを使う点に注意。
+
+計測が以前の実行の結果に左右されないよう、ログ・ページテキストストア・グルーピング結果は
+一時ディレクトリ（実行後に削除）に書き、チェックポイントとページ重複の再利用は使わない（resume=False）。
+実行中は、ページテキストは同じPDFのワークロード間で、グルーピングは全ワークロードで共有する
+（サーバーと同じく文書・スキーマ単位で1回だけ計算される）。チャンク生成は毎回行う。
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.demo_a import page_store, pipeline
+from app.demo_a.llm_client import DemoAClient, load_env, set_client
+from app.demo_a.mock_api import add_mock_arguments, mock_config_from_args, start_mock_api
+from app.demo_a.pipeline import build_index, extract_with_schema
+from app.demo_a.presets import get_preset
+from app.demo_a.rate_governor import get_governor
+from app.demo_a.schema_registry import SchemaRegistry, get_registry, set_registry
+
+logger = logging.getLogger(__name__)
+
+# RSSを記録する間隔（秒）
+_RSS_SAMPLE_INTERVAL = 0.2
+
+
+def percentiles(values: list[float], points: tuple[float, ...] = (0.5, 0.9, 0.99)) -> dict[str, float | None]:
+    """最近傍順位法のパーセンタイル。"""
+    ordered = sorted(values)
+    result = {}
+    for q in points:
+        key = f"p{round(q * 100):d}"
+        if not ordered:
+            result[key] = None
+            continue
+        idx = min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))
+        result[key] = round(ordered[idx], 3)
+    return result
+
+
+def _rss_mb() -> float | None:
+    """現在のRSS（MB）。/proc がない環境ではNone。"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return round(pages * resource.getpagesize() / 2**20, 1)
+
+
+class _RssSampler:
+    """実行中のRSSを定期的に記録し、ピークを求める。"""
+
+    def __init__(self) -> None:
+        self.start = _rss_mb()
+        self.peak = self.start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-rss", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(_RSS_SAMPLE_INTERVAL):
+            rss = _rss_mb()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        end = _rss_mb()
+        max_rss = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return {"rss_start_mb": self.start, "rss_peak_mb": self.peak, "rss_end_mb": end, "max_rss_mb": max_rss}
+
+
+@contextmanager
+def _isolated_caches() -> Iterator[Path]:
+    """ログ・ページテキストストア・グルーピング結果を一時ディレクトリに向ける（終了時に元に戻して削除する）。"""
+    logs_dir, store_dir, registry = pipeline.LOGS_DIR, page_store.STORE_DIR, get_registry()
+    with tempfile.TemporaryDirectory(prefix="demo_a_loadtest_") as tmp:
+        work_dir = Path(tmp)
+        pipeline.LOGS_DIR = work_dir / "logs"
+        page_store.STORE_DIR = work_dir / "page_text"
+        page_store.clear_page_stores()
+        set_registry(SchemaRegistry(work_dir / "schema_registry"))
+        try:
+            yield work_dir
+        finally:
+            # 一時ディレクトリのストアをプロセス内に残さない
+            page_store.clear_page_stores()
+            pipeline.LOGS_DIR, page_store.STORE_DIR = logs_dir, store_dir
+            set_registry(registry)
+
+
+def _run_workload(pdf_path: Path, fields: list[dict]) -> dict:
+    """1ワークロード（インデックス構築 → 抽出）。チェックポイント・ページ重複の再利用は使わない。"""
+    t0 = time.perf_counter()
+    record: dict = {"ok": False}
+    try:
+        pdf_path, batches, chunk_index = build_index(pdf_path, resume=False)
+        record["index_s"] = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        extract_with_schema(pdf_path, batches, chunk_index, fields)
+        record["extract_s"] = time.perf_counter() - t1
+        record["ok"] = True
+    except Exception as e:
+        logger.warning("ワークロード失敗: %s: %s", pdf_path.name, e)
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["total_s"] = time.perf_counter() - t0
+    return record
+
+
+def run_load(
+    pdf_paths: list[Path],
+    fields: list[dict],
+    users: int,
+    workloads: int,
+    client: DemoAClient,
+) -> dict:
+    """users 並列で workloads 件のワークロードを実行し、計測結果を返す。
+
+    pdf_paths は順に繰り返して割り当てる。ディスク上のキャッシュは実行ごとの一時ディレクトリを使う。
+    """
+    set_client(client)
+    governor = get_governor()
+    retries_before = governor.stats()["retries"]
+
+    with _isolated_caches():
+        sampler = _RssSampler()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            records = list(
+                executor.map(lambda i: _run_workload(pdf_paths[i % len(pdf_paths)], fields), range(workloads))
+            )
+        wall = time.perf_counter() - t0
+        memory = sampler.stop()
+
+    ok = [r for r in records if r["ok"]]
+    errors: dict[str, int] = {}
+    for r in records:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    return {
+        "users": users,
+        "workloads": workloads,
+        "succeeded": len(ok),
+        "failed": len(records) - len(ok),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "workloads_per_minute": round(len(ok) / wall * 60, 2) if wall else None,
+        "latency": {
+            "index_s": percentiles([r["index_s"] for r in ok]),
+            "extract_s": percentiles([r["extract_s"] for r in ok]),
+            "total_s": percentiles([r["total_s"] for r in ok]),
+        },
+        "api_stages": client.hedge_metrics(),
+        "retries": governor.stats()["retries"] - retries_before,
+        "governor": governor.stats(),
+        "memory": memory,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.demo_a.loadtest", description="擬似APIに対する負荷試験")
+    parser.add_argument("pdfs", nargs="+", type=Path, help="ワークロードに使うPDF（順に繰り返して割り当てる）")
+    parser.add_argument("-u", "--users", type=int, default=4, help="同時実行数（デフォルト4）")
+    parser.add_argument("-n", "--workloads", type=int, default=None, help="ワークロード総数（デフォルトは users × 2）")
+    parser.add_argument("-p", "--preset", default="引合概要", help="抽出に使うプリセット")
+    parser.add_argument("--base-url", default=None, help="起動済みの擬似APIのURL（省略時は同一プロセスで起動）")
+    parser.add_argument("--rpm", type=int, default=None, help="ガバナーのRPM（0で無制限。省略時は環境変数・既定値）")
+    parser.add_argument("--tpm", type=int, default=None, help="ガバナーのTPM（0で無制限。省略時は環境変数・既定値）")
+    parser.add_argument("--hedge", action="store_true", help="ヘッジリクエストを有効にする")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="結果JSONの出力先（省略時は標準出力）")
+    add_mock_arguments(parser)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    load_env()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    for path in args.pdfs:
+        if not path.is_file():
+            parser.error(f"ファイルが見つかりません: {path}")
+    try:
+        fields = get_preset(args.preset)["fields"]
+    except KeyError as e:
+        parser.error(str(e))
+
+    # ガバナーは初回の get_governor() で環境変数から作られる
+    if args.rpm is not None:
+        os.environ["DEMO_A_RPM"] = str(args.rpm)
+    if args.tpm is not None:
+        os.environ["DEMO_A_TPM"] = str(args.tpm)
+
+    server, api, base_url = None, None, args.base_url
+    if base_url is None:
+        server, api, base_url = start_mock_api(mock_config_from_args(parser, args))
+        logger.info("擬似APIを起動: %s", base_url)
+
+    client = DemoAClient(api_key="mock", base_url=base_url, hedge=args.hedge)
+    try:
+        report = run_load(args.pdfs, fields, args.users, args.workloads or args.users * 2, client)
+        report["base_url"] = base_url
+        if api is not None:
+            report["mock"] = api.stats()
+            report["requests_per_second"] = round(report["mock"]["requests"] / report["wall_seconds"], 2)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(text, encoding="utf-8")
+    print(
+        f"{report['succeeded']}/{report['workloads']} 成功, {report['wall_seconds']}秒, "
+        f"{report['workloads_per_minute']} ワークロード/分, 合計 p50={report['latency']['total_s']['p50']}秒 "
+        f"p99={report['latency']['total_s']['p99']}秒, リトライ {report['retries']}回, "
+        f"RSSピーク {report['memory']['rss_peak_mb']}MB",
+        file=sys.stderr,
+    )
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,36 @@
 """Step 7: コンテキスト統合（関連チャンク→PDFページ切出し）"""
 
+from collections.abc import Callable
+from dataclasses import dataclass, field
 from pathlib import Path
 
-import pymupdf
+from app.demo_a.chunk_index import ChunkIndex
+from app.demo_a.doc_pool import borrow_document
+from app.demo_a.page_store import get_page_store
+from app.demo_a.pdf_workers import run_in_pdf_worker
+from app.demo_a.schemas import ChunkHit
 
-from app.demo_a.schemas import SemanticChunk
+# コンテキストPDFの入力トークン予算（抽出プロンプト・出力分の余裕を残す）
+DEFAULT_CONTEXT_TOKEN_BUDGET = 120_000
+
+
+@dataclass
+class ExtractionContext:
+    """抽出用コンテキストPDFとページの出どころ。"""
+
+    pdf_bytes: bytes
+    page_count: int
+    page_map: list[int]  # コンテキストのページ（0始まりの添字）→ 元PDFのページ番号（1始まり）
+    estimated_tokens: int = 0
+    chunk_ids: list[str] = field(default_factory=list)  # 採用したチャンク（関連度順）
+
+    def source_page(self, context_page: int) -> int:
+        """コンテキストPDFのページ番号（1始まり）に対応する元PDFのページ番号。"""
+        return self.page_map[context_page - 1]
+
+    def source_ranges(self) -> list[tuple[int, int]]:
+        """page_map を元PDFの連続ページ範囲にまとめたもの（ログ用）。"""
+        return _merge_page_ranges([(p, p) for p in self.page_map])
 
 
 def _merge_page_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
@@ -24,59 +50,173 @@ def _merge_page_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
     return merged
 
 
+def _pack_hits(
+    hits: list[ChunkHit],
+    page_cost: Callable[[int], int],
+    total_pages: int,
+    token_budget: int,
+    max_pages: int,
+    in_order: bool = False,
+) -> tuple[list[ChunkHit], set[int], int]:
+    """関連度の高いチャンクから順に、トークン予算内でページを選ぶ。
+
+    既に選ばれたページと重なる部分のコストは二重に数えない。
+    予算に収まらないチャンクは飛ばし、より小さいチャンクで残り予算を埋める。
+    in_order=True の場合は与えられた順に詰め、最初に収まらなくなった所で止める。
+
+    Returns:
+        (採用したヒット, 選ばれたページ番号の集合, 見積もりトークン数)
+    """
+    ordered = hits if in_order else sorted(hits, key=lambda h: (-h.score, h.chunk.page_start))
+    packed: list[ChunkHit] = []
+    selected: set[int] = set()
+    used_tokens = 0
+
+    for hit in ordered:
+        new_pages = [
+            p for p in range(hit.chunk.page_start, min(hit.chunk.page_end, total_pages) + 1) if p not in selected
+        ]
+        cost = sum(page_cost(p) for p in new_pages)
+        if used_tokens + cost > token_budget or len(selected) + len(new_pages) > max_pages:
+            if in_order:
+                break
+            continue
+        selected.update(new_pages)
+        used_tokens += cost
+        packed.append(hit)
+
+    return packed, selected, used_tokens
+
+
 def build_extraction_context(
-    relevant_chunks: list[SemanticChunk],
+    hits: list[ChunkHit],
     pdf_path: Path,
+    token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
     max_pages: int = 100,
-) -> bytes:
+    chunk_index: ChunkIndex | None = None,
+) -> ExtractionContext:
     """関連チャンクからPDFのページを統合して抽出用コンテキストを構築。
 
-    searcher.pyがIDではなくSemanticChunkを返すため、chunk_mapルックアップは不要。
+    関連度スコアの高いチャンクから、ページテキストから見積もったトークンコストで
+    予算内に詰める（重複ページは1回だけ計上）。選ばれたページは文書順に並べる。
+    元PDFは文書プールから借り、出力PDFのページ数とページ対応表も同時に返す。
 
     Args:
-        relevant_chunks: high/mediumと評価されたSemanticChunkのリスト
+        hits: 検索でヒットしたチャンクと関連度スコア
         pdf_path: 元PDFファイルパス
-        max_pages: 最大ページ数
+        token_budget: コンテキストの入力トークン予算
+        max_pages: 最大ページ数（APIのPDFページ数上限）
+        chunk_index: チャンクインデックス（フォールバック時にセクション単位でページを選ぶのに使用）
 
     Returns:
-        統合されたPDFのバイト列（チャンクが0件の場合は全文PDFを返す）
+        統合されたコンテキスト（収まるチャンクがない場合は先頭から予算内のページ）
     """
-    # ページ範囲を収集（max_pages以内に収める）
-    page_ranges: list[tuple[int, int]] = []
-    total_pages = 0
-    for chunk in relevant_chunks:
-        pages = chunk.page_end - chunk.page_start + 1
-        if total_pages + pages <= max_pages:
-            page_ranges.append((chunk.page_start, chunk.page_end))
-            total_pages += pages
-
-    # チャンクが0件 or 全件がmax_pagesを超えた場合は先頭max_pagesページにフォールバック
-    if not page_ranges:
-        doc = pymupdf.open(pdf_path)
-        total = len(doc)
-        out_doc = pymupdf.open()
-        out_doc.insert_pdf(doc, from_page=0, to_page=min(max_pages, total) - 1)
-        pdf_bytes = out_doc.tobytes()
-        out_doc.close()
-        doc.close()
-        return pdf_bytes
+    store = get_page_store(pdf_path)
+    total = len(store)
+
+    packed, selected, used_tokens = _pack_hits(hits, store.estimated_tokens, total, token_budget, max_pages)
+
+    # チャンクが0件 or 全件が予算を超えた場合は先頭から予算内のページにフォールバック
+    # （インデックスがあればセクションの途中で切らないよう、先頭のチャンクから順に詰める）
+    if not selected and chunk_index is not None:
+        leading = [ChunkHit(chunk=c, relevance="fallback", score=0.0) for c in chunk_index]
+        packed, selected, used_tokens = _pack_hits(
+            leading, store.estimated_tokens, total, token_budget, max_pages, in_order=True
+        )
+    if not selected:
+        for p in range(1, min(max_pages, total) + 1):
+            cost = store.estimated_tokens(p)
+            if selected and used_tokens + cost > token_budget:
+                break
+            selected.add(p)
+            used_tokens += cost
+
+    return _cut_context(pdf_path, selected, used_tokens, packed, total)
+
+
+def build_extraction_contexts(
+    hits: list[ChunkHit],
+    pdf_path: Path,
+    token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    max_pages: int = 100,
+    max_contexts: int = 4,
+    chunk_index: ChunkIndex | None = None,
+) -> list[ExtractionContext]:
+    """関連チャンクを複数のコンテキストPDFに分割する（map-reduce抽出用）。
 
-    # マージ・重複排除
-    merged = _merge_page_ranges(page_ranges)
+    1つ目は build_extraction_context と同じ詰め方で作り、収まらなかったチャンクで
+    2つ目以降を作る。先行コンテキストのページに完全に含まれるチャンクは繰り返さない。
+    各コンテキストは関連度の高い順に並ぶ。
 
-    # 元PDFから該当ページを切り出し
-    doc = pymupdf.open(pdf_path)
-    out_doc = pymupdf.open()
-    for start, end in merged:
-        out_doc.insert_pdf(doc, from_page=start - 1, to_page=end - 1)
+    Args:
+        hits: 検索でヒットしたチャンクと関連度スコア
+        pdf_path: 元PDFファイルパス
+        token_budget: コンテキスト1つあたりの入力トークン予算
+        max_pages: コンテキスト1つあたりの最大ページ数
+        max_contexts: 作成するコンテキストの最大数
+        chunk_index: チャンクインデックス（build_extraction_context のフォールバック用）
 
-    if len(out_doc) == 0:
+    Returns:
+        コンテキストのリスト（1件以上）
+    """
+    store = get_page_store(pdf_path)
+    total = len(store)
+
+    contexts = [build_extraction_context(hits, pdf_path, token_budget, max_pages, chunk_index)]
+    covered = set(contexts[0].page_map)
+    remaining = [h for h in hits if h.chunk.chunk_id not in set(contexts[0].chunk_ids)]
+
+    while remaining and len(contexts) < max_contexts:
+        remaining = [
+            h
+            for h in remaining
+            if any(p not in covered for p in range(h.chunk.page_start, min(h.chunk.page_end, total) + 1))
+        ]
+        packed, selected, used_tokens = _pack_hits(remaining, store.estimated_tokens, total, token_budget, max_pages)
+        if not packed:
+            # 残りはどれも単独で予算を超える
+            break
+        contexts.append(_cut_context(pdf_path, selected, used_tokens, packed, total))
+        covered |= selected
+        packed_ids = {h.chunk.chunk_id for h in packed}
+        remaining = [h for h in remaining if h.chunk.chunk_id not in packed_ids]
+
+    return contexts
+
+
+def _cut_context(
+    pdf_path: Path,
+    selected: set[int],
+    used_tokens: int,
+    packed: list[ChunkHit],
+    total: int,
+) -> ExtractionContext:
+    """選ばれたページを元PDFから文書順に切り出す。"""
+    merged = _merge_page_ranges([(p, p) for p in selected])
+    page_map = [p for start, end in merged for p in range(start, end + 1)]
+
+    # 元PDFから該当ページを切り出し（PDF処理のプロセスプールで行う）
+    if not page_map:
+        return ExtractionContext(pdf_path.read_bytes(), total, list(range(1, total + 1)))
+    pdf_bytes = run_in_pdf_worker(_cut_pages, pdf_path, merged)
+
+    return ExtractionContext(
+        pdf_bytes,
+        len(page_map),
+        page_map,
+        estimated_tokens=used_tokens,
+        chunk_ids=[h.chunk.chunk_id for h in packed],
+    )
+
+
+def _cut_pages(pdf_path: Path, ranges: list[tuple[int, int]]) -> bytes:
+    """元PDFの ranges（1始まり・両端含む）のページを順に並べたPDFのバイト列。"""
+    import pymupdf
+
+    with borrow_document(pdf_path) as doc:
+        out_doc = pymupdf.open()
+        for start, end in ranges:
+            out_doc.insert_pdf(doc, from_page=start - 1, to_page=end - 1)
+        pdf_bytes = out_doc.tobytes()
         out_doc.close()
-        doc.close()
-        return pdf_path.read_bytes()
-
-    pdf_bytes = out_doc.tobytes()
-    out_doc.close()
-    doc.close()
-
     return pdf_bytes
@@ -0,0 +1,412 @@
+"""ローカルの擬似 Anthropic Messages API（負荷試験用）
+
+DemoAClient が使う POST /v1/messages の形を実装する:
+    - output_config.format（JSON Schema）による Structured Output。応答本文はスキーマに合うJSON
+    - PDFの document ブロック（base64）を含むリクエスト
+    - stream=true の SSE（ヘッジ・ストリーミング抽出で使用）
+応答の中身は StubClient と同じ規則で組み立てる（チャンク生成はプロンプト中のページ範囲から、
+検索はプロンプト中のチャンク一覧の [番号] から作るため、パイプラインを最後まで通せる）。
+
+レイテンシは分布で指定し、ステップ（スキーマのtitleから判定）ごとに変えられる。
+429（rate_limit_error）・529（overloaded_error）と、PDFを含むリクエストへの
+400 "Could not process PDF" を指定した確率で返す。
+
+レイテンシ分布の指定:
+    fixed:秒 / uniform:最小:最大 / lognormal:中央値:sigma / exp:平均
+
+起動例:
+    python -m app.demo_a.mock_api --port 8780 --latency lognormal:1.5:0.5 --stage-latency chunk=lognormal:8:0.4 \\
+        --rate-429 0.05 --rate-529 0.02 --pdf-error 0.02
+クライアントはベースURLの設定だけで向ける:
+    DEMO_A_API_BASE_URL=http://127.0.0.1:8780 python -m app.demo_a ...
+GET /stats でリクエスト数・注入したエラー数を返す。
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.demo_a.rate_governor import estimate_input_tokens
+from app.demo_a.schemas import BatchChunkResult, ChunkSearchResult, GroupingResult
+from app.demo_a.stub_client import StubClient
+
+logger = logging.getLogger(__name__)
+
+# スキーマのtitle → ステップ名（llm_client.STAGE_* と同じ名前）。それ以外は抽出
+_KNOWN_FORMATS = {
+    "BatchChunkResult": ("chunk", BatchChunkResult),
+    "GroupingResult": ("group", GroupingResult),
+    "ChunkSearchResult": ("search", ChunkSearchResult),
+}
+KIND_EXTRACT = "extract"
+
+# SSEで1イベントに載せる文字数
+_STREAM_DELTA_CHARS = 24
+
+
+@dataclass(frozen=True)
+class LatencySpec:
+    """レイテンシ分布（秒）。"""
+
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, text: str) -> "LatencySpec":
+        """遅延の指定（例: "lognormal:1.5:0.5"）を読む。
+
+        Raises:
+            ValueError: 形式が不正
+        """
+        name, *args = text.split(":")
+        try:
+            values = [float(v) for v in args]
+        except ValueError as e:
+            raise ValueError(f"レイテンシ分布の指定が不正です: {text}") from e
+        arity = {"fixed": 1, "uniform": 2, "lognormal": 2, "exp": 1}
+        if name not in arity or len(values) != arity[name]:
+            raise ValueError(
+                f"レイテンシ分布の指定が不正です: {text}"
+                "（fixed:秒 / uniform:最小:最大 / lognormal:中央値:sigma / exp:平均）"
+            )
+        return cls(name, *values)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(max(self.a, 1e-6)), self.b)
+        if self.kind == "exp":
+            return rng.expovariate(1.0 / self.a) if self.a > 0 else 0.0
+        return self.a
+
+
+@dataclass
+class MockConfig:
+    """擬似APIの挙動。"""
+
+    latency: LatencySpec = field(default_factory=LatencySpec)
+    stage_latency: dict[str, LatencySpec] = field(default_factory=dict)
+    rate_429: float = 0.0
+    rate_529: float = 0.0
+    pdf_error_rate: float = 0.0
+    retry_after: float = 1.0
+    # エラー応答までの時間（正常応答のレイテンシに対する比率）
+    error_latency_ratio: float = 0.1
+    pages_per_chunk: int = 5
+    seed: int | None = None
+
+
+class MockAnthropicAPI:
+    """擬似APIの応答生成と統計。HTTPハンドラから呼ばれる（スレッドセーフ）。"""
+
+    def __init__(self, config: MockConfig | None = None) -> None:
+        self.config = config or MockConfig()
+        self._rng = random.Random(self.config.seed)
+        self._stub = StubClient(pages_per_chunk=self.config.pages_per_chunk)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {
+                "requests": 0,
+                "streamed": 0,
+                "by_kind": {},
+                "injected": {"429": 0, "529": 0, "pdf_error": 0},
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    def _draw(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _latency(self, kind: str) -> float:
+        spec = self.config.stage_latency.get(kind, self.config.latency)
+        with self._lock:
+            return max(0.0, spec.sample(self._rng))
+
+    def handle(self, body: dict) -> tuple[int, dict, float, str | None]:
+        """1リクエストを処理する。
+
+        Returns:
+            (HTTPステータス, 応答JSON（正常時はMessage）, 応答までの秒数, retry-after ヘッダ値)
+        """
+        schema = ((body.get("output_config") or {}).get("format") or {}).get("schema") or {}
+        kind, model_cls = _KNOWN_FORMATS.get(schema.get("title", ""), (KIND_EXTRACT, None))
+        latency = self._latency(kind)
+        has_pdf = any(
+            isinstance(m.get("content"), list) and any(b.get("type") == "document" for b in m["content"])
+            for m in body.get("messages", [])
+        )
+
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["streamed"] += bool(body.get("stream"))
+            by_kind = self._stats["by_kind"].setdefault(kind, {"requests": 0, "ok": 0})
+            by_kind["requests"] += 1
+
+        error_latency = latency * self.config.error_latency_ratio
+        draw = self._draw()
+        if draw < self.config.rate_429:
+            self._count("429")
+            error = _error("rate_limit_error", "Number of requests has exceeded your rate limit")
+            return 429, error, error_latency, str(self.config.retry_after)
+        if draw < self.config.rate_429 + self.config.rate_529:
+            self._count("529")
+            return 529, _error("overloaded_error", "Overloaded"), error_latency, None
+        if has_pdf and self._draw() < self.config.pdf_error_rate:
+            self._count("pdf_error")
+            return 400, _error("invalid_request_error", "Could not process PDF"), error_latency, None
+
+        messages = body.get("messages", [])
+        if model_cls is not None:
+            text = self._stub.structured_extract(messages, model_cls).model_dump_json()
+        else:
+            text = json.dumps(_sample(schema, schema.get("$defs", {})), ensure_ascii=False)
+
+        with self._lock:
+            self._stats["by_kind"][kind]["ok"] += 1
+        message = {
+            "id": f"msg_mock_{uuid.uuid4().hex[:16]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": estimate_input_tokens(messages), "output_tokens": max(1, len(text) // 3)},
+        }
+        return 200, message, latency, None
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats["injected"][name] += 1
+
+
+def _error(error_type: str, message: str) -> dict:
+    return {"type": "error", "error": {"type": error_type, "message": message}}
+
+
+def _sample(schema: dict, defs: dict, name: str = "") -> object:
+    """JSON Schema に合う値を作る（抽出スキーマ用。null許容のフィールドにも値を入れる）。"""
+    if "$ref" in schema:
+        return _sample(defs[schema["$ref"].rsplit("/", 1)[-1]], defs, name)
+    if "anyOf" in schema:
+        options = [s for s in schema["anyOf"] if s.get("type") != "null"] or schema["anyOf"]
+        return _sample(options[0], defs, name)
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: _sample(sub, defs, key) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return []
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 0.0
+    if kind == "boolean":
+        return False
+    if kind == "null":
+        return None
+    return f"mock:{name}"
+
+
+def _sse_events(message: dict) -> list[bytes]:
+    """Messageを Messages API のストリーミングイベント列にする。"""
+
+    def event(name: str, data: dict) -> bytes:
+        return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+    text = message["content"][0]["text"]
+    start = {**message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 0}}
+    events = [
+        event("message_start", {"type": "message_start", "message": start}),
+        event(
+            "content_block_start",
+            {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        ),
+    ]
+    for i in range(0, len(text), _STREAM_DELTA_CHARS):
+        delta = {"type": "text_delta", "text": text[i : i + _STREAM_DELTA_CHARS]}
+        events.append(event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta}))
+    events += [
+        event("content_block_stop", {"type": "content_block_stop", "index": 0}),
+        event(
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": message["usage"]["output_tokens"]},
+            },
+        ),
+        event("message_stop", {"type": "message_stop"}),
+    ]
+    return events
+
+
+def make_handler(api: MockAnthropicAPI) -> type[BaseHTTPRequestHandler]:
+    """MockAnthropicAPI に紐づいたリクエストハンドラクラスを作る。"""
+
+    class MockRequestHandler(BaseHTTPRequestHandler):
+        server_version = "DemoAMockAPI/0.1"
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+        def _send_json(self, status: int, data: dict, headers: dict | None = None) -> None:
+            payload = json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/") == "/stats":
+                self._send_json(200, api.stats())
+            else:
+                self._send_json(404, _error("not_found_error", f"Not found: {self.path}"))
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            if self.path.split("?", 1)[0].rstrip("/") != "/v1/messages":
+                self._send_json(404, _error("not_found_error", f"Not found: {self.path}"))
+                return
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                self._send_json(400, _error("invalid_request_error", "Invalid JSON body"))
+                return
+
+            status, data, latency, retry_after = api.handle(body)
+            if status != 200 or not body.get("stream"):
+                time.sleep(latency)
+                self._send_json(status, data, {"retry-after": retry_after} if retry_after else None)
+                return
+
+            # ストリーミング: 最初のイベントまでにレイテンシの3割、残りを本文のイベントに割り振る
+            events = _sse_events(data)
+            time.sleep(latency * 0.3)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            interval = latency * 0.7 / len(events)
+            try:
+                for chunk in events:
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                    time.sleep(interval)
+            except (BrokenPipeError, ConnectionResetError):
+                # ヘッジで負けた側はクライアントが途中で切断する
+                pass
+            self.close_connection = True
+
+    return MockRequestHandler
+
+
+def start_mock_api(
+    config: MockConfig | None = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+) -> tuple[ThreadingHTTPServer, MockAnthropicAPI, str]:
+    """擬似APIをバックグラウンドスレッドで起動する（port=0 なら空いているポート）。
+
+    Returns:
+        (HTTPサーバー, 擬似API, ベースURL)。停止は server.shutdown()
+    """
+    api = MockAnthropicAPI(config)
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-anthropic-api", daemon=True).start()
+    return server, api, f"http://{host}:{server.server_address[1]}"
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    """擬似APIの挙動を指定する引数を追加する（loadtest と共用）。"""
+    parser.add_argument(
+        "--latency", type=LatencySpec.parse, default=LatencySpec("lognormal", 1.0, 0.4), help="応答レイテンシの分布"
+    )
+    parser.add_argument(
+        "--stage-latency",
+        action="append",
+        default=[],
+        metavar="STEP=SPEC",
+        help="ステップ別のレイテンシ分布（chunk / group / search / extract。複数指定可）",
+    )
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--rate-529", type=float, default=0.0, help="529を返す確率")
+    parser.add_argument(
+        "--pdf-error", type=float, default=0.0, help="PDFを含むリクエストに 'Could not process PDF' を返す確率"
+    )
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429の retry-after（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード")
+
+
+def mock_config_from_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> MockConfig:
+    """add_mock_arguments() で追加した引数から MockConfig を作る。"""
+    stage_latency = {}
+    for item in args.stage_latency:
+        stage, sep, spec = item.partition("=")
+        if not sep:
+            parser.error(f"--stage-latency は STEP=SPEC の形式で指定してください: {item}")
+        try:
+            stage_latency[stage.strip()] = LatencySpec.parse(spec)
+        except ValueError as e:
+            parser.error(str(e))
+    return MockConfig(
+        latency=args.latency,
+        stage_latency=stage_latency,
+        rate_429=args.rate_429,
+        rate_529=args.rate_529,
+        pdf_error_rate=args.pdf_error,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.demo_a.mock_api", description="負荷試験用の擬似 Anthropic Messages API"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8780)
+    add_mock_arguments(parser)
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    config = mock_config_from_args(parser, args)
+
+    api = MockAnthropicAPI(config)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    server.daemon_threads = True
+    logger.info("擬似API起動: http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
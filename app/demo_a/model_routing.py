@@ -0,0 +1,90 @@
+"""パイプラインステップ別のモデル割り当て（モデルルーティングテーブル）
+
+Step 5（フィールドグルーピング）と Step 6（チャンク検索）はテキストのみの短い分類タスクで、
+抽出が始まる前のクリティカルパスに乗る。既定ではこの2ステップに高速なモデルを割り当て、
+PDFを読む Step 3（チャンク生成）と Step 8（構造化抽出）は Sonnet のままにする。
+
+デプロイ単位の設定は環境変数で上書きできる（STEPは chunk / group / search / extract）:
+    DEMO_A_MODEL_<STEP>       モデルID（例: DEMO_A_MODEL_SEARCH=claude-sonnet-4-6）
+    DEMO_A_MAX_TOKENS_<STEP>  最大出力トークン数
+
+呼び出し単位では build_index / extract_with_schema の models 引数（{ステップ名: モデルID}）で上書きする。
+使用したモデルは実行メタデータ・ログとグルーピングキャッシュのキーに含める。
+"""
+
+import os
+from dataclasses import asdict, dataclass, field, replace
+
+from app.demo_a.llm_client import MODEL, STAGE_CHUNK, STAGE_EXTRACT, STAGE_GROUP, STAGE_SEARCH
+
+FAST_MODEL = "claude-haiku-4-5"
+
+STAGES = (STAGE_CHUNK, STAGE_GROUP, STAGE_SEARCH, STAGE_EXTRACT)
+
+
+@dataclass(frozen=True)
+class StepModel:
+    """1ステップのモデル設定。"""
+
+    model: str
+    max_tokens: int = 4096
+
+
+def _default_steps() -> dict[str, StepModel]:
+    return {
+        STAGE_CHUNK: StepModel(MODEL),
+        STAGE_GROUP: StepModel(FAST_MODEL),
+        STAGE_SEARCH: StepModel(FAST_MODEL),
+        STAGE_EXTRACT: StepModel(MODEL),
+    }
+
+
+@dataclass
+class ModelRoutingTable:
+    """ステップ名（STAGE_*）→ モデル設定。"""
+
+    steps: dict[str, StepModel] = field(default_factory=_default_steps)
+
+    @classmethod
+    def from_env(cls) -> "ModelRoutingTable":
+        """環境変数で上書きした設定を作る。"""
+        table = cls()
+        for stage, step in table.steps.items():
+            model = os.getenv(f"DEMO_A_MODEL_{stage.upper()}", "").strip() or step.model
+            max_tokens = int(os.getenv(f"DEMO_A_MAX_TOKENS_{stage.upper()}", step.max_tokens))
+            table.steps[stage] = StepModel(model, max_tokens)
+        return table
+
+    def step(self, stage: str) -> StepModel:
+        """ステップのモデル設定。"""
+        return self.steps[stage]
+
+    def with_overrides(self, overrides: dict[str, str | StepModel] | None) -> "ModelRoutingTable":
+        """一部のステップを差し替えた新しいテーブルを返す。
+
+        Args:
+            overrides: {ステップ名: モデルID または StepModel}。モデルIDのみの場合 max_tokens は元の値
+
+        Raises:
+            ValueError: 未知のステップ名
+        """
+        if not overrides:
+            return self
+        unknown = set(overrides) - set(self.steps)
+        if unknown:
+            raise ValueError(f"未知のステップ: {sorted(unknown)}（指定可能: {', '.join(STAGES)}）")
+        steps = dict(self.steps)
+        for stage, value in overrides.items():
+            steps[stage] = value if isinstance(value, StepModel) else replace(steps[stage], model=value)
+        return ModelRoutingTable(steps)
+
+    def to_dict(self, stages: tuple[str, ...] = STAGES) -> dict[str, dict]:
+        """実行メタデータ・ログ用の辞書（stages で対象ステップを絞れる）。"""
+        return {stage: asdict(self.steps[stage]) for stage in stages if stage in self.steps}
+
+
+def resolve_model_routing(models: "ModelRoutingTable | dict[str, str | StepModel] | None" = None) -> ModelRoutingTable:
+    """呼び出し単位の指定から使用するテーブルを決める（未指定のステップは環境変数・既定値）。"""
+    if isinstance(models, ModelRoutingTable):
+        return models
+    return ModelRoutingTable.from_env().with_overrides(models)
@@ -0,0 +1,400 @@
+"""文書間のページ重複検出（索引済みページのチャンク再利用）
+
+入札パッケージには版違いの契約書・共通の一般条件など、ほぼ同じページを含む文書が多い。
+各ページに
+    - テキストの文字シングル（NFKC正規化・空白除去後の5文字）の MinHash
+    - 単語ボックスから作るレイアウト署名（4×4格子の占有ビット + 単語数）
+を計算して SIGNATURE_DIR に保存し、MinHash の LSH（バンド分割）でほかの文書のページを引く。
+
+構築が完了した文書は、調停済みのチャンクを CHUNK_DIR にチャンク生成モデル・クライアント識別子別に保存してから
+署名を登録する。チャンク生成（Step 3）では、バッチ内で索引済み文書のページと一致する区間（同じ文書・
+同じページずれで MIN_REUSE_PAGES ページ以上連続する区間）は、その文書の保存済みチャンクを
+ページ番号をずらして再利用し、残りのページだけをAPIに送る。再利用元は同じチャンク生成モデル・
+同じクライアントで構築済みの文書に限る（スタブや擬似APIのチャンクを実APIの構築で使わない）。
+
+    output/page_signatures/<PDFのフィンガープリント>.json
+    output/page_chunks/<PDFのフィンガープリント>.<モデル>.<クライアント識別子>.json
+
+テキストのほとんどないページ（白紙・スキャン画像）は単独では一致を判定せず、
+前後の一致区間に挟まれ、再利用元の対応ページもテキストがほとんどない場合だけ区間に含める。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+
+from app.demo_a.fingerprint import file_fingerprint
+from app.demo_a.llm_client import get_client
+from app.demo_a.model_routing import StepModel
+from app.demo_a.page_store import PageTextStore, get_page_store
+from app.demo_a.pdf_workers import run_in_pdf_worker
+from app.demo_a.schemas import SemanticChunk
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_DIR = Path(__file__).parent.parent.parent / "output" / "page_signatures"
+CHUNK_DIR = Path(__file__).parent.parent.parent / "output" / "page_chunks"
+
+SHINGLE_CHARS = 5
+NUM_HASHES = 64
+LSH_BANDS = 16  # 1バンド4値。推定類似度0.5前後から候補になる
+MIN_PAGE_CHARS = 50  # これ未満のページは単独で一致を判定しない
+SIMILARITY_THRESHOLD = 0.85  # MinHashの推定Jaccard類似度
+LAYOUT_MAX_CELL_DIFF = 2  # 占有ビットの違いの許容数
+LAYOUT_MIN_WORD_RATIO = 0.8
+MIN_REUSE_PAGES = 2
+
+_GRID = 4
+_MASKS = [random.Random(20240601 + i).getrandbits(64) for i in range(NUM_HASHES)]
+
+
+@dataclass(frozen=True)
+class PageSignature:
+    """1ページの署名。テキストがほとんどないページは minhash が空。"""
+
+    minhash: tuple[int, ...]
+    layout_mask: int
+    word_count: int
+
+    @property
+    def has_text(self) -> bool:
+        return bool(self.minhash)
+
+    def similarity(self, other: "PageSignature") -> float:
+        """推定Jaccard類似度（MinHashの一致率）。"""
+        if not self.minhash or not other.minhash:
+            return 0.0
+        return sum(a == b for a, b in zip(self.minhash, other.minhash)) / NUM_HASHES
+
+    def layout_matches(self, other: "PageSignature") -> bool:
+        if bin(self.layout_mask ^ other.layout_mask).count("1") > LAYOUT_MAX_CELL_DIFF:
+            return False
+        low, high = sorted((self.word_count, other.word_count))
+        return high == 0 or low / high >= LAYOUT_MIN_WORD_RATIO
+
+    def matches(self, other: "PageSignature") -> bool:
+        return self.similarity(other) >= SIMILARITY_THRESHOLD and self.layout_matches(other)
+
+
+def page_signature(text: str, words: list[tuple[float, float, float, float, str]]) -> PageSignature:
+    """ページのテキストと単語ボックスから署名を作る。"""
+    normalized = "".join(unicodedata.normalize("NFKC", text).split())
+    minhash: tuple[int, ...] = ()
+    if len(normalized) >= MIN_PAGE_CHARS:
+        hashes = {
+            int.from_bytes(hashlib.blake2b(normalized[i : i + SHINGLE_CHARS].encode("utf-8"), digest_size=8).digest())
+            for i in range(len(normalized) - SHINGLE_CHARS + 1)
+        }
+        minhash = tuple(min(map(mask.__xor__, hashes)) for mask in _MASKS)
+
+    mask = 0
+    if words:
+        x0 = min(w[0] for w in words)
+        y0 = min(w[1] for w in words)
+        width = max(max(w[2] for w in words) - x0, 1e-6)
+        height = max(max(w[3] for w in words) - y0, 1e-6)
+        for w in words:
+            col = min(_GRID - 1, int(((w[0] + w[2]) / 2 - x0) / width * _GRID))
+            row = min(_GRID - 1, int(((w[1] + w[3]) / 2 - y0) / height * _GRID))
+            mask |= 1 << (row * _GRID + col)
+    return PageSignature(minhash, mask, len(words))
+
+
+def document_signatures(page_store: PageTextStore) -> list[PageSignature]:
+    """文書の全ページの署名（ページ番号1のものが先頭）。page_store は単語ボックス付きであること。"""
+    return [page_signature(page_store.text(p), page_store.words(p)) for p in range(1, len(page_store) + 1)]
+
+
+class SignatureIndex:
+    """索引済み文書のページ署名とLSH表（SIGNATURE_DIR に永続化）。
+
+    Args:
+        directory: 署名の保存先
+    """
+
+    def __init__(self, directory: Path = SIGNATURE_DIR) -> None:
+        self.directory = directory
+        self._documents: dict[str, list[PageSignature]] = {}
+        self._buckets: dict[tuple[int, tuple[int, ...]], list[tuple[str, int]]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+                signatures = [PageSignature(tuple(p[0]), p[1], p[2]) for p in data["pages"]]
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                logger.warning("ページ署名を読めません（スキップします）: %s: %s", path, e)
+                continue
+            self._add(path.stem, signatures)
+
+    def _add(self, fingerprint: str, signatures: list[PageSignature]) -> None:
+        self._documents[fingerprint] = signatures
+        rows = NUM_HASHES // LSH_BANDS
+        for page, sig in enumerate(signatures, start=1):
+            if not sig.has_text:
+                continue
+            for band in range(LSH_BANDS):
+                key = (band, sig.minhash[band * rows : (band + 1) * rows])
+                self._buckets.setdefault(key, []).append((fingerprint, page))
+
+    def register(self, fingerprint: str, signatures: list[PageSignature]) -> None:
+        """文書の署名を登録・保存する（登録済みなら何もしない）。"""
+        with self._lock:
+            self._load()
+            if fingerprint in self._documents:
+                return
+            self._add(fingerprint, signatures)
+        path = self.directory / f"{fingerprint}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        pages = [[list(s.minhash), s.layout_mask, s.word_count] for s in signatures]
+        tmp.write_text(json.dumps({"pages": pages}, separators=(",", ":")), encoding="utf-8")
+        tmp.replace(path)
+
+    def page_count(self, fingerprint: str) -> int:
+        with self._lock:
+            return len(self._documents.get(fingerprint, []))
+
+    def signature(self, fingerprint: str, page: int) -> PageSignature | None:
+        with self._lock:
+            signatures = self._documents.get(fingerprint, [])
+            return signatures[page - 1] if 1 <= page <= len(signatures) else None
+
+    def candidates(self, sig: PageSignature, exclude: str) -> list[tuple[str, int, float]]:
+        """sig と一致するほかの文書のページ [(フィンガープリント, ページ番号, 類似度)]（類似度の高い順）。"""
+        if not sig.has_text:
+            return []
+        rows = NUM_HASHES // LSH_BANDS
+        with self._lock:
+            self._load()
+            found = {
+                hit
+                for band in range(LSH_BANDS)
+                for hit in self._buckets.get((band, sig.minhash[band * rows : (band + 1) * rows]), [])
+                if hit[0] != exclude
+            }
+            scored = []
+            for fingerprint, page in found:
+                other = self._documents[fingerprint][page - 1]
+                if sig.matches(other):
+                    scored.append((fingerprint, page, sig.similarity(other)))
+        return sorted(scored, key=lambda c: (-c[2], c[0], c[1]))
+
+
+_index: SignatureIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_signature_index() -> SignatureIndex:
+    """プロセス共有の署名インデックス（シングルトン）。"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SignatureIndex()
+        return _index
+
+
+def set_signature_index(index: SignatureIndex) -> None:
+    """署名インデックスを差し替える（テスト用）。"""
+    global _index
+    with _index_lock:
+        _index = index
+
+
+@dataclass
+class ReuseSegment:
+    """バッチ内の連続ページ区間。chunks があれば再利用（ページ番号は変換済み）、Noneなら要生成。"""
+
+    page_start: int
+    page_end: int
+    chunks: list[SemanticChunk] | None = None
+    source: str | None = None
+
+    @property
+    def page_count(self) -> int:
+        return self.page_end - self.page_start + 1
+
+
+class PageDedup:
+    """1文書のインデックス構築で使うページ重複検出。
+
+    Args:
+        fingerprint: 構築中のPDFのフィンガープリント
+        signatures: 構築中のPDFのページ署名
+        step: チャンク生成モデル（同じモデルで構築済みの文書だけを再利用元にする）
+        index: 署名インデックス
+        client_id: クライアント識別子（同じクライアントで構築済みの文書だけを再利用元にする）
+        chunk_dir: 構築済み文書のチャンクの保存先
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        signatures: list[PageSignature],
+        step: StepModel,
+        index: SignatureIndex,
+        client_id: str,
+        chunk_dir: Path = CHUNK_DIR,
+    ) -> None:
+        self.fingerprint = fingerprint
+        self.signatures = signatures
+        self.step = step
+        self.index = index
+        self.client_id = client_id
+        self.chunk_dir = chunk_dir
+        self._source_chunks: dict[str, list[SemanticChunk]] = {}
+        self._lock = threading.Lock()
+
+    def _chunk_path(self, fingerprint: str) -> Path:
+        return self.chunk_dir / f"{fingerprint}.{self.step.model}.{self.client_id}.json"
+
+    def _chunks_of(self, source: str) -> list[SemanticChunk]:
+        with self._lock:
+            if source not in self._source_chunks:
+                chunks: list[SemanticChunk] = []
+                path = self._chunk_path(source)
+                if path.exists():
+                    try:
+                        data = json.loads(path.read_text(encoding="utf-8"))
+                        chunks = [SemanticChunk.model_validate(c) for c in data["chunks"]]
+                    except (ValueError, KeyError) as e:
+                        logger.warning("保存済みチャンクを読めません（再利用しません）: %s: %s", path, e)
+                self._source_chunks[source] = chunks
+            return self._source_chunks[source]
+
+    def _has_chunks(self, source: str) -> bool:
+        return bool(self._chunks_of(source))
+
+    def _match(self, page: int, previous: tuple[str, int] | None) -> tuple[str, int] | None:
+        """page の一致先 (文書, ページずれ)。直前ページと同じ一致先・ずれを優先する。"""
+        sig = self.signatures[page - 1]
+        if not sig.has_text:
+            if previous is None:
+                return None
+            source_sig = self.index.signature(previous[0], page + previous[1])
+            return previous if source_sig is not None and not source_sig.has_text else None
+        candidates = [(s, p - page) for s, p, _ in self.index.candidates(sig, self.fingerprint)]
+        candidates = [c for c in candidates if self._has_chunks(c[0])]
+        if not candidates:
+            return None
+        return previous if previous in candidates else candidates[0]
+
+    def plan(self, batch: dict) -> list[ReuseSegment]:
+        """バッチのページを、再利用する区間と生成する区間に分ける（ページ順）。"""
+        runs: list[tuple[int, int, tuple[str, int] | None]] = []
+        previous = None
+        for page in range(batch["page_start"], batch["page_end"] + 1):
+            match = self._match(page, previous)
+            if runs and runs[-1][2] == match:
+                runs[-1] = (runs[-1][0], page, match)
+            else:
+                runs.append((page, page, match))
+            previous = match
+
+        segments: list[ReuseSegment] = []
+        for start, end, match in runs:
+            segment = ReuseSegment(start, end)
+            if match is not None and end - start + 1 >= MIN_REUSE_PAGES:
+                segment.chunks = self._remap(match[0], start, end, match[1])
+                segment.source = match[0] if segment.chunks is not None else None
+            if segments and segment.chunks is None and segments[-1].chunks is None:
+                segments[-1].page_end = end
+            else:
+                segments.append(segment)
+        return segments
+
+    def _remap(self, source: str, start: int, end: int, offset: int) -> list[SemanticChunk] | None:
+        """再利用元の start+offset 〜 end+offset ページのチャンクを start 〜 end に写す。
+
+        オーバーラップ部分で重複したチャンクは先に現れた方を採り、区間内に
+        チャンクのないページが残る場合はNone。
+        """
+        source_start, source_end = start + offset, end + offset
+        picked: list[SemanticChunk] = []
+        covered_to = source_start - 1
+        for chunk in sorted(self._chunks_of(source), key=lambda c: (c.page_start, -c.page_end)):
+            if chunk.page_end <= covered_to or chunk.page_start > source_end:
+                continue
+            if chunk.page_start > covered_to + 1:
+                return None
+            page_start = max(chunk.page_start, covered_to + 1)
+            page_end = min(chunk.page_end, source_end)
+            picked.append(chunk.model_copy(update={"page_start": page_start - offset, "page_end": page_end - offset}))
+            covered_to = page_end
+            if covered_to >= source_end:
+                return picked
+        return None
+
+    def register(self, chunks: list[SemanticChunk]) -> None:
+        """構築が完了したこの文書を、以降の構築の再利用元として登録する。
+
+        Args:
+            chunks: 調停済みのチャンク（署名より先に保存し、署名だけが見える状態を作らない）
+        """
+        path = self._chunk_path(self.fingerprint)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(
+            json.dumps({"chunks": [c.model_dump() for c in chunks]}, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+        tmp.replace(path)
+        self.index.register(self.fingerprint, self.signatures)
+
+
+def open_page_dedup(
+    pdf_path: Path,
+    step: StepModel,
+    chunk_dir: Path = CHUNK_DIR,
+    index: SignatureIndex | None = None,
+    client_id: str | None = None,
+) -> PageDedup:
+    """PDFのページ署名を計算し、インデックス構築用の重複検出を返す（単語ボックス付きのページストアを使う）。
+
+    client_id を省略した場合は get_client().identity を使う。
+    """
+    signatures = document_signatures(get_page_store(pdf_path, include_words=True))
+    if client_id is None:
+        client_id = get_client().identity
+    return PageDedup(file_fingerprint(pdf_path), signatures, step, index or get_signature_index(), client_id, chunk_dir)
+
+
+def sub_batch(batch: dict, page_start: int, page_end: int) -> dict:
+    """バッチの一部のページだけのバッチを作る（ページ番号は元文書のまま）。"""
+    pdf_bytes = run_in_pdf_worker(
+        _extract_pages, batch["pdf_bytes"], page_start - batch["page_start"], page_end - batch["page_start"]
+    )
+    return {
+        "id": f"batch_p{page_start:03d}_{page_end:03d}",
+        "label": f"p.{page_start}–{page_end}",
+        "pdf_bytes": pdf_bytes,
+        "page_start": page_start,
+        "page_end": page_end,
+        "page_count": page_end - page_start + 1,
+    }
+
+
+def _extract_pages(pdf_bytes: bytes, from_page: int, to_page: int) -> bytes:
+    """PDFバイト列の from_page〜to_page（0始まり・両端含む）のページだけのPDF。"""
+    import pymupdf
+
+    src = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        doc = pymupdf.open()
+        doc.insert_pdf(src, from_page=from_page, to_page=to_page)
+        result = doc.tobytes()
+        doc.close()
+    finally:
+        src.close()
+    return result
@@ -0,0 +1,266 @@
+"""文書ごとのページテキストストア（インデックス構築時に1回だけ抽出）
+
+pymupdfで1パス走査して全ページのテキスト・文字数・テキストレイヤ有無
+（オプションで単語ボックス）を抽出し、オフセット表付きのバイナリファイルに保存する。
+読み出しはmmap経由で、必要なページだけをデコードする。
+オープン済みのストアはプロセス内で最大 MAX_OPEN_STORES 件まで共有し、超えたら古いものから閉じる。
+
+ファイル形式（リトルエンディアン）:
+    ヘッダ   : magic "DAPT", version u16, flags u16, page_count u32, reserved u32
+    ページ表 : page_count × (text_offset u64, text_bytes u32, char_count u32,
+                              words_offset u64, word_count u32, page_flags u8, pad 3)
+    本文     : 各ページのUTF-8テキスト
+    単語     : 各ページ (words_text_bytes u32, "\\n"区切りの単語UTF-8, word_count × 4 float32 bbox)
+"""
+
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.demo_a.doc_pool import borrow_document
+from app.demo_a.fingerprint import file_fingerprint
+from app.demo_a.pdf_workers import run_in_pdf_worker
+
+STORE_DIR = Path(__file__).parent.parent.parent / "output" / "page_text"
+
+_MAGIC = b"DAPT"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHHII")
+_ENTRY = struct.Struct("<QIIQIB3x")
+_WORDS_LEN = struct.Struct("<I")
+_BOX = struct.Struct("<4f")
+
+_FLAG_HAS_WORDS = 0x1
+_PAGE_HAS_TEXT = 0x1
+
+# PDFドキュメントブロックのページあたりトークン見積もり（ページ画像 + テキスト）
+PAGE_IMAGE_TOKENS = 1_600
+CHARS_PER_TOKEN = 2.5
+
+# プロセス内でオープンしたままにするストアの最大数
+MAX_OPEN_STORES = 16
+
+
+class PageTextStore:
+    """ページテキストストアの読み出し（mmap）。ページ番号は1始まり。
+
+    close() 後も読み出せばファイルを開き直す（get_page_store() のLRUから外れて閉じられたストアを、
+    取得済みの呼び出し側がそのまま使い続けられるようにする）。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = None
+        self._mm: mmap.mmap | None = None
+        self._lock = threading.Lock()
+        with self._view() as mm:
+            magic, version, flags, page_count, _ = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError(f"ページテキストストアの形式が不正です: {path}")
+        self.page_count = page_count
+        self.has_words = bool(flags & _FLAG_HAS_WORDS)
+
+    def __len__(self) -> int:
+        return self.page_count
+
+    @contextmanager
+    def _view(self) -> Iterator[mmap.mmap]:
+        """mmap を使う間ロックし、閉じていれば開き直す（読み出した値はブロック内でコピーすること）。"""
+        with self._lock:
+            if self._mm is None:
+                self._file = open(self.path, "rb")
+                self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            yield self._mm
+
+    def _entry(self, page: int) -> tuple[int, int, int, int, int, int]:
+        if not 1 <= page <= self.page_count:
+            raise IndexError(f"ページ番号が範囲外です: {page}（全{self.page_count}ページ）")
+        with self._view() as mm:
+            return _ENTRY.unpack_from(mm, _HEADER.size + (page - 1) * _ENTRY.size)
+
+    def text(self, page: int) -> str:
+        """ページのテキスト。"""
+        offset, length, *_ = self._entry(page)
+        with self._view() as mm:
+            data = mm[offset : offset + length]
+        return data.decode("utf-8")
+
+    def char_count(self, page: int) -> int:
+        """ページの文字数。"""
+        return self._entry(page)[2]
+
+    def has_text_layer(self, page: int) -> bool:
+        """ページに抽出可能なテキストがあるか（スキャン画像のみのページはFalse）。"""
+        return bool(self._entry(page)[5] & _PAGE_HAS_TEXT)
+
+    def words(self, page: int) -> list[tuple[float, float, float, float, str]]:
+        """ページの単語と bbox (x0, y0, x1, y1, word)。単語なしで構築した場合は空リスト。"""
+        _, _, _, offset, count, _ = self._entry(page)
+        if not self.has_words or count == 0:
+            return []
+        with self._view() as mm:
+            (text_len,) = _WORDS_LEN.unpack_from(mm, offset)
+            start = offset + _WORDS_LEN.size
+            tokens = mm[start : start + text_len].decode("utf-8").split("\n")
+            box_start = start + text_len
+            return [(*_BOX.unpack_from(mm, box_start + i * _BOX.size), tokens[i]) for i in range(count)]
+
+    def estimated_tokens(self, page: int) -> int:
+        """ページをPDFとしてAPIに送った場合の入力トークン数の見積もり。"""
+        return PAGE_IMAGE_TOKENS + int(self.char_count(page) / CHARS_PER_TOKEN)
+
+    def texts(self, page_start: int, page_end: int) -> list[str]:
+        """page_start〜page_end（両端含む）のテキストのリスト。"""
+        return [self.text(p) for p in range(page_start, page_end + 1)]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._file.close()
+                self._mm = self._file = None
+
+
+def build_page_store(pdf_path: Path, out_path: Path, include_words: bool = False) -> Path:
+    """PDFを1パス走査してページテキストストアを書き出す。
+
+    各ページで TextPage を1回だけ生成し、テキストと単語を同じ解析結果から取り出す。
+
+    Args:
+        pdf_path: PDFファイルパス
+        out_path: 出力先ファイルパス
+        include_words: 単語ボックスも保存するか
+
+    Returns:
+        out_path
+    """
+    texts: list[bytes] = []
+    char_counts: list[int] = []
+    page_flags: list[int] = []
+    word_blocks: list[tuple[bytes, int]] = []
+
+    with borrow_document(pdf_path) as doc:
+        for page in doc:
+            textpage = page.get_textpage()
+            text = textpage.extractText()
+            texts.append(text.encode("utf-8"))
+            char_counts.append(len(text))
+            page_flags.append(_PAGE_HAS_TEXT if text.strip() else 0)
+
+            if include_words:
+                words = textpage.extractWORDS()
+                word_text = "\n".join(w[4] for w in words).encode("utf-8")
+                boxes = b"".join(_BOX.pack(w[0], w[1], w[2], w[3]) for w in words)
+                word_blocks.append((_WORDS_LEN.pack(len(word_text)) + word_text + boxes, len(words)))
+            else:
+                word_blocks.append((b"", 0))
+
+    page_count = len(texts)
+    offset = _HEADER.size + page_count * _ENTRY.size
+    text_offsets = []
+    for t in texts:
+        text_offsets.append(offset)
+        offset += len(t)
+    word_offsets = []
+    for block, _ in word_blocks:
+        word_offsets.append(offset)
+        offset += len(block)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_suffix(out_path.suffix + f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, _FLAG_HAS_WORDS if include_words else 0, page_count, 0))
+        for i in range(page_count):
+            f.write(
+                _ENTRY.pack(
+                    text_offsets[i],
+                    len(texts[i]),
+                    char_counts[i],
+                    word_offsets[i],
+                    word_blocks[i][1],
+                    page_flags[i],
+                )
+            )
+        for t in texts:
+            f.write(t)
+        for block, _ in word_blocks:
+            f.write(block)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+# フィンガープリント → オープン済みストア（プロセス内で共有するLRU）
+_stores: OrderedDict[str, PageTextStore] = OrderedDict()
+# 構築・オープン中のフィンガープリント（同じ文書は1スレッドだけが構築し、ほかは完了を待つ）
+_opening: set[str] = set()
+_stores_cond = threading.Condition()
+
+
+def get_page_store(pdf_path: Path, include_words: bool = False) -> PageTextStore:
+    """PDFのページテキストストアを取得する。ディスクになければ構築する。
+
+    ストアは内容フィンガープリントをキーに STORE_DIR に保存され、
+    プロセス内ではオープン済みのものを再利用する。構築中に待たされるのは同じ文書の呼び出しだけ。
+
+    Args:
+        pdf_path: PDFファイルパス
+        include_words: 単語ボックスが必要か（既存ストアに単語がなければ再構築）
+    """
+    fingerprint = file_fingerprint(pdf_path)
+    with _stores_cond:
+        while True:
+            store = _stores.get(fingerprint)
+            if store is not None and (store.has_words or not include_words):
+                _stores.move_to_end(fingerprint)
+                return store
+            if fingerprint not in _opening:
+                break
+            _stores_cond.wait()
+        _opening.add(fingerprint)
+
+    try:
+        path = STORE_DIR / f"{fingerprint}.ptx"
+        store = PageTextStore(path) if path.exists() else None
+        if store is not None and include_words and not store.has_words:
+            store.close()
+            store = None
+        if store is None:
+            # 全ページの解析はPDF処理のプロセスプールで行う
+            run_in_pdf_worker(build_page_store, pdf_path, path, include_words=include_words)
+            store = PageTextStore(path)
+    except BaseException:
+        with _stores_cond:
+            _opening.discard(fingerprint)
+            _stores_cond.notify_all()
+        raise
+
+    with _stores_cond:
+        _opening.discard(fingerprint)
+        # 単語なしの旧ストアも取得済みの呼び出し側は使い続けられる（閉じても読み出し時に開き直す）
+        old = _stores.pop(fingerprint, None)
+        evicted = [old] if old is not None else []
+        _stores[fingerprint] = store
+        while len(_stores) > MAX_OPEN_STORES:
+            evicted.append(_stores.popitem(last=False)[1])
+        _stores_cond.notify_all()
+    for old in evicted:
+        old.close()
+    return store
+
+
+def clear_page_stores() -> None:
+    """オープン済みのストアをすべて閉じ、プロセス内の再利用をやめる（STORE_DIR を差し替えるとき・テスト用）。
+
+    取得済みの呼び出し側は使い続けられる（読み出し時に元のファイルを開き直す）。
+    """
+    with _stores_cond:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
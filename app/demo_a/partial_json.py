@@ -0,0 +1,99 @@
+"""ストリーミング中の部分JSONから、確定したトップレベルのフィールドを取り出す
+
+Structured Output の応答は {"field": value, ...} のフラットなJSONオブジェクトとして
+少しずつ届く。PartialObjectParser は届いた断片を feed() で受け取り、
+値の終わり（次の "," か閉じ "}"）まで届いたフィールドから順に on_field を呼ぶ。
+受け取り済みの部分は再走査しない。
+"""
+
+import json
+from collections.abc import Callable
+from typing import Any
+
+# トップレベルで次に来るもの
+_EXPECT_KEY = "key"
+_EXPECT_COLON = "colon"
+_EXPECT_VALUE = "value"
+
+
+class PartialObjectParser:
+    """トップレベルのJSONオブジェクトを増分パースする。
+
+    Args:
+        on_field: フィールドの値が確定するたびに (フィールド名, 値) で呼ばれる
+    """
+
+    def __init__(self, on_field: Callable[[str, Any], None] | None = None) -> None:
+        self.on_field = on_field
+        self.reset()
+
+    def reset(self) -> None:
+        """最初からやり直す（リトライで応答が先頭から再送される場合）。"""
+        self.fields: dict[str, Any] = {}
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = _EXPECT_KEY
+        self._key: str | None = None
+        self._key_start = 0
+        self._value_start: int | None = None
+
+    def feed(self, delta: str) -> None:
+        """応答テキストの断片を追加する。"""
+        self._text += delta
+        text = self._text
+
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            top = self._depth == 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if top and self._expect == _EXPECT_KEY:
+                        self._key = json.loads(text[self._key_start : i + 1])
+                        self._expect = _EXPECT_COLON
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if top and self._expect == _EXPECT_KEY:
+                    self._key_start = i
+                elif top and self._expect == _EXPECT_VALUE and self._value_start is None:
+                    self._value_start = i
+            elif c in "{[":
+                if top and self._expect == _EXPECT_VALUE and self._value_start is None:
+                    self._value_start = i
+                self._depth += 1
+            elif c in "}]":
+                if top:
+                    self._finish_value(text, i)
+                self._depth -= 1
+            elif top and c == ":" and self._expect == _EXPECT_COLON:
+                self._expect = _EXPECT_VALUE
+                self._value_start = None
+            elif top and c == ",":
+                self._finish_value(text, i)
+                self._expect = _EXPECT_KEY
+            elif top and self._expect == _EXPECT_VALUE and self._value_start is None and not c.isspace():
+                self._value_start = i
+
+        self._pos = len(text)
+
+    def _finish_value(self, text: str, end: int) -> None:
+        if self._expect != _EXPECT_VALUE or self._value_start is None or self._key is None:
+            return
+        try:
+            value = json.loads(text[self._value_start : end])
+        except ValueError:
+            return
+        self.fields[self._key] = value
+        self._value_start = None
+        if self.on_field is not None:
+            self.on_field(self._key, value)
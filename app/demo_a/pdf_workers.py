@@ -0,0 +1,143 @@
+"""pymupdfによるPDF処理（CPU処理）のプロセスプール
+
+バッチ分割・コンテキストPDFの切り出し・ページテキストストアの構築などは、pymupdf内で
+GILを保持したまま長く走るため、同じプロセスのほかのスレッド（Streamlitの他セッションの
+スクリプト実行・サーバーのワーカー）が止まる。これらを子プロセスで実行し、呼び出し側の
+スレッドは結果を待つだけ（GILを解放）にする。
+
+子プロセスにはファイルパス・ページ範囲だけを渡し、結果はPDFのバイト列などで受け取る。
+子プロセスは spawn で起動し（スレッドを持つプロセスからの fork を避ける）、文書プール（doc_pool）は
+子プロセスごとに持つ。同じ文書が複数の子プロセスで開かれうるため、プール全体の容量
+（DEMO_A_DOC_POOL_SIZE）を子プロセス数で分け、プロセス数を増やしても開く文書数が増えないようにする。
+
+プロセス数は環境変数 DEMO_A_PDF_WORKERS（0でプロセスプールを使わず、呼び出したスレッドで実行。
+既定は DEFAULT_WORKERS）。
+プロセスを起動できない環境やプールが壊れた場合は、警告を出して以降は同じプロセス内で実行する。
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, TypeVar
+
+from app.demo_a.doc_pool import DEFAULT_CAPACITY, DocumentPool, set_pool
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 既定のプロセス数（呼び出し側のプロセスに1コア残す。1コアの環境ではプールを使わない）
+DEFAULT_WORKERS = max(0, min(2, (os.cpu_count() or 1) - 1))
+
+# 子プロセス内では入れ子にプールを使わない
+_in_worker = False
+
+
+def _init_worker(doc_pool_capacity: int) -> None:
+    global _in_worker
+    _in_worker = True
+    set_pool(DocumentPool(doc_pool_capacity))
+
+
+def _worker_doc_pool_capacity(workers: int) -> int:
+    """子プロセス1つあたりの文書プール容量（全体の容量を子プロセス数で分ける）。"""
+    total = int(os.getenv("DEMO_A_DOC_POOL_SIZE", DEFAULT_CAPACITY))
+    return max(1, -(-total // max(1, workers)))
+
+
+class PdfWorkerPool:
+    """PDF処理用のプロセスプール（初回の run() で起動する）。
+
+    Args:
+        workers: プロセス数（0以下ならプロセスプールを使わない）
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS) -> None:
+        self.workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._disabled = workers <= 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return not self._disabled and not _in_worker
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(_worker_doc_pool_capacity(self.workers),),
+                )
+            return self._executor
+
+    def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """fn(*args, **kwargs) を子プロセスで実行して結果を返す（無効なら呼び出したスレッドで実行）。
+
+        fn はモジュールのトップレベル関数、引数と戻り値はpickle可能であること。
+        fn が送出した例外はそのまま送出する。
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            self._fallback(e)
+            return fn(*args, **kwargs)
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            self._fallback(e)
+            return fn(*args, **kwargs)
+
+    def _fallback(self, error: BaseException) -> None:
+        with self._lock:
+            if self._disabled:
+                return
+            self._disabled = True
+            executor, self._executor = self._executor, None
+        logger.warning(
+            "PDF処理のプロセスプールを使えません。以降は同一プロセスで実行します: %s: %s", type(error).__name__, error
+        )
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+# シングルトンインスタンス
+_pool: PdfWorkerPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pdf_workers() -> PdfWorkerPool:
+    """プロセス共有のPDF処理プールを取得する（プロセス数は環境変数 DEMO_A_PDF_WORKERS）。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PdfWorkerPool(int(os.getenv("DEMO_A_PDF_WORKERS", DEFAULT_WORKERS)))
+        return _pool
+
+
+def set_pdf_workers(pool: PdfWorkerPool) -> None:
+    """PDF処理プールを差し替える（テスト・プロセス数の変更用）。"""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, pool
+    if old is not None and old is not pool:
+        old.shutdown()
+
+
+def run_in_pdf_worker(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """get_pdf_workers().run() の短縮形。"""
+    return get_pdf_workers().run(fn, *args, **kwargs)
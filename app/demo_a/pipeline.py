@@ -1,22 +1,50 @@
-"""デモA パイプライン統合（フェーズ1 + フェーズ2）"""
+"""デモA パイプライン統合（フェーズ1 + フェーズ2）
+
+Step 2-9 は STAGES のノードとして宣言し、StageGraph で実行する。各関数は必要なノードだけを対象にし、
+前のフェーズの結果（バッチ・チャンクインデックスなど）はノードの出力として渡す:
+
+    build_index()        route → split → chunk
+    prepare_extraction() (split, chunk) → group → search → merge
+    run_extraction()     merge → extract → postprocess
+
+Step 1（変換）を含むファイル単位の実行は pipeline_graph.run_pipeline()。
+"""
 
 import json
 import logging
+import os
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
 from datetime import datetime
 from pathlib import Path
+from typing import Any
 
-import pymupdf
-
-logger = logging.getLogger(__name__)
+from pydantic import BaseModel
 
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.chunk_index import ChunkIndex
 from app.demo_a.chunker import build_document_index
-from app.demo_a.extractor import extract_structured_data, postprocess_result
-from app.demo_a.grouper import group_fields
-from app.demo_a.merger import build_extraction_context
-from app.demo_a.schema_builder import build_extraction_schema
-from app.demo_a.schemas import SemanticChunk
+from app.demo_a.extractor import (
+    extract_structured_data,
+    postprocess_result,
+    reconcile_conflicts,
+    reduce_extractions,
+)
+from app.demo_a.index_checkpoint import open_checkpoint
+from app.demo_a.llm_client import STAGE_CHUNK, STAGE_EXTRACT, STAGE_GROUP, STAGE_SEARCH
+from app.demo_a.merger import DEFAULT_CONTEXT_TOKEN_BUDGET, ExtractionContext, build_extraction_contexts
+from app.demo_a.model_routing import ModelRoutingTable, StepModel, resolve_model_routing
+from app.demo_a.page_dedup import open_page_dedup
+from app.demo_a.page_store import get_page_store
+from app.demo_a.router import RouteDecision, decide_route
+from app.demo_a.schema_registry import get_registry
+from app.demo_a.schemas import ChunkHit, GroupingResult
 from app.demo_a.searcher import search_chunks
 from app.demo_a.splitter import load_and_split
+from app.demo_a.stage_graph import CLASS_LLM, Stage, StageGraph
+
+logger = logging.getLogger(__name__)
 
 LOGS_DIR = Path(__file__).parent.parent.parent / "logs"
 
@@ -31,144 +59,655 @@ def _save_json_log(name: str, data: dict | list) -> Path:
     return path
 
 
+def _route_stage(
+    pdf_path: Path,
+    expected_schema_runs: int | None,
+    metadata: dict | None,
+    cancel: CancelToken | None,
+) -> RouteDecision:
+    """直接抽出かインデックス検索かの判定。"""
+    # ページテキストを1パスで抽出・保存（フォールバック・ルーティング等はここから読む）
+    decision = decide_route(get_page_store(pdf_path), expected_schema_runs)
+    logger.info(
+        "ルーティング: %s（%s, %dページ, 約%dトークン）",
+        decision.route,
+        decision.reason,
+        decision.total_pages,
+        decision.document_tokens,
+    )
+    _save_json_log("route", {"source_pdf": str(pdf_path), **decision.to_dict()})
+    if metadata is not None:
+        metadata["route"] = decision.to_dict()
+    return decision
+
+
+def _split_stage(pdf_path: Path, route: RouteDecision, cancel: CancelToken | None) -> list[dict]:
+    """Step 2. バッチ分割"""
+    return load_and_split(pdf_path, split=route.split)
+
+
+def _chunk_stage(
+    pdf_path: Path,
+    split: list[dict],
+    chunk_step: StepModel,
+    resume: bool,
+    fallback_on_error: bool | None,
+    dedup: bool | None,
+    metadata: dict | None,
+    cancel: CancelToken | None,
+) -> ChunkIndex | None:
+    """Step 3-4. チャンク生成。直接抽出（バッチが1つ）ならNone。"""
+    if len(split) <= 1:
+        return None
+    if fallback_on_error is None:
+        fallback_on_error = os.getenv("DEMO_A_INDEX_FALLBACK", "") == "1"
+    if dedup is None:
+        dedup = os.getenv("DEMO_A_PAGE_DEDUP", "1") != "0"
+
+    chunk_index = build_document_index(
+        split,
+        page_store=get_page_store(pdf_path),
+        step=chunk_step,
+        cancel=cancel,
+        checkpoint=open_checkpoint(pdf_path, chunk_step) if resume else None,
+        fallback_on_error=fallback_on_error,
+        metadata=metadata,
+        dedup=open_page_dedup(pdf_path, chunk_step) if resume and dedup else None,
+    )
+    if metadata is not None:
+        metadata["models"] = {STAGE_CHUNK: chunk_step.model}
+
+    # チャンクインデックスをJSON出力
+    _save_json_log(
+        "chunk_index",
+        {
+            "source_pdf": str(pdf_path),
+            "model": chunk_step.model,
+            "total_batches": len(split),
+            "batches": [
+                {
+                    "id": b["id"],
+                    "label": b["label"],
+                    "page_start": b["page_start"],
+                    "page_end": b["page_end"],
+                    "page_count": b["page_count"],
+                }
+                for b in split
+            ],
+            "total_chunks": len(chunk_index),
+            "chunks": [c.model_dump() for c in chunk_index],
+        },
+    )
+    return chunk_index
+
+
+def _extraction_model_stage(fields: list[dict], cancel: CancelToken | None) -> type[BaseModel]:
+    """抽出スキーマのPydanticモデル"""
+    return get_registry().compile(fields).model
+
+
+def _group_stage(
+    split: list[dict],
+    fields: list[dict],
+    group_step: StepModel,
+    cancel: CancelToken | None,
+) -> GroupingResult | None:
+    """Step 5. フィールドグルーピング + クエリ生成（スキーマ × モデル単位でキャッシュ）。直接抽出ならNone。
+
+    文書の中身には依存しないため、チャンク生成（Step 3）と並行に実行できる。
+    """
+    if len(split) <= 1:
+        return None
+    field_groups = get_registry().grouping(fields, group_step, cancel)
+
+    # グルーピング結果をJSON出力
+    _save_json_log(
+        "field_groups",
+        {
+            "model": group_step.model,
+            "field_definitions": fields,
+            "groups": [g.model_dump() for g in field_groups.groups],
+        },
+    )
+    return field_groups
+
+
+def _search_stage(
+    chunk: ChunkIndex | None,
+    group: GroupingResult | None,
+    search_step: StepModel,
+    cancel: CancelToken | None,
+) -> list[ChunkHit] | None:
+    """Step 6. チャンク検索（関連度スコア付き）。直接抽出ならNone。"""
+    if chunk is None or group is None:
+        return None
+    hits = search_chunks(chunk, group, search_step, cancel)
+
+    # 検索結果をJSON出力
+    _save_json_log(
+        "search_results",
+        {
+            "model": search_step.model,
+            "total_chunks": len(chunk),
+            "matched_chunks": len(hits),
+            "matched": [h.model_dump() for h in hits],
+        },
+    )
+    return hits
+
+
+def _merge_stage(
+    pdf_path: Path,
+    split: list[dict],
+    chunk: ChunkIndex | None,
+    search: list[ChunkHit] | None,
+    context_token_budget: int,
+    max_contexts: int,
+    cancel: CancelToken | None,
+) -> list[ExtractionContext]:
+    """Step 7. コンテキスト統合（関連度順・トークン予算内、必要なら複数に分割）。
+
+    直接抽出の文書では文書全体を1つのコンテキストとする。
+    """
+    if chunk is None or search is None:
+        # 直接抽出: そのまま丸ごと投入（Step 5-7スキップ）
+        batch = split[0]
+        return [
+            ExtractionContext(
+                pdf_bytes=batch["pdf_bytes"],
+                page_count=batch["page_count"],
+                page_map=list(range(batch["page_start"], batch["page_end"] + 1)),
+            )
+        ]
+
+    contexts = build_extraction_contexts(
+        search,
+        pdf_path,
+        token_budget=context_token_budget,
+        max_contexts=max_contexts,
+        chunk_index=chunk,
+    )
+
+    packed_in = {chunk_id: n for n, c in enumerate(contexts) for chunk_id in c.chunk_ids}
+    _save_json_log(
+        "extraction_context",
+        {
+            "source_pdf": str(pdf_path),
+            "context_token_budget": context_token_budget,
+            "contexts": [
+                {
+                    "context_pdf_bytes": len(c.pdf_bytes),
+                    "context_pdf_pages": c.page_count,
+                    "context_estimated_tokens": c.estimated_tokens,
+                    "source_page_ranges": c.source_ranges(),
+                }
+                for c in contexts
+            ],
+            "source_chunks": [
+                {
+                    "chunk_id": h.chunk.chunk_id,
+                    "page_start": h.chunk.page_start,
+                    "page_end": h.chunk.page_end,
+                    "relevance": h.relevance,
+                    "score": h.score,
+                    "context": packed_in.get(h.chunk.chunk_id),
+                    "query": h.chunk.query,
+                    "description": h.chunk.description,
+                }
+                for h in search
+            ],
+        },
+    )
+    return contexts
+
+
+def _extract_stage(
+    merge: list[ExtractionContext],
+    fields: list[dict],
+    extraction_model: type[BaseModel],
+    extract_step: StepModel,
+    reconcile: bool,
+    on_field: Callable[[str, Any], None] | None,
+    cancel: CancelToken | None,
+) -> BaseModel:
+    """Step 8. 構造化抽出"""
+    prepared = PreparedExtraction(fields, extraction_model, merge, extract_step)
+    return extract_prepared(prepared, reconcile=reconcile, on_field=on_field, cancel=cancel)
+
+
+def _postprocess_stage(extract: BaseModel, fields: list[dict], cancel: CancelToken | None) -> list[dict]:
+    """Step 9. 後処理"""
+    results = postprocess_result(extract, fields)
+
+    # 最終結果をJSON出力
+    _save_json_log("extraction_result", results)
+    return results
+
+
+# Step 2-9 のステージ（Step 1 の変換を含むグラフは pipeline_graph.py）。
+# 新しいステージはここにノードを追加し、下流ノードの inputs に名前を加える
+STAGES = [
+    Stage("route", _route_stage, inputs=("pdf_path", "expected_schema_runs", "metadata")),
+    Stage("split", _split_stage, inputs=("pdf_path", "route")),
+    Stage(
+        "chunk",
+        _chunk_stage,
+        inputs=("pdf_path", "split", "chunk_step", "resume", "fallback_on_error", "dedup", "metadata"),
+        concurrency=CLASS_LLM,
+    ),
+    Stage("extraction_model", _extraction_model_stage, inputs=("fields",)),
+    Stage("group", _group_stage, inputs=("split", "fields", "group_step"), concurrency=CLASS_LLM),
+    Stage("search", _search_stage, inputs=("chunk", "group", "search_step"), concurrency=CLASS_LLM),
+    Stage(
+        "merge",
+        _merge_stage,
+        inputs=("pdf_path", "split", "chunk", "search", "context_token_budget", "max_contexts"),
+    ),
+    Stage(
+        "extract",
+        _extract_stage,
+        inputs=("merge", "fields", "extraction_model", "extract_step", "reconcile", "on_field"),
+        concurrency=CLASS_LLM,
+    ),
+    Stage("postprocess", _postprocess_stage, inputs=("extract", "fields")),
+]
+
+
+def _run_stages(inputs: dict[str, Any], targets: list[str], cancel: CancelToken | None) -> dict[str, Any]:
+    """STAGES の targets を実行する（メモ化しない）。
+
+    ステージの同時実行数の制限は呼び出しごとにかける（プロセス全体の送信レートはガバナーが制御する）。
+    """
+    return StageGraph(STAGES).run(inputs, targets=targets, cancel=cancel)
+
+
 def build_index(
     pdf_path: Path,
-) -> tuple[Path, list[dict], list[SemanticChunk] | None]:
+    expected_schema_runs: int | None = None,
+    metadata: dict | None = None,
+    models: ModelRoutingTable | dict[str, str | StepModel] | None = None,
+    cancel: CancelToken | None = None,
+    resume: bool = True,
+    fallback_on_error: bool | None = None,
+    dedup: bool | None = None,
+) -> tuple[Path, list[dict], ChunkIndex | None]:
     """フェーズ1: インデックス構築（ファイルアップロード時に1回だけ実行）。
 
+    文書全体のトークン見積もりと想定スキーマ実行回数から、
+    直接抽出かインデックス検索かを決めてからバッチ分割する。
+
+    チャンク生成はバッチ単位でチェックポイントに保存し、同じ文書の構築をやり直した場合
+    （一部のバッチの失敗・プロセスの再起動など）は未完了のバッチだけをAPIに送る。
+
     Args:
         pdf_path: PDFファイルパス
+        expected_schema_runs: この文書に対する想定スキーマ実行回数（Noneなら設定値）
+        metadata: 渡された場合、ルーティング結果を "route"、使用モデルを "models"、
+            チェックポイントから再利用したバッチ数を "resumed_batches"、
+            テキスト抽出に切り替えたバッチ番号を "fallback_batches"、
+            類似文書からチャンクを再利用したページ数を "dedup_pages" キーに書き込む
+        models: ステップ別モデルの上書き（{ステップ名: モデルID}。Noneなら環境変数・既定値）
+        cancel: 取消トークン。取り消されたら未送信のバッチは送信せず、送信中のリクエストは中断する
+        resume: バッチ単位のチェックポイントを保存・再利用するか
+        fallback_on_error: チャンク生成に失敗したバッチを（PDF処理エラー以外でも）テキスト抽出に
+            切り替えて構築を続けるか（Noneなら環境変数 DEMO_A_INDEX_FALLBACK=1 で有効）
+        dedup: ほかの索引済み文書と一致するページのチャンクを再利用するか
+            （resume=True の場合のみ。Noneなら環境変数 DEMO_A_PAGE_DEDUP=0 で無効、それ以外は有効）
 
     Returns:
         (pdf_path, batches, chunk_index)
-        chunk_index は100ページ以下の文書ではNone
+        chunk_index は直接抽出と判定された文書ではNone
+
+    Raises:
+        OperationCancelledError: cancel が取り消された
+    """
+    outputs = _run_stages(
+        {
+            "pdf_path": pdf_path,
+            "expected_schema_runs": expected_schema_runs,
+            "metadata": metadata,
+            "chunk_step": resolve_model_routing(models).step(STAGE_CHUNK),
+            "resume": resume,
+            "fallback_on_error": fallback_on_error,
+            "dedup": dedup,
+        },
+        targets=["split", "chunk"],
+        cancel=cancel,
+    )
+    return pdf_path, outputs["split"], outputs["chunk"]
+
+
+@dataclass
+class PreparedExtraction:
+    """Step 5-7 の結果（抽出コンテキストまで組み立てた状態）。
+
+    スキーマと構築済みインデックスだけで決まるため、抽出実行前に先行して作っておける。
+    run_extraction() に渡して Step 8-9 を実行する。
     """
-    batches = load_and_split(pdf_path)
 
-    chunk_index = None
-    if len(batches) > 1:
-        chunk_index = build_document_index(batches)
+    field_definitions: list[dict]
+    extraction_model: type[BaseModel]
+    contexts: list[ExtractionContext]
+    extract_step: StepModel
+    models: dict[str, str] = field(default_factory=dict)
+
+
+def prepare_extraction(
+    pdf_path: Path,
+    batches: list[dict],
+    chunk_index: ChunkIndex | None,
+    field_definitions: list[dict],
+    context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    max_contexts: int = 1,
+    models: ModelRoutingTable | dict[str, str | StepModel] | None = None,
+    cancel: CancelToken | None = None,
+) -> PreparedExtraction:
+    """フェーズ2前半: フィールドグルーピング → チャンク検索 → コンテキスト統合（Step 5-7）。
+
+    直接抽出の文書では Step 5-7 を行わず、文書全体を1つのコンテキストとする。
+    引数は extract_with_schema() と同じ。
+    """
+    routing = resolve_model_routing(models)
+    extract_step = routing.step(STAGE_EXTRACT)
+    used_models = {STAGE_EXTRACT: extract_step.model}
+    if chunk_index is not None:
+        used_models[STAGE_GROUP] = routing.step(STAGE_GROUP).model
+        used_models[STAGE_SEARCH] = routing.step(STAGE_SEARCH).model
+
+    outputs = _run_stages(
+        {
+            "pdf_path": pdf_path,
+            "split": batches,
+            "chunk": chunk_index,
+            "fields": field_definitions,
+            "group_step": routing.step(STAGE_GROUP),
+            "search_step": routing.step(STAGE_SEARCH),
+            "context_token_budget": context_token_budget,
+            "max_contexts": max_contexts,
+        },
+        targets=["extraction_model", "merge"],
+        cancel=cancel,
+    )
+    return PreparedExtraction(
+        field_definitions, outputs["extraction_model"], outputs["merge"], extract_step, used_models
+    )
+
+
+def extract_prepared(
+    prepared: PreparedExtraction,
+    reconcile: bool = True,
+    on_field: Callable[[str, Any], None] | None = None,
+    cancel: CancelToken | None = None,
+) -> BaseModel:
+    """構造化抽出（Step 8）。後処理前の抽出モデルのインスタンスを返す。
+
+    引数は extract_with_schema() と同じ。
+    """
+    field_definitions = prepared.field_definitions
+    extraction_model = prepared.extraction_model
+    contexts = prepared.contexts
+    extract_step = prepared.extract_step
+
+    # Step 8. 構造化抽出（コンテキストが複数なら並列に抽出してフィールドごとに統合）
+    if len(contexts) == 1:
+        extracted = extract_structured_data(
+            contexts[0].pdf_bytes,
+            field_definitions,
+            extraction_model,
+            on_field=on_field,
+            step=extract_step,
+            cancel=cancel,
+        )
+    else:
+        with ThreadPoolExecutor(max_workers=len(contexts)) as executor:
+            partials = list(
+                executor.map(
+                    lambda c: extract_structured_data(
+                        c.pdf_bytes, field_definitions, extraction_model, step=extract_step, cancel=cancel
+                    ),
+                    contexts,
+                )
+            )
+        extracted, conflicts = reduce_extractions(partials, field_definitions, extraction_model)
+
+        resolved = {}
+        if conflicts and reconcile:
+            resolved = reconcile_conflicts(
+                conflicts,
+                field_definitions,
+                [c.source_ranges() for c in contexts],
+                step=extract_step,
+                cancel=cancel,
+            )
+            extracted = extraction_model(**{**extracted.model_dump(), **resolved})
 
-        # チャンクインデックスをJSON出力
         _save_json_log(
-            "chunk_index",
+            "map_reduce",
             {
-                "source_pdf": str(pdf_path),
-                "total_batches": len(batches),
-                "batches": [
-                    {
-                        "id": b["id"],
-                        "label": b["label"],
-                        "page_start": b["page_start"],
-                        "page_end": b["page_end"],
-                        "page_count": b["page_count"],
-                    }
-                    for b in batches
-                ],
-                "total_chunks": len(chunk_index),
-                "chunks": [c.model_dump() for c in chunk_index],
+                "partials": [p.model_dump() for p in partials],
+                "conflicts": conflicts,
+                "resolved": resolved,
+                "reduced": extracted.model_dump(),
             },
         )
 
-    return pdf_path, batches, chunk_index
+    return extracted
+
+
+def run_extraction(
+    prepared: PreparedExtraction,
+    reconcile: bool = True,
+    on_field: Callable[[str, Any], None] | None = None,
+    cancel: CancelToken | None = None,
+) -> list[dict]:
+    """フェーズ2後半: 構造化抽出 → 後処理（Step 8-9）。
+
+    引数は extract_with_schema() と同じ。
+    """
+    outputs = _run_stages(
+        {
+            "merge": prepared.contexts,
+            "fields": prepared.field_definitions,
+            "extraction_model": prepared.extraction_model,
+            "extract_step": prepared.extract_step,
+            "reconcile": reconcile,
+            "on_field": on_field,
+        },
+        targets=["postprocess"],
+        cancel=cancel,
+    )
+    return outputs["postprocess"]
 
 
 def extract_with_schema(
     pdf_path: Path,
     batches: list[dict],
-    chunk_index: list[SemanticChunk] | None,
+    chunk_index: ChunkIndex | None,
     field_definitions: list[dict],
+    context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    max_contexts: int = 1,
+    reconcile: bool = True,
+    on_field: Callable[[str, Any], None] | None = None,
+    models: ModelRoutingTable | dict[str, str | StepModel] | None = None,
+    metadata: dict | None = None,
+    cancel: CancelToken | None = None,
 ) -> list[dict]:
     """フェーズ2: 検索→抽出（スキーマ提出ごとに実行）。
 
     スキーマを変えて再実行する場合、この関数だけ呼び直す。
+    max_contexts > 1 の場合、1つのコンテキストに収まらない関連ページを
+    複数のコンテキストに分けて並列に抽出し、フィールドごとに統合する（map-reduce）。
+    Step 5-7 と Step 8-9 は prepare_extraction() / run_extraction() で分けて実行することもできる。
 
     Args:
         pdf_path: 元PDFファイルパス
         batches: フェーズ1で作成されたバッチ
-        chunk_index: セマンティックチャンクインデックス（小文書ではNone）
+        chunk_index: セマンティックチャンクインデックス（直接抽出の文書ではNone）
         field_definitions: 抽出フィールド定義
+        context_token_budget: 大きい文書で抽出に渡すコンテキストの入力トークン予算（1つあたり）
+        max_contexts: 大きい文書で作成するコンテキストの最大数
+        reconcile: map-reduce時、値が食い違ったフィールドをLLMで再判定するか
+        on_field: 指定した場合、Step 8 をストリーミングで受信し、値が確定したフィールドから
+            (フィールド名, 値) で呼ぶ（map-reduce時は統合後の値のみ確定するため呼ばない）
+        models: ステップ別モデルの上書き（{ステップ名: モデルID}。Noneなら環境変数・既定値）
+        metadata: 渡された場合、使用したステップ別モデルを "models" キーに書き込む
+        cancel: 取消トークン。取り消されたら以降のステップは実行せず、送信中のリクエストは中断する
 
     Returns:
         抽出結果リスト
+
+    Raises:
+        OperationCancelledError: cancel が取り消された
     """
-    extraction_model = build_extraction_schema(field_definitions)
+    prepared = prepare_extraction(
+        pdf_path,
+        batches,
+        chunk_index,
+        field_definitions,
+        context_token_budget=context_token_budget,
+        max_contexts=max_contexts,
+        models=models,
+        cancel=cancel,
+    )
+    if metadata is not None:
+        metadata["models"] = prepared.models
+    return run_extraction(prepared, reconcile=reconcile, on_field=on_field, cancel=cancel)
 
-    if chunk_index is None:
-        # 小さい文書: そのまま丸ごとSonnetに投入（Step 5-7スキップ）
-        extracted = extract_structured_data(
-            batches[0]["pdf_bytes"],
-            field_definitions,
-            extraction_model,
-        )
-    else:
-        # 大きい文書: クエリベース検索 → コンテキスト統合 → 抽出
-        # Step 5. フィールドグルーピング + クエリ生成
-        field_groups = group_fields(field_definitions)
 
-        # グルーピング結果をJSON出力
-        _save_json_log(
-            "field_groups",
-            {
-                "field_definitions": field_definitions,
-                "groups": [g.model_dump() for g in field_groups.groups],
-            },
-        )
+# 一括抽出で1回の呼び出しに含めるフィールド数の上限
+MAX_FUSED_FIELDS_PER_CALL = 40
 
-        # Step 6. チャンク検索
-        search_results = search_chunks(chunk_index, field_groups)
 
-        # 検索結果をJSON出力
-        _save_json_log(
-            "search_results",
-            {
-                "total_chunks": len(chunk_index),
-                "matched_chunks": len(search_results),
-                "matched": [c.model_dump() for c in search_results],
-            },
-        )
+def fuse_field_definitions(schemas: list[dict]) -> tuple[list[dict], list[dict[str, str]]]:
+    """複数スキーマのフィールド定義を1つにまとめる。
 
-        # Step 7. コンテキスト統合
-        context_pdf = build_extraction_context(
-            search_results,
-            pdf_path,
-        )
+    名前・型・説明がすべて同じフィールドは共有し、名前だけが同じで定義が異なるフィールドは
+    "<名前>_<スキーマ番号>" に改名して区別する。改名後の名前がいずれかのスキーマの元のフィールド名や
+    統合済みのフィールド名と重なる場合は、重ならなくなるまで番号を進める。
 
-        # コンテキストPDFのページ数を確認してログ出力
-        ctx_doc = pymupdf.open(stream=context_pdf, filetype="pdf")
-        ctx_pages = len(ctx_doc)
-        ctx_doc.close()
+    Args:
+        schemas: [{"name": str, "fields": list[dict]}, ...]
 
-        _save_json_log(
-            "extraction_context",
-            {
-                "source_pdf": str(pdf_path),
-                "context_pdf_bytes": len(context_pdf),
-                "context_pdf_pages": ctx_pages,
-                "source_chunks": [
-                    {
-                        "chunk_id": c.chunk_id,
-                        "page_start": c.page_start,
-                        "page_end": c.page_end,
-                        "query": c.query,
-                        "description": c.description,
-                    }
-                    for c in search_results
-                ],
-            },
-        )
+    Returns:
+        (統合したフィールド定義, スキーマごとの {元のフィールド名: 統合後のフィールド名})
+    """
+    fused: list[dict] = []
+    by_name: dict[str, dict] = {}
+    mappings: list[dict[str, str]] = []
+    # 後続のスキーマが本当に持っている "<名前>_2" などと改名後の名前が混ざらないよう、元の名前を予約する
+    reserved = {f["name"] for schema in schemas for f in schema["fields"]}
+    for number, schema in enumerate(schemas, start=1):
+        mapping = {}
+        for f in schema["fields"]:
+            name = f["name"]
+            existing = by_name.get(name)
+            if existing is not None and (existing["type"], existing["description"]) != (f["type"], f["description"]):
+                suffix = number
+                name = f"{f['name']}_{suffix}"
+                while name in reserved or name in by_name:
+                    suffix += 1
+                    name = f"{f['name']}_{suffix}"
+                existing = None
+            if existing is None:
+                by_name[name] = {**f, "name": name}
+                fused.append(by_name[name])
+            mapping[f["name"]] = name
+        mappings.append(mapping)
+    return fused, mappings
 
-        # Step 8. 構造化抽出
-        extracted = extract_structured_data(
-            context_pdf,
-            field_definitions,
-            extraction_model,
+
+def _partition_fields(schemas: list[dict], mappings: list[dict[str, str]], limit: int) -> list[list[str]]:
+    """統合後のフィールド名を、1回の抽出呼び出しあたり limit 件以下に分ける（スキーマ単位でなるべくまとめる）。"""
+    parts: list[list[str]] = [[]]
+    seen: set[str] = set()
+    for schema, mapping in zip(schemas, mappings):
+        names = [mapping[f["name"]] for f in schema["fields"] if mapping[f["name"]] not in seen]
+        seen.update(names)
+        if parts[-1] and len(parts[-1]) + len(names) > limit:
+            parts.append([])
+        for name in names:
+            if len(parts[-1]) >= limit:
+                parts.append([])
+            parts[-1].append(name)
+    return [part for part in parts if part]
+
+
+def extract_all(
+    pdf_path: Path,
+    batches: list[dict],
+    chunk_index: ChunkIndex | None,
+    schemas: list[dict],
+    context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    max_contexts: int = 1,
+    reconcile: bool = True,
+    models: ModelRoutingTable | dict[str, str | StepModel] | None = None,
+    metadata: dict | None = None,
+    max_fields_per_call: int = MAX_FUSED_FIELDS_PER_CALL,
+    cancel: CancelToken | None = None,
+) -> list[list[dict]]:
+    """複数スキーマの一括抽出（Step 5-7 を1回だけ行い、抽出結果をスキーマごとに分ける）。
+
+    全スキーマのフィールドを統合してグルーピング・検索・コンテキスト統合を1回で行い、
+    同じコンテキストに対してフィールドを max_fields_per_call 件ずつに分けた抽出を並列に実行する。
+    スキーマごとに extract_with_schema() を呼ぶ場合と比べ、検索・コンテキストPDFの作成と
+    文書の送信がスキーマ数倍ではなく1回（フィールドが多い場合は数回の並列呼び出し）で済む。
+
+    Args:
+        pdf_path: 元PDFファイルパス
+        batches: フェーズ1で作成されたバッチ
+        chunk_index: セマンティックチャンクインデックス（直接抽出の文書ではNone）
+        schemas: [{"name": str, "fields": list[dict]}, ...]
+        context_token_budget: extract_with_schema() と同じ
+        max_contexts: extract_with_schema() と同じ
+        reconcile: extract_with_schema() と同じ
+        models: extract_with_schema() と同じ
+        metadata: 渡された場合、使用したステップ別モデルを "models"、抽出呼び出しの分割を "fused_calls" に書き込む
+        max_fields_per_call: 1回の抽出呼び出しに含めるフィールド数の上限
+        cancel: extract_with_schema() と同じ
+
+    Returns:
+        schemas と同じ順の、スキーマごとの抽出結果リスト（extract_with_schema() の戻り値と同じ形式）
+    """
+    fused_fields, mappings = fuse_field_definitions(schemas)
+    prepared = prepare_extraction(
+        pdf_path,
+        batches,
+        chunk_index,
+        fused_fields,
+        context_token_budget=context_token_budget,
+        max_contexts=max_contexts,
+        models=models,
+        cancel=cancel,
+    )
+
+    parts = _partition_fields(schemas, mappings, max_fields_per_call)
+    fields_by_name = {f["name"]: f for f in fused_fields}
+    registry = get_registry()
+
+    def _run(names: list[str]) -> list[dict]:
+        part_fields = [fields_by_name[name] for name in names]
+        part = replace(
+            prepared,
+            field_definitions=part_fields,
+            extraction_model=registry.compile(part_fields).model,
         )
+        return run_extraction(part, reconcile=reconcile, cancel=cancel)
 
-    # Step 9. 後処理
-    results = postprocess_result(extracted, field_definitions)
+    if len(parts) == 1:
+        fused_results = _run(parts[0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            fused_results = [r for results in executor.map(_run, parts) for r in results]
 
-    # 最終結果をJSON出力
-    _save_json_log("extraction_result", results)
+    if metadata is not None:
+        metadata["models"] = prepared.models
+        metadata["fused_calls"] = [len(part) for part in parts]
 
-    return results
+    by_name = {r["field_name"]: r for r in fused_results}
+    return [
+        [
+            {**by_name[mapping[f["name"]]], "field_name": f["name"], "description": f["description"]}
+            for f in schema["fields"]
+        ]
+        for schema, mapping in zip(schemas, mappings)
+    ]
@@ -0,0 +1,190 @@
+"""デモA パイプライン（Step 1-9）のステージグラフ
+
+pipeline.STAGES（Step 2-9）の前に Step 1 の変換ノードを加え、ファイル1件 × スキーマ1件を1つのグラフで実行する。
+
+    pdf_path → route → split → chunk ──────────┐
+                         └→ group → search → merge → extract → postprocess
+    fields ─────────────────┘
+
+グルーピング（Step 5）は文書に依存しないため、チャンク生成（Step 3）と並行に実行する。
+ノード出力はプロセス内の StageCache にメモ化するため、同じ文書でスキーマだけを変えて
+run_pipeline() を呼び直すと、変換〜チャンク生成はキャッシュから返り、group 以降だけが実行される。
+キャッシュはバッチPDFなどの出力の合計バイト数（環境変数 DEMO_A_STAGE_CACHE_BYTES、
+既定 stage_graph.DEFAULT_CACHE_MAX_BYTES）を超えたら、最近使われていない出力から捨てる。
+
+使用例:
+    python -m app.demo_a.pipeline_graph contract.pdf --preset 引合概要 --preset 契約条件
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+from app.demo_a import pipeline
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.converter import TextContent, ensure_pdf
+from app.demo_a.llm_client import STAGE_CHUNK, STAGE_EXTRACT, STAGE_GROUP, STAGE_SEARCH, load_env
+from app.demo_a.merger import DEFAULT_CONTEXT_TOKEN_BUDGET
+from app.demo_a.model_routing import ModelRoutingTable, StepModel, resolve_model_routing
+from app.demo_a.presets import get_preset
+from app.demo_a.stage_graph import (
+    CLASS_IO,
+    DEFAULT_CACHE_MAX_BYTES,
+    Stage,
+    StageCache,
+    StageEvent,
+    StageGraph,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT_DIR = Path("output/converted")
+
+# LibreOfficeは同一プロファイルでの同時起動に対応しないため、変換だけは直列化する
+_convert_lock = threading.Lock()
+
+
+def _convert(file_path: Path, output_dir: Path, cancel: CancelToken | None) -> Path:
+    """Step 1. ファイル → PDF"""
+    with _convert_lock:
+        result = ensure_pdf(file_path, output_dir=output_dir)
+    if isinstance(result, TextContent):
+        raise ValueError("テキストファイルはPDFパイプラインに未対応")
+    return result
+
+
+STAGES = [Stage("pdf_path", _convert, inputs=("file_path", "output_dir"), concurrency=CLASS_IO), *pipeline.STAGES]
+
+_graph: StageGraph | None = None
+_cache: StageCache | None = None
+_graph_lock = threading.Lock()
+
+
+def get_pipeline_graph() -> StageGraph:
+    """パイプラインのステージグラフ（シングルトン）。"""
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = StageGraph(STAGES)
+        return _graph
+
+
+def get_stage_cache() -> StageCache:
+    """run_pipeline() が既定で使うノード出力のキャッシュ（シングルトン）。"""
+    global _cache
+    with _graph_lock:
+        if _cache is None:
+            _cache = StageCache(max_bytes=int(os.getenv("DEMO_A_STAGE_CACHE_BYTES", DEFAULT_CACHE_MAX_BYTES)))
+        return _cache
+
+
+def set_stage_cache(cache: StageCache) -> None:
+    """キャッシュを差し替える（テスト・キャッシュの破棄用）。"""
+    global _cache
+    with _graph_lock:
+        _cache = cache
+
+
+def run_pipeline(
+    file_path: Path,
+    field_definitions: list[dict],
+    output_dir: Path = DEFAULT_OUTPUT_DIR,
+    expected_schema_runs: int | None = None,
+    context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    max_contexts: int = 1,
+    reconcile: bool = True,
+    models: ModelRoutingTable | dict[str, str | StepModel] | None = None,
+    on_event: Callable[[StageEvent], None] | None = None,
+    cancel: CancelToken | None = None,
+    cache: StageCache | None = None,
+) -> list[dict]:
+    """ファイル1件 × スキーマ1件を Step 1-9 のステージグラフで処理する。
+
+    ステップ別モデルはステップごとにグラフ入力とするため、例えば抽出モデルだけを変えた場合は
+    extract 以降だけが再実行される。
+
+    Args:
+        file_path: 入力ファイルパス
+        field_definitions: 抽出フィールド定義
+        output_dir: PDF変換の出力先
+        expected_schema_runs: build_index() と同じ
+        context_token_budget: extract_with_schema() と同じ
+        max_contexts: extract_with_schema() と同じ
+        reconcile: extract_with_schema() と同じ
+        models: ステップ別モデルの上書き（{ステップ名: モデルID}。Noneなら環境変数・既定値）
+        on_event: ノードの開始・完了・キャッシュ利用を受け取るコールバック
+        cancel: 取消トークン
+        cache: ノード出力のキャッシュ（Noneなら get_stage_cache()）
+
+    Returns:
+        抽出結果リスト（extract_with_schema() の戻り値と同じ形式）
+
+    Raises:
+        OperationCancelledError: cancel が取り消された
+    """
+    routing = resolve_model_routing(models)
+    inputs = {
+        "file_path": file_path,
+        "output_dir": output_dir,
+        "expected_schema_runs": expected_schema_runs,
+        "metadata": None,
+        "resume": True,
+        "fallback_on_error": None,
+        "dedup": None,
+        "fields": field_definitions,
+        "context_token_budget": context_token_budget,
+        "max_contexts": max_contexts,
+        "reconcile": reconcile,
+        "on_field": None,
+        "chunk_step": routing.step(STAGE_CHUNK),
+        "group_step": routing.step(STAGE_GROUP),
+        "search_step": routing.step(STAGE_SEARCH),
+        "extract_step": routing.step(STAGE_EXTRACT),
+    }
+    outputs = get_pipeline_graph().run(
+        inputs,
+        targets=["postprocess"],
+        cache=cache if cache is not None else get_stage_cache(),
+        on_event=on_event,
+        cancel=cancel,
+    )
+    return outputs["postprocess"]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.demo_a.pipeline_graph", description="ステージグラフでファイル × スキーマを順に抽出する"
+    )
+    parser.add_argument("file", type=Path, help="入力ファイル")
+    parser.add_argument("-p", "--preset", action="append", required=True, help="プリセット名（複数指定可。順に実行）")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    load_env()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    if not args.file.is_file():
+        parser.error(f"ファイルが見つかりません: {args.file}")
+
+    def _print_event(event: StageEvent) -> None:
+        detail = f" {event.seconds}秒" if event.seconds else ""
+        detail += f" {event.error}" if event.error else ""
+        print(f"  {event.stage}: {event.status}{detail}", file=sys.stderr)
+
+    for name in args.preset:
+        try:
+            fields = get_preset(name)["fields"]
+        except KeyError as e:
+            parser.error(str(e))
+        print(f"[{name}]", file=sys.stderr)
+        results = run_pipeline(args.file, fields, on_event=_print_event)
+        print(json.dumps({"file": str(args.file), "preset": name, "results": results}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""フェーズ2の投機実行（抽出ボタンが押される前に Step 5-7 を先行実行する）
+
+グルーピング・チャンク検索・コンテキスト統合は構築済みインデックスと選択中のスキーマだけで決まる。
+UIでスキーマの選択がしばらく変わらなければ、その (文書, スキーマ) の組で prepare_extraction() を
+バックグラウンドで始めておき、ボタンが押されたら結果をそのまま使う。
+
+    prefetch = SpeculativePrefetch()
+    prefetch.request(key, lambda cancel: prepare_extraction(..., cancel=cancel))   # 選択が変わるたびに呼ぶ
+    ...
+    prepared = prefetch.take(key)   # 同じキーの投機結果（実行中なら完了を待つ）。なければNone
+
+選択が変わって別のキーが要求されると、前のキーの投機は取り消す。
+待機中（デバウンス中）なら実行せず、実行中なら fn に渡した CancelToken を取り消す
+（パイプラインに渡しておけば送信中のリクエストも中断される）。
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+from app.demo_a.cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# 選択がこの秒数変わらなければ投機実行を始める
+DEFAULT_DEBOUNCE = 0.8
+
+STATE_WAITING = "waiting"  # デバウンス中
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+STATE_CANCELLED = "cancelled"
+
+
+class _Speculation:
+    """1キー分の投機実行。"""
+
+    def __init__(self, key: str, fn: Callable[[CancelToken], Any]) -> None:
+        self.key = key
+        self.fn = fn
+        self.state = STATE_WAITING
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.seconds = 0.0
+        self.cancel = CancelToken()
+        self.wakeup = threading.Event()  # デバウンスを打ち切る（取消・即時採用）
+        self.done = threading.Event()
+
+
+class SpeculativePrefetch:
+    """直近に要求された1キーだけを投機実行する（UIセッションごとに1つ持つ）。
+
+    Args:
+        debounce: 要求から実行開始までの待ち時間（秒）。この間に別のキーが要求されたら実行しない
+    """
+
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE) -> None:
+        self.debounce = debounce
+        self._current: _Speculation | None = None
+        self._lock = threading.Lock()
+
+    def request(self, key: str, fn: Callable[[CancelToken], Any]) -> None:
+        """key の投機実行を要求する。同じキーが待機中・実行中・完了済みなら何もしない。
+
+        Args:
+            key: 投機結果を識別するキー（文書・スキーマのフィンガープリントなど）
+            fn: 実行する処理。取消されたら取り消される CancelToken を受け取る
+        """
+        with self._lock:
+            current = self._current
+            if current is not None and current.key == key and current.state not in (STATE_CANCELLED, STATE_FAILED):
+                return
+            if current is not None:
+                self._cancel(current)
+            spec = _Speculation(key, fn)
+            self._current = spec
+        threading.Thread(target=self._run, args=(spec,), name="phase2-prefetch", daemon=True).start()
+
+    def take(self, key: str, timeout: float | None = None) -> Any | None:
+        """key の投機結果を採用する。
+
+        デバウンス中ならすぐに実行を始め、実行中なら完了を待つ。
+
+        Returns:
+            投機結果。キーが違う・取消済み・失敗・タイムアウトの場合はNone
+        """
+        with self._lock:
+            spec = self._current
+        if spec is None or spec.key != key or spec.cancel.cancelled:
+            return None
+        spec.wakeup.set()
+        if not spec.done.wait(timeout):
+            return None
+        if spec.state != STATE_DONE:
+            return None
+        logger.info("投機実行の結果を採用: %s（%.2f秒）", key, spec.seconds)
+        return spec.result
+
+    def status(self) -> tuple[str | None, str | None]:
+        """(直近に要求されたキー, 状態 STATE_*)。"""
+        with self._lock:
+            spec = self._current
+        if spec is None:
+            return None, None
+        return spec.key, spec.state
+
+    def cancel(self) -> None:
+        """投機実行を取り消す。"""
+        with self._lock:
+            if self._current is not None:
+                self._cancel(self._current)
+                self._current = None
+
+    def _cancel(self, spec: _Speculation) -> None:
+        spec.cancel.cancel()
+        spec.wakeup.set()
+        if spec.state in (STATE_WAITING, STATE_RUNNING):
+            logger.info("投機実行を取消: %s", spec.key)
+
+    def _run(self, spec: _Speculation) -> None:
+        spec.wakeup.wait(self.debounce)
+        if spec.cancel.cancelled:
+            spec.state = STATE_CANCELLED
+            spec.done.set()
+            return
+
+        spec.state = STATE_RUNNING
+        t0 = time.perf_counter()
+        try:
+            result = spec.fn(spec.cancel)
+        except Exception as e:
+            spec.error = e
+            spec.state = STATE_CANCELLED if spec.cancel.cancelled else STATE_FAILED
+            if spec.state == STATE_FAILED:
+                logger.warning("投機実行に失敗: %s: %s", spec.key, e)
+        else:
+            spec.result = result
+            spec.state = STATE_CANCELLED if spec.cancel.cancelled else STATE_DONE
+        spec.seconds = round(time.perf_counter() - t0, 3)
+        spec.done.set()
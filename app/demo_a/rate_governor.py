@@ -0,0 +1,276 @@
+"""LLM呼び出しのプロセス全体レート制御（RPM / TPM / 優先度 / 429適応）
+
+全パイプラインステップ・全セッションの呼び出しを1つのガバナーに通し、
+    - リクエスト数/分（RPM）と入力トークン数/分（TPM）のトークンバケットで送信を制限
+    - 送信前に payload サイズからトークン数を見積もり、応答の usage で補正
+    - 429 / 529（overloaded）を受けたらプロセス全体でクールダウンし、送信レートを一時的に下げる
+    - 待機中の呼び出しは優先度順に送信する（Step 8 抽出 > Step 5-6 > Step 3 チャンク生成）
+
+設定は環境変数 DEMO_A_RPM / DEMO_A_TPM（0で無制限）。
+"""
+
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from app.demo_a.cancellation import CancelToken
+
+# 優先度（小さいほど先に送信）
+PRIORITY_INTERACTIVE = 0  # Step 8: 構造化抽出（ユーザーが結果を待っている）
+PRIORITY_NORMAL = 5  # Step 5-6: グルーピング・検索
+PRIORITY_BACKGROUND = 10  # Step 3: チャンク生成
+
+DEFAULT_RPM = 50
+DEFAULT_TPM = 400_000
+
+# トークン数見積もり用の係数（usageによる補正で実測値に寄せていく）
+_CHARS_PER_TOKEN = 2.5  # 日英混在テキスト
+_PDF_BYTES_PER_TOKEN = 20.0  # PDFドキュメントブロック（テキスト＋ページ画像）
+
+# 適応制御: 429で送信レートを半減し、成功ごとに少しずつ戻す
+_MIN_RATE_FACTOR = 0.1
+_RATE_DECREASE = 0.5
+_RATE_RECOVERY = 0.05
+
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+def backoff_delay(attempt: int, base: float = BASE_BACKOFF, cap: float = MAX_BACKOFF) -> float:
+    """Full jitter の指数バックオフ待ち時間（秒）。
+
+    並列リクエストのリトライ時刻がそろって再びバーストするのを防ぐため、
+    [0, min(cap, base * 2^attempt)] から一様に選ぶ。
+    """
+    return random.uniform(0, min(cap, base * (2**attempt)))
+
+
+def estimate_input_tokens(messages: list[dict]) -> int:
+    """messagesのpayloadサイズから入力トークン数を見積もる。"""
+    text_chars = 0
+    pdf_bytes = 0
+    for m in messages:
+        content = m["content"]
+        if isinstance(content, str):
+            text_chars += len(content)
+            continue
+        for block in content:
+            if block.get("type") == "text":
+                text_chars += len(block["text"])
+            elif block.get("type") == "document":
+                data = block["source"].get("data", "")
+                # base64 → 元のバイト数
+                pdf_bytes += len(data) * 3 // 4
+    return int(text_chars / _CHARS_PER_TOKEN + pdf_bytes / _PDF_BYTES_PER_TOKEN) + 1
+
+
+@dataclass
+class Ticket:
+    """acquire() で払い出した送信枠。settle() で実トークン数に補正する。"""
+
+    estimated_tokens: int
+    priority: int
+    waited: float
+
+
+class _Bucket:
+    """1分あたり capacity を補充するトークンバケット。capacity<=0 は無制限。"""
+
+    def __init__(self, capacity: float) -> None:
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float, factor: float) -> None:
+        if self.unlimited:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0 * factor)
+        self.updated = now
+
+    def can_take(self, amount: float) -> bool:
+        # capacityより大きい要求は、満タンになった時点で通す（残高は負になる）
+        return self.unlimited or self.level >= min(amount, self.capacity)
+
+    def seconds_until(self, amount: float, factor: float) -> float:
+        if self.can_take(amount):
+            return 0.0
+        needed = min(amount, self.capacity) - self.level
+        return needed / (self.capacity / 60.0 * factor)
+
+
+class RateGovernor:
+    """プロセス全体で共有するLLM呼び出しのレート制御。
+
+    Args:
+        rpm: 1分あたりの最大リクエスト数（0で無制限）
+        tpm: 1分あたりの最大入力トークン数（0で無制限）
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM) -> None:
+        self._requests = _Bucket(rpm)
+        self._tokens = _Bucket(tpm)
+        self._factor = 1.0
+        self._cooldown_until = 0.0
+        self._estimate_ratio = 1.0  # 実トークン数 / 見積もり の移動平均
+
+        self._cond = threading.Condition()
+        self._waiters: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+
+        self._stats = {
+            "admitted": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "wait_seconds": 0.0,
+            "estimated_tokens": 0,
+            "actual_tokens": 0,
+        }
+
+    @property
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self._cooldown_until
+
+    def acquire(
+        self,
+        estimated_tokens: int,
+        priority: int = PRIORITY_NORMAL,
+        cancel: CancelToken | None = None,
+    ) -> Ticket:
+        """送信枠が空くまで待って取得する。待機中は優先度（同値なら到着順）で並ぶ。
+
+        Raises:
+            OperationCancelledError: 待機中に cancel が取り消された
+        """
+        tokens = max(1, int(estimated_tokens * self._estimate_ratio))
+        start = time.monotonic()
+        unregister = cancel.on_cancel(self._wake) if cancel is not None else None
+        with self._cond:
+            me = (priority, next(self._seq))
+            heapq.heappush(self._waiters, me)
+            try:
+                while True:
+                    if cancel is not None:
+                        cancel.raise_if_cancelled()
+                    now = time.monotonic()
+                    self._requests.refill(now, self._factor)
+                    self._tokens.refill(now, self._factor)
+
+                    if self._waiters[0] == me:
+                        wait = max(
+                            self._cooldown_until - now,
+                            self._requests.seconds_until(1, self._factor),
+                            self._tokens.seconds_until(tokens, self._factor),
+                        )
+                        if wait <= 0:
+                            self._requests.level -= 1
+                            self._tokens.level -= tokens
+                            break
+                        self._cond.wait(timeout=wait)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._waiters.remove(me)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                if unregister is not None:
+                    unregister()
+
+            waited = time.monotonic() - start
+            self._stats["admitted"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["estimated_tokens"] += tokens
+        return Ticket(estimated_tokens=tokens, priority=priority, waited=waited)
+
+    def settle(self, ticket: Ticket, actual_tokens: int | None) -> None:
+        """応答の usage で見積もりとの差をバケットに反映し、見積もり係数を補正する。
+
+        actual_tokens が None（エラー応答など）の場合は見積もり分を返却する。
+        """
+        with self._cond:
+            if actual_tokens is None:
+                self._tokens.level += ticket.estimated_tokens
+            else:
+                self._tokens.level -= actual_tokens - ticket.estimated_tokens
+                self._stats["actual_tokens"] += actual_tokens
+                raw_estimate = ticket.estimated_tokens / self._estimate_ratio
+                ratio = actual_tokens / max(1.0, raw_estimate)
+                self._estimate_ratio = min(10.0, max(0.1, 0.8 * self._estimate_ratio + 0.2 * ratio))
+            if not self._tokens.unlimited:
+                self._tokens.level = min(self._tokens.level, self._tokens.capacity)
+            self._cond.notify_all()
+
+    def _wake(self) -> None:
+        """待機中の acquire() に取消を確認させる。"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        with self._cond:
+            self._factor = min(1.0, self._factor + _RATE_RECOVERY)
+
+    def on_rate_limited(self, attempt: int, retry_after: float | None = None) -> float:
+        """429 / 529 を受けたときに呼ぶ。全呼び出しをクールダウンさせ、送信レートを下げる。
+
+        Returns:
+            設定したクールダウン秒数
+        """
+        delay = backoff_delay(attempt)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._cond:
+            self._stats["rate_limited"] += 1
+            self._factor = max(_MIN_RATE_FACTOR, self._factor * _RATE_DECREASE)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+            self._cond.notify_all()
+        return delay
+
+    def record_retry(self) -> None:
+        with self._cond:
+            self._stats["retries"] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "rate_factor": round(self._factor, 3),
+                "estimate_ratio": round(self._estimate_ratio, 3),
+                "waiting": len(self._waiters),
+                "cooldown_remaining": round(max(0.0, self._cooldown_until - time.monotonic()), 3),
+            }
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# シングルトンインスタンス（全クライアント・全セッションで共有）
+_governor: RateGovernor | None = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> RateGovernor:
+    """プロセス全体で共有するガバナーを取得する。"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = RateGovernor(
+                rpm=_env_int("DEMO_A_RPM", DEFAULT_RPM),
+                tpm=_env_int("DEMO_A_TPM", DEFAULT_TPM),
+            )
+        return _governor
+
+
+def set_governor(governor: RateGovernor) -> None:
+    """テスト用: ガバナーを差し替える。"""
+    global _governor
+    with _governor_lock:
+        _governor = governor
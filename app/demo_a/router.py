@@ -0,0 +1,146 @@
+"""Step 2前: 直接抽出 / インデックス検索 のルーティング（コスト見積もりによる判定）
+
+固定の「100ページ以下なら丸ごと投入」ではなく、ページテキストストアから見積もった
+文書全体のトークン数と、想定されるスキーマ実行回数から両戦略のコストを比べて選ぶ。
+
+    直接抽出:       スキーマ実行ごとに文書全体を送る           = runs × 文書トークン
+    インデックス検索: チャンク生成で文書を1回（＋オーバーラップ分）送り、
+                     実行ごとに関連ページのコンテキストを送る   = 構築 + runs × (コンテキスト + 検索)
+
+構築は文書トークンの約 batch_size / (batch_size - overlap) ≈ 1.11 倍なので、インデックス検索が
+選ばれるのは runs × (indexed_margin - relevant_fraction) > 1.11 のときだけ（検索の固定分を除く）。
+既定値（margin 0.8・関連割合 0.3）では runs ≥ 3 が必要で、runs = 2 では常に直接抽出になる。
+
+設定は環境変数で上書きできる:
+    DEMO_A_ROUTE                   direct / indexed で強制（省略時は自動）
+    DEMO_A_ROUTE_MAX_DIRECT_PAGES  直接抽出できる最大ページ数（APIのPDFページ数上限）
+    DEMO_A_ROUTE_MAX_DIRECT_TOKENS 直接抽出できる最大トークン数（コンテキストウィンドウ）
+    DEMO_A_EXPECTED_SCHEMA_RUNS    1文書あたりの想定スキーマ実行回数
+    DEMO_A_ROUTE_RELEVANT_FRACTION 1スキーマで関連するページの割合の見込み
+    DEMO_A_ROUTE_INDEXED_MARGIN    インデックス検索を選ぶのに必要なコスト比（小さいほど直接抽出寄り）
+"""
+
+import os
+from dataclasses import asdict, dataclass, field
+
+from app.demo_a.merger import DEFAULT_CONTEXT_TOKEN_BUDGET
+from app.demo_a.page_store import PageTextStore
+
+ROUTE_DIRECT = "direct"
+ROUTE_INDEXED = "indexed"
+
+# Step 6 の検索プロンプト（チャンク一覧）とグルーピングの1実行あたりの見込み
+SEARCH_OVERHEAD_TOKENS = 4_000
+
+
+@dataclass
+class RoutingConfig:
+    """ルーティングのしきい値。"""
+
+    max_direct_pages: int = 100
+    max_direct_tokens: int = 180_000
+    # 2回以下ではコスト比較でインデックス検索が選ばれないため、プリセット数（3）を既定とする
+    expected_schema_runs: int = 3
+    relevant_fraction: float = 0.3
+    # 抽出品質は文書全体を見る直接抽出の方が高いため、インデックス検索は十分安い場合だけ選ぶ
+    indexed_margin: float = 0.8
+    batch_size: int = 20
+    overlap: int = 2
+    context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET
+    force: str | None = None
+
+    @classmethod
+    def from_env(cls) -> "RoutingConfig":
+        """環境変数で上書きした設定を作る。"""
+        config = cls()
+        config.max_direct_pages = int(os.getenv("DEMO_A_ROUTE_MAX_DIRECT_PAGES", config.max_direct_pages))
+        config.max_direct_tokens = int(os.getenv("DEMO_A_ROUTE_MAX_DIRECT_TOKENS", config.max_direct_tokens))
+        config.expected_schema_runs = int(os.getenv("DEMO_A_EXPECTED_SCHEMA_RUNS", config.expected_schema_runs))
+        config.relevant_fraction = float(os.getenv("DEMO_A_ROUTE_RELEVANT_FRACTION", config.relevant_fraction))
+        config.indexed_margin = float(os.getenv("DEMO_A_ROUTE_INDEXED_MARGIN", config.indexed_margin))
+        force = os.getenv("DEMO_A_ROUTE", "").strip().lower()
+        if force in (ROUTE_DIRECT, ROUTE_INDEXED):
+            config.force = force
+        return config
+
+
+@dataclass
+class RouteDecision:
+    """ルーティング結果（実行メタデータ・ログに記録する）。"""
+
+    route: str
+    reason: str
+    total_pages: int
+    document_tokens: int
+    expected_schema_runs: int
+    direct_cost: int | None
+    indexed_cost: int | None
+    thresholds: dict = field(default_factory=dict)
+
+    @property
+    def split(self) -> bool:
+        return self.route == ROUTE_INDEXED
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def decide_route(
+    store: PageTextStore,
+    expected_schema_runs: int | None = None,
+    config: RoutingConfig | None = None,
+) -> RouteDecision:
+    """文書のトークン見積もりから、直接抽出かインデックス検索かを決める。
+
+    Args:
+        store: 文書のページテキストストア
+        expected_schema_runs: この文書に対する想定スキーマ実行回数（Noneなら設定値）
+        config: しきい値（Noneなら環境変数から）
+
+    Returns:
+        ルーティング結果
+    """
+    config = config or RoutingConfig.from_env()
+    runs = max(1, expected_schema_runs or config.expected_schema_runs)
+    total = len(store)
+    doc_tokens = sum(store.estimated_tokens(p) for p in range(1, total + 1))
+
+    direct_feasible = total <= config.max_direct_pages and doc_tokens <= config.max_direct_tokens
+    # 1バッチに収まる文書はチャンク生成しても検索対象が1つしかない
+    indexed_feasible = total > config.batch_size
+
+    direct_cost = runs * doc_tokens if direct_feasible else None
+    indexed_cost = None
+    if indexed_feasible:
+        build = int(doc_tokens * config.batch_size / (config.batch_size - config.overlap))
+        per_run = min(int(doc_tokens * config.relevant_fraction), config.context_token_budget) + SEARCH_OVERHEAD_TOKENS
+        indexed_cost = build + runs * per_run
+
+    def _decision(route: str, reason: str) -> RouteDecision:
+        return RouteDecision(
+            route=route,
+            reason=reason,
+            total_pages=total,
+            document_tokens=doc_tokens,
+            expected_schema_runs=runs,
+            direct_cost=direct_cost,
+            indexed_cost=indexed_cost,
+            thresholds={
+                "max_direct_pages": config.max_direct_pages,
+                "max_direct_tokens": config.max_direct_tokens,
+                "relevant_fraction": config.relevant_fraction,
+                "indexed_margin": config.indexed_margin,
+            },
+        )
+
+    if config.force == ROUTE_DIRECT and total <= config.max_direct_pages:
+        return _decision(ROUTE_DIRECT, "設定で直接抽出を指定")
+    if config.force == ROUTE_INDEXED and indexed_feasible:
+        return _decision(ROUTE_INDEXED, "設定でインデックス検索を指定")
+    if not direct_feasible and indexed_feasible:
+        return _decision(ROUTE_INDEXED, "文書全体が1回の抽出に収まらない")
+    if not indexed_feasible:
+        return _decision(ROUTE_DIRECT, f"{config.batch_size}ページ以下の文書")
+    if indexed_cost < direct_cost * config.indexed_margin:
+        return _decision(ROUTE_INDEXED, "インデックス検索の方が安い")
+    return _decision(ROUTE_DIRECT, "直接抽出の方が安い")
@@ -0,0 +1,200 @@
+"""スキーマレジストリ（Step 4-5 の結果をスキーマ単位でキャッシュ）
+
+フィールド定義リストをフィンガープリントで識別し、
+    - 動的Pydanticモデル（Step 4）とそのJSON Schemaをコンパイル済みで保持
+    - フィールドグルーピング結果（Step 5）をスキーマ × グルーピングに使うモデル × クライアントごとに
+      1回だけ計算し、ディスクに永続化（スタブや擬似APIの結果を実APIの実行で再利用しない）
+する。組み込みプリセットは起動時に warm_presets() で事前計算しておけば、
+大きい文書の抽出ごとに発生していたグルーピングのLLM往復がなくなる。
+"""
+
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.fingerprint import schema_fingerprint
+from app.demo_a.grouper import group_fields
+from app.demo_a.llm_client import STAGE_GROUP, get_client
+from app.demo_a.model_routing import StepModel, resolve_model_routing
+from app.demo_a.presets import list_presets
+from app.demo_a.schema_builder import build_extraction_schema
+from app.demo_a.schemas import GroupingResult
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_DIR = Path(__file__).parent.parent.parent / "output" / "schema_registry"
+
+
+@dataclass
+class CompiledSchema:
+    """コンパイル済みスキーマ。"""
+
+    fingerprint: str
+    field_definitions: list[dict]
+    model: type[BaseModel]
+    json_schema: dict
+
+
+class SchemaRegistry:
+    """スキーマのコンパイル結果とグルーピング結果のキャッシュ。
+
+    Args:
+        registry_dir: グルーピング結果の保存先（Noneなら永続化しない）
+    """
+
+    def __init__(self, registry_dir: Path | None = REGISTRY_DIR) -> None:
+        self.registry_dir = registry_dir
+        self._compiled: dict[str, CompiledSchema] = {}
+        self._groupings: dict[str, GroupingResult] = {}
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def compile(self, field_definitions: list[dict]) -> CompiledSchema:
+        """フィールド定義からPydanticモデルを生成する（同じ定義は再生成しない）。"""
+        fingerprint = schema_fingerprint(field_definitions)
+        with self._lock:
+            compiled = self._compiled.get(fingerprint)
+        if compiled is not None:
+            return compiled
+
+        model = build_extraction_schema(field_definitions)
+        compiled = CompiledSchema(
+            fingerprint=fingerprint,
+            field_definitions=[dict(f) for f in field_definitions],
+            model=model,
+            json_schema=model.model_json_schema(),
+        )
+        with self._lock:
+            return self._compiled.setdefault(fingerprint, compiled)
+
+    def grouping(
+        self,
+        field_definitions: list[dict],
+        step: StepModel | None = None,
+        cancel: CancelToken | None = None,
+        client_id: str | None = None,
+    ) -> GroupingResult:
+        """フィールドグルーピング結果を取得する。メモリ → ディスク → LLM の順に探す。
+
+        キャッシュのキーはスキーマのフィンガープリント・グルーピングに使うモデル・クライアント識別子の組。
+        同じキーに対する同時呼び出しでは、LLM呼び出しは1回だけ行う。
+
+        Args:
+            field_definitions: フィールド定義リスト
+            step: グルーピングに使うモデル設定（Noneならモデルルーティングテーブルの group）
+            cancel: 取消トークン（LLM呼び出しを中断する。取り消された結果はキャッシュしない）
+            client_id: クライアント識別子（Noneなら get_client().identity）
+        """
+        step = step or resolve_model_routing().step(STAGE_GROUP)
+        if client_id is None:
+            client_id = get_client().identity
+        key = f"{schema_fingerprint(field_definitions)}.{step.model}.{client_id}"
+        with self._lock:
+            cached = self._groupings.get(key)
+        if cached is not None:
+            return cached
+
+        with self._key_lock(f"grouping:{key}"):
+            with self._lock:
+                cached = self._groupings.get(key)
+            if cached is not None:
+                return cached
+
+            result = self._load_grouping(key)
+            if result is None:
+                result = group_fields(field_definitions, step, cancel)
+                self._save_grouping(key, field_definitions, step, client_id, result)
+
+            with self._lock:
+                self._groupings[key] = result
+            return result
+
+    def warm_presets(self) -> None:
+        """組み込みプリセットのモデルとグルーピング結果を事前計算する。"""
+        for preset in list_presets():
+            try:
+                self.compile(preset["fields"])
+                self.grouping(preset["fields"])
+            except Exception as e:
+                logger.warning("プリセット '%s' の事前計算に失敗: %s", preset["name"], e)
+
+    def _grouping_path(self, key: str) -> Path | None:
+        if self.registry_dir is None:
+            return None
+        return self.registry_dir / f"{key}.grouping.json"
+
+    def _load_grouping(self, key: str) -> GroupingResult | None:
+        path = self._grouping_path(key)
+        if path is None or not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            return GroupingResult.model_validate(data["grouping"])
+        except (ValueError, KeyError) as e:
+            logger.warning("グルーピングキャッシュを読めません（再計算します）: %s: %s", path, e)
+            return None
+
+    def _save_grouping(
+        self,
+        key: str,
+        field_definitions: list[dict],
+        step: StepModel,
+        client_id: str,
+        result: GroupingResult,
+    ) -> None:
+        path = self._grouping_path(key)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(
+                {
+                    "field_definitions": field_definitions,
+                    "model": step.model,
+                    "client": client_id,
+                    "grouping": result.model_dump(),
+                },
+                ensure_ascii=False,
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+        tmp.replace(path)
+
+
+# シングルトンインスタンス
+_registry: SchemaRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> SchemaRegistry:
+    """グローバルなスキーマレジストリを取得する。"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SchemaRegistry()
+        return _registry
+
+
+def set_registry(registry: SchemaRegistry) -> None:
+    """テスト用: レジストリを差し替える。"""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+
+
+def warm_presets_in_background() -> threading.Thread:
+    """プリセットの事前計算をバックグラウンドスレッドで開始する。"""
+    thread = threading.Thread(target=get_registry().warm_presets, name="schema-registry-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -39,18 +39,26 @@ class GroupingResult(BaseModel):
 
 
 # --- Step 6: チャンク検索（評価型） ---
-# LLMはchunk_idを「生成」せず、こちらが渡したIDに対して relevance を付けるだけ。
-# ハルシネーションによるID不一致を根本的に防ぐ設計。
+# LLMはchunk_idを「生成」せず、こちらが振った一覧の番号で関連するチャンクを指すだけ。
+# 関連しないチャンクは返させないため、出力トークン数はチャンク総数ではなくヒット数に比例する。
 
 
-class ChunkEvaluation(BaseModel):
-    """1チャンクの関連度評価。chunk_idはこちらから渡し、LLMはrelevanceだけ返す。"""
+class ChunkScore(BaseModel):
+    """関連するチャンク1件。indexはこちらが一覧に振った番号、scoreは0〜1の関連度。"""
 
-    chunk_id: str
-    relevance: str  # "high" / "medium" / "none"
+    index: int
+    score: float
+
+
+class ChunkSearchResult(BaseModel):
+    """関連するチャンクだけの評価リスト（関連しないチャンクは含まない）。"""
+
+    hits: list[ChunkScore]
 
 
-class ChunkEvaluations(BaseModel):
-    """全チャンクの関連度評価リスト。"""
+class ChunkHit(BaseModel):
+    """検索でヒットしたチャンクと関連度。コンテキスト統合で優先順位付けに使う。"""
 
-    evaluations: list[ChunkEvaluation]
+    chunk: SemanticChunk
+    relevance: str  # "high" / "medium" / "fallback"
+    score: float
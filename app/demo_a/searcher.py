@@ -1,85 +1,145 @@
-"""Step 6: チャンク検索（評価型 - LLMはrelevanceを付けるだけでIDを生成しない）"""
+"""Step 6: チャンク検索（評価型 - LLMは一覧の番号とスコアを返すだけでIDを生成しない）"""
 
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from app.demo_a.llm_client import get_client
-from app.demo_a.schemas import ChunkEvaluations, GroupingResult, SemanticChunk
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.chunk_index import ChunkIndex
+from app.demo_a.llm_client import STAGE_SEARCH, get_client
+from app.demo_a.model_routing import StepModel, resolve_model_routing
+from app.demo_a.rate_governor import PRIORITY_NORMAL
+from app.demo_a.schemas import ChunkHit, ChunkSearchResult, GroupingResult, SemanticChunk
 
 logger = logging.getLogger(__name__)
 
+# スコア → 関連度ラベル（MIN_SCORE 未満は関連なしとして除外する）
+HIGH_SCORE = 0.7
+MIN_SCORE = 0.3
+FALLBACK_SCORE = 0.1
+
+# 1回の検索呼び出しに含めるチャンク数（これを超えるインデックスは分割して並列に検索する）
+DEFAULT_SEARCH_BATCH_SIZE = 150
+
 
 def search_chunks(
-    chunk_index: list[SemanticChunk],
+    chunk_index: ChunkIndex,
     field_groups: GroupingResult,
-) -> list[SemanticChunk]:
+    step: StepModel | None = None,
+    cancel: CancelToken | None = None,
+    batch_size: int | None = None,
+) -> list[ChunkHit]:
     """チャンクインデックスに対してクエリベース検索。
 
-    LLMにchunk_idを「選ばせる」のではなく、各チャンクを「評価させる」ことで
-    ハルシネーションによるID不一致を防ぐ。
+    LLMにchunk_idを「選ばせる」のではなく、こちらが番号を振ったチャンク一覧から
+    関連するものの番号とスコアだけを返させることで、ハルシネーションによるID不一致を防ぐ。
+    関連しないチャンクは返させないため、応答の長さ（＝レイテンシ）はヒット数に比例する。
 
     Args:
-        chunk_index: セマンティックチャンクのリスト
+        chunk_index: セマンティックチャンクのインデックス
         field_groups: フィールドグルーピング結果
+        step: 使用するモデル設定（Noneならモデルルーティングテーブルの search）
+        cancel: 取消トークン（取り消されたら送信中のリクエストを中断する）
+        batch_size: 1回の呼び出しに含めるチャンク数
+            （Noneなら環境変数 DEMO_A_SEARCH_BATCH_SIZE、未設定なら DEFAULT_SEARCH_BATCH_SIZE）
 
     Returns:
-        high / medium と評価されたSemanticChunkのリスト（noneは除外済み）
+        スコアが MIN_SCORE 以上のチャンクと関連度のリスト（関連なしは除外済み、文書順）
     """
-    client = get_client()
+    step = step or resolve_model_routing().step(STAGE_SEARCH)
+    if batch_size is None:
+        batch_size = int(os.getenv("DEMO_A_SEARCH_BATCH_SIZE", DEFAULT_SEARCH_BATCH_SIZE))
+    batch_size = max(1, batch_size)
 
     # 検索クエリをまとめる
     queries_text = "\n".join(f"- {g.group_name}: {g.search_query}" for g in field_groups.groups)
 
-    # chunk_idとqueryを列挙（LLMはこのIDをそのまま返すだけでよい）
-    chunks_text = "\n".join(
-        f"chunk_id={c.chunk_id} | {c.query}" for c in chunk_index
-    )
+    # 一覧の番号は文書全体での通し番号（分割しても番号は変わらない）
+    chunks = list(chunk_index)
+    ranges = [range(start, min(start + batch_size, len(chunks))) for start in range(0, len(chunks), batch_size)]
+
+    def _search(indices: range) -> dict[int, float]:
+        return _search_batch(chunks, indices, queries_text, step, cancel)
+
+    if len(ranges) <= 1:
+        scores = _search(ranges[0]) if ranges else {}
+    else:
+        logger.info("[searcher] %dチャンクを%d回に分けて検索", len(chunks), len(ranges))
+        with ThreadPoolExecutor(max_workers=min(4, len(ranges))) as executor:
+            scores = {i: s for part in executor.map(_search, ranges) for i, s in part.items()}
+
+    # chunk_indexから該当するチャンクを順番通りに返す（IDはこちらが持つ）
+    matched = [
+        ChunkHit(chunk=chunks[i], relevance="high" if scores[i] >= HIGH_SCORE else "medium", score=scores[i])
+        for i in sorted(scores)
+        if scores[i] >= MIN_SCORE
+    ]
+    logger.warning("[searcher] matched %d chunks (input: %d chunks)", len(matched), len(chunks))
+
+    # LLMが関連チャンクなしと判定した場合は先頭5チャンクをフォールバックとして返す
+    if not matched:
+        logger.warning("[searcher] フォールバック: 先頭5チャンクを使用")
+        return [ChunkHit(chunk=c, relevance="fallback", score=FALLBACK_SCORE) for c in chunks[:5]]
+
+    return matched
+
+
+def _search_batch(
+    chunks: list[SemanticChunk],
+    indices: range,
+    queries_text: str,
+    step: StepModel,
+    cancel: CancelToken | None,
+) -> dict[int, float]:
+    """chunks[indices] を1回の呼び出しで評価し、{一覧の番号: スコア} を返す。
+
+    範囲外の番号は捨て、同じ番号が複数回返った場合は高い方のスコアを採る。
+    """
+    # 番号とqueryを列挙（LLMはこの番号をそのまま返すだけでよい）
+    chunks_text = "\n".join(f"[{i}] {chunks[i].query}" for i in indices)
 
     messages = [
         {
             "role": "user",
             "content": (
-                "以下の検索クエリに対して、各チャンクの関連度を評価してください。\n\n"
+                "以下の検索クエリに対して、関連するチャンクを選び関連度を評価してください。\n\n"
                 "ルール:\n"
-                "- relevance='high': 検索クエリに直接関連する情報が含まれる可能性が高い\n"
-                "- relevance='medium': 補足的な情報が含まれる可能性がある\n"
-                "- relevance='none': 関連しない\n"
-                "- chunk_idは与えられた値をそのままコピーすること（変更禁止）\n"
-                "- 全チャンクを評価し、evaluationsリストに全件返すこと\n\n"
+                "- 関連するチャンクだけを hits に返すこと（関連しないチャンクは返さない）\n"
+                "- index: チャンク一覧の [ ] 内の番号をそのまま返すこと（変更禁止）\n"
+                "- score: 0〜1の関連度。検索クエリに直接関連する情報が含まれる可能性が高ければ0.7以上、"
+                "補足的な情報が含まれる可能性があれば0.3〜0.7\n"
+                "- hits は score の高い順に並べること\n\n"
                 f"## 検索クエリ\n{queries_text}\n\n"
-                f"## 評価対象チャンク（全{len(chunk_index)}件）\n{chunks_text}"
+                f"## 評価対象チャンク（{len(indices)}件、番号 {indices.start}〜{indices.stop - 1}）\n{chunks_text}"
             ),
         }
     ]
 
-    result: ChunkEvaluations = client.structured_extract(
+    result: ChunkSearchResult = get_client().structured_extract(
         messages=messages,
-        output_format=ChunkEvaluations,
+        output_format=ChunkSearchResult,
+        model=step.model,
+        max_tokens=step.max_tokens,
+        priority=PRIORITY_NORMAL,
+        stage=STAGE_SEARCH,
+        cancel=cancel,
     )
 
-    # デバッグ: LLMが返したevaluationsをすべてログに出す
-    logger.warning("[searcher] LLM returned %d evaluations (input: %d chunks)", len(result.evaluations), len(chunk_index))
-    for e in result.evaluations:
-        logger.warning("[searcher]   chunk_id=%r  relevance=%r", e.chunk_id, e.relevance)
-
-    # LLMが返したevaluationsからhigh/mediumのchunk_idを抽出
-    relevant_ids = {
-        e.chunk_id for e in result.evaluations if e.relevance in ("high", "medium")
-    }
-    logger.warning("[searcher] relevant_ids=%r", relevant_ids)
-
-    # chunk_indexの実際のIDと照合
-    actual_ids = {c.chunk_id for c in chunk_index}
-    missing = relevant_ids - actual_ids
-    if missing:
-        logger.warning("[searcher] LLMが存在しないIDを返した（ハルシネーション）: %r", missing)
-
-    # chunk_indexから該当するチャンクを順番通りに返す（IDはこちらが持つ）
-    matched = [c for c in chunk_index if c.chunk_id in relevant_ids]
-    logger.warning("[searcher] matched %d chunks", len(matched))
-
-    # LLMが全件noneと判定した場合は先頭5チャンクをフォールバックとして返す
-    if not matched:
-        logger.warning("[searcher] フォールバック: 先頭5チャンクを使用")
-        return chunk_index[:5]
-
-    return matched
+    scores: dict[int, float] = {}
+    invalid = []
+    for hit in result.hits:
+        if hit.index not in indices:
+            invalid.append(hit.index)
+            continue
+        score = min(1.0, max(0.0, hit.score))
+        scores[hit.index] = max(score, scores.get(hit.index, 0.0))
+    if invalid:
+        logger.warning("[searcher] LLMが範囲外の番号を返した（ハルシネーション）: %r", invalid)
+    logger.warning(
+        "[searcher] LLM returned %d hits (chunks %d-%d): %r",
+        len(result.hits),
+        indices.start,
+        indices.stop - 1,
+        {i: round(s, 2) for i, s in sorted(scores.items())},
+    )
+    return scores
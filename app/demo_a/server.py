@@ -0,0 +1,340 @@
+"""ローカルHTTPジョブサーバー（build_index / extract_with_schema のジョブ化）
+
+他システムからプロセス外でエンジンを呼び出すための小さなHTTPサービス。
+ジョブは jobs.JobManager の優先度付きキューに入り、有界ワーカープールで実行される。
+
+エンドポイント:
+    POST   /jobs              ジョブ投入（202 + ジョブ情報）
+                                {"type": "index", "path": "..."}
+                                {"type": "extract", "document_id": "<indexジョブID>" | "path": "...",
+                                 "preset": "引合概要" | "fields": [...], "priority": 0,
+                                 "max_contexts": 1, "models": {"search": "claude-sonnet-4-6"}}
+    GET    /jobs              ジョブ一覧（結果なし）
+    GET    /jobs/<id>         ジョブ状態と結果
+    GET    /jobs/<id>/events  状態変化をNDJSONでストリーミング（終了状態で切断）
+    DELETE /jobs/<id>         ジョブの取消（実行中なら送信中のAPIリクエストも中断する）
+    GET    /health            ワーカー・キューの状況
+
+起動例:
+    python -m app.demo_a.server --port 8765 --workers 4
+    python -m app.demo_a.server --stub-llm   # API呼び出しなしで動作確認
+"""
+
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from app.demo_a.index_cache import get_index_cache
+from app.demo_a.jobs import DEFAULT_JOB_TTL, DEFAULT_MAX_RETAINED_JOBS, JOB_EXTRACT, JOB_INDEX, Job, JobManager
+from app.demo_a.llm_client import load_env
+from app.demo_a.model_routing import resolve_model_routing
+from app.demo_a.pipeline import extract_with_schema
+from app.demo_a.presets import get_preset
+from app.demo_a.schema_registry import warm_presets_in_background
+
+logger = logging.getLogger(__name__)
+
+# /jobs/<id>/events で状態変化を待つ間隔（秒）。この間隔でハートビート行を送る
+EVENT_POLL_INTERVAL = 15.0
+
+
+class JobService:
+    """ジョブ種別ごとの処理と、構築済みインデックスの保持を担う。
+
+    インデックスジョブのIDをそのまま document_id として扱い、
+    抽出ジョブはそのインデックスを再利用する。インデックスジョブが保持期限切れなどで
+    捨てられたら、そのインデックスも手放す（以降その document_id は指定できない）。
+
+    Args:
+        max_workers: ワーカースレッド数
+        output_dir: PDF変換の出力先
+        job_ttl: 終了したジョブを保持する秒数（Noneなら期限なし）
+        max_retained_jobs: 保持するジョブ数の上限
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        output_dir: Path = Path("output/converted"),
+        job_ttl: float | None = DEFAULT_JOB_TTL,
+        max_retained_jobs: int = DEFAULT_MAX_RETAINED_JOBS,
+    ) -> None:
+        self.output_dir = output_dir
+        self._indexes: dict[str, tuple] = {}
+        self.manager = JobManager(
+            handlers={JOB_INDEX: self._run_index, JOB_EXTRACT: self._run_extract},
+            max_workers=max_workers,
+            job_ttl=job_ttl,
+            max_retained_jobs=max_retained_jobs,
+            on_evict=self._on_evict,
+        )
+
+    def submit(self, payload: dict) -> Job:
+        """リクエストボディからジョブを投入する。不正な入力はValueError。"""
+        job_type = payload.get("type")
+        priority = payload.get("priority")
+        if priority is not None and (not isinstance(priority, int) or isinstance(priority, bool)):
+            raise ValueError("'priority' は整数で指定してください")
+
+        if job_type == JOB_INDEX:
+            return self.manager.submit(JOB_INDEX, {"path": _require_path(payload)}, priority)
+
+        if job_type == JOB_EXTRACT:
+            if "preset" in payload:
+                try:
+                    fields = get_preset(payload["preset"])["fields"]
+                except KeyError as e:
+                    raise ValueError(str(e)) from e
+            elif isinstance(payload.get("fields"), list) and payload["fields"]:
+                fields = payload["fields"]
+            else:
+                raise ValueError("'preset' または 'fields' を指定してください")
+
+            max_contexts = payload.get("max_contexts", 1)
+            if not isinstance(max_contexts, int) or max_contexts < 1:
+                raise ValueError("'max_contexts' は1以上の整数で指定してください")
+
+            models = payload.get("models")
+            if models is not None:
+                if not isinstance(models, dict) or not all(isinstance(m, str) and m for m in models.values()):
+                    raise ValueError("'models' は {ステップ名: モデルID} の形式で指定してください")
+                resolve_model_routing(models)
+
+            index_job = self._resolve_index_job(payload)
+            return self.manager.submit(
+                JOB_EXTRACT,
+                {"document_id": index_job.job_id, "fields": fields, "max_contexts": max_contexts, "models": models},
+                priority,
+                depends_on=index_job,
+            )
+
+        raise ValueError(f"未対応のジョブ種別: {job_type!r}")
+
+    def _resolve_index_job(self, payload: dict) -> Job:
+        """抽出対象のインデックスジョブを決める。pathのみ指定時は既存を再利用し、なければ投入する。"""
+        if "document_id" in payload:
+            job = self.manager.get(payload["document_id"])
+            if job is None or job.job_type != JOB_INDEX:
+                raise ValueError(f"document_id が見つかりません: {payload['document_id']}")
+            return job
+
+        path = _require_path(payload)
+        existing = self.manager.find(
+            lambda j: j.job_type == JOB_INDEX and j.params["path"] == path and j.status not in ("failed", "cancelled")
+        )
+        if existing is not None:
+            return existing
+        return self.manager.submit(JOB_INDEX, {"path": path})
+
+    def _run_index(self, job: Job) -> dict:
+        # 変換・インデックス構築はプロセス共有キャッシュ経由（同じ文書は1回だけ構築）
+        entry = get_index_cache().get_or_build(Path(job.params["path"]), output_dir=self.output_dir, cancel=job.cancel)
+        pdf_path, batches, chunk_index = entry.pdf_path, entry.batches, entry.chunk_index
+        self._indexes[job.job_id] = (pdf_path, batches, chunk_index)
+        return {
+            "document_id": job.job_id,
+            "pdf_path": str(pdf_path),
+            "pages": batches[-1]["page_end"],
+            "batches": len(batches),
+            "chunks": len(chunk_index) if chunk_index is not None else None,
+            "route": entry.metadata.get("route"),
+            "models": entry.metadata.get("models"),
+            "resumed_batches": entry.metadata.get("resumed_batches"),
+            "fallback_batches": entry.metadata.get("fallback_batches"),
+            "dedup_pages": entry.metadata.get("dedup_pages"),
+        }
+
+    def _on_evict(self, job: Job) -> None:
+        if job.job_type == JOB_INDEX:
+            self._indexes.pop(job.job_id, None)
+
+    def _run_extract(self, job: Job) -> list[dict]:
+        pdf_path, batches, chunk_index = self._indexes[job.params["document_id"]]
+        return extract_with_schema(
+            pdf_path,
+            batches,
+            chunk_index,
+            job.params["fields"],
+            max_contexts=job.params["max_contexts"],
+            models=job.params.get("models"),
+            cancel=job.cancel,
+        )
+
+
+def _require_path(payload: dict) -> str:
+    path = payload.get("path")
+    if not path:
+        raise ValueError("'path' を指定してください")
+    resolved = Path(path).resolve()
+    if not resolved.is_file():
+        raise ValueError(f"ファイルが見つかりません: {path}")
+    return str(resolved)
+
+
+def make_handler(service: JobService) -> type[BaseHTTPRequestHandler]:
+    """JobService に紐づいたリクエストハンドラクラスを作る。"""
+
+    class JobRequestHandler(BaseHTTPRequestHandler):
+        server_version = "DemoAJobServer/0.1"
+
+        def log_message(self, format: str, *args) -> None:
+            logger.info("%s - %s", self.address_string(), format % args)
+
+        def _send_json(self, status: int, data) -> None:
+            body = json.dumps(data, ensure_ascii=False, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _route(self) -> tuple[str, str | None, str | None]:
+            parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+            head = parts[0] if parts else ""
+            job_id = parts[1] if len(parts) > 1 else None
+            sub = parts[2] if len(parts) > 2 else None
+            return head, job_id, sub
+
+        def do_GET(self) -> None:
+            head, job_id, sub = self._route()
+            if head == "health":
+                self._send_json(200, service.manager.stats())
+            elif head == "jobs" and job_id is None:
+                self._send_json(200, [j.to_dict(include_result=False) for j in service.manager.list_jobs()])
+            elif head == "jobs" and sub is None:
+                job = service.manager.get(job_id)
+                if job is None:
+                    self._send_json(404, {"error": "job not found"})
+                else:
+                    self._send_json(200, job.to_dict())
+            elif head == "jobs" and sub == "events":
+                self._stream_events(job_id)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            head, job_id, _ = self._route()
+            if head != "jobs" or job_id is not None:
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(payload, dict):
+                    raise ValueError("リクエストボディはJSONオブジェクトで指定してください")
+                job = service.submit(payload)
+            except (ValueError, json.JSONDecodeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(202, job.to_dict(include_result=False))
+
+        def do_DELETE(self) -> None:
+            head, job_id, sub = self._route()
+            if head != "jobs" or job_id is None or sub is not None:
+                self._send_json(404, {"error": "not found"})
+                return
+            job = service.manager.get(job_id)
+            if job is None:
+                self._send_json(404, {"error": "job not found"})
+            elif service.manager.cancel(job_id):
+                self._send_json(200, job.to_dict(include_result=False))
+            else:
+                self._send_json(409, {"error": f"取消できない状態です: {job.status}"})
+
+        def _stream_events(self, job_id: str | None) -> None:
+            job = service.manager.get(job_id) if job_id else None
+            if job is None:
+                self._send_json(404, {"error": "job not found"})
+                return
+
+            # 1行1イベントのNDJSON。Content-Lengthなしで送り、終了状態で接続を閉じる
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            version = -1
+            try:
+                while True:
+                    if job.version != version:
+                        version = job.version
+                        data = job.to_dict(include_result=job.done)
+                    else:
+                        data = {"job_id": job.job_id, "status": job.status, "heartbeat": True}
+                    self.wfile.write(json.dumps(data, ensure_ascii=False, default=str).encode() + b"\n")
+                    self.wfile.flush()
+                    if job.done:
+                        return
+                    service.manager.wait_for_update(job, version, EVENT_POLL_INTERVAL)
+            except (BrokenPipeError, ConnectionResetError):
+                logger.info("イベントストリームの接続が切断されました: %s", job_id)
+
+    return JobRequestHandler
+
+
+def create_server(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    max_workers: int = 4,
+    output_dir: Path = Path("output/converted"),
+    job_ttl: float | None = DEFAULT_JOB_TTL,
+    max_retained_jobs: int = DEFAULT_MAX_RETAINED_JOBS,
+) -> tuple[ThreadingHTTPServer, JobService]:
+    """サーバーとジョブサービスを生成する（serve_forever() は呼び出し側で実行）。"""
+    service = JobService(
+        max_workers=max_workers, output_dir=output_dir, job_ttl=job_ttl, max_retained_jobs=max_retained_jobs
+    )
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    httpd.daemon_threads = True
+    return httpd, service
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.demo_a.server", description="デモA ローカルジョブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4, help="ワーカースレッド数")
+    parser.add_argument("--output-dir", type=Path, default=Path("output/converted"), help="PDF変換の出力先")
+    parser.add_argument(
+        "--job-ttl", type=float, default=DEFAULT_JOB_TTL, help="終了したジョブを保持する秒数（0以下で期限なし）"
+    )
+    parser.add_argument("--max-jobs", type=int, default=DEFAULT_MAX_RETAINED_JOBS, help="保持するジョブ数の上限")
+    parser.add_argument("--stub-llm", action="store_true", help="API呼び出しを行わないスタブLLMを使う")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    load_env()
+
+    if args.stub_llm:
+        from app.demo_a.llm_client import set_client
+        from app.demo_a.stub_client import StubClient
+
+        set_client(StubClient())
+        logger.warning("スタブLLMクライアントで起動します（API呼び出しなし）")
+
+    httpd, service = create_server(
+        args.host,
+        args.port,
+        args.workers,
+        args.output_dir,
+        job_ttl=args.job_ttl if args.job_ttl > 0 else None,
+        max_retained_jobs=args.max_jobs,
+    )
+    warm_presets_in_background()
+    logger.warning("ジョブサーバー起動: http://%s:%d", args.host, args.port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.manager.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,65 +2,75 @@
 
 from pathlib import Path
 
-import pymupdf
+from app.demo_a.doc_pool import borrow_document
+from app.demo_a.pdf_workers import run_in_pdf_worker
 
 
 def load_and_split(
     pdf_path: Path,
     batch_size: int = 20,
     overlap: int = 2,
+    split: bool | None = None,
 ) -> list[dict]:
     """PDFを読み込み、必要に応じてオーバーラップ付きバッチに分割。
 
-    100ページ以下の文書は分割不要（フェーズ2でそのまま丸ごとSonnetに投入）。
-    100ページ超の文書は batch_size ページずつに物理分割し、
+    分割しない文書はフェーズ2でそのまま丸ごとSonnetに投入する。
+    分割する文書は batch_size ページずつに物理分割し、
     隣接バッチ間で overlap ページのオーバーラップを持たせる。
 
     Args:
         pdf_path: PDFファイルパス
         batch_size: 1バッチあたりのページ数（デフォルト20）
         overlap: 隣接バッチ間のオーバーラップページ数（デフォルト2）
+        split: 分割するか（router.decide_route の判定）。Noneなら100ページ超で分割
 
     Returns:
         list of {"id": str, "label": str, "pdf_bytes": bytes,
                  "page_start": int, "page_end": int, "page_count": int}
     """
-    doc = pymupdf.open(pdf_path)
-    total = len(doc)
+    # ページの切り出しはPDF処理のプロセスプールで行う（ファイルパスだけを渡す）
+    return run_in_pdf_worker(_load_and_split, pdf_path, batch_size, overlap, split)
 
-    if total <= 100:
-        pdf_bytes = pdf_path.read_bytes()
-        doc.close()
-        return [
-            {
-                "id": "full_document",
-                "label": f"全文 ({total}ページ)",
-                "pdf_bytes": pdf_bytes,
-                "page_start": 1,
-                "page_end": total,
-                "page_count": total,
-            }
-        ]
 
-    stride = batch_size - overlap
-    batches = []
-    for start in range(0, total, stride):
-        end = min(start + batch_size - 1, total - 1)
-        sub_doc = pymupdf.open()
-        sub_doc.insert_pdf(doc, from_page=start, to_page=end)
-        batches.append(
-            {
-                "id": f"batch_p{start + 1:03d}_{end + 1:03d}",
-                "label": f"p.{start + 1}–{end + 1}",
-                "pdf_bytes": sub_doc.tobytes(),
-                "page_start": start + 1,
-                "page_end": end + 1,
-                "page_count": end - start + 1,
-            }
-        )
-        sub_doc.close()
-        if end == total - 1:
-            break
+def _load_and_split(pdf_path: Path, batch_size: int, overlap: int, split: bool | None) -> list[dict]:
+    import pymupdf
+
+    with borrow_document(pdf_path) as doc:
+        total = len(doc)
+
+        if split is None:
+            split = total > 100
+
+        if not split:
+            return [
+                {
+                    "id": "full_document",
+                    "label": f"全文 ({total}ページ)",
+                    "pdf_bytes": pdf_path.read_bytes(),
+                    "page_start": 1,
+                    "page_end": total,
+                    "page_count": total,
+                }
+            ]
+
+        stride = batch_size - overlap
+        batches = []
+        for start in range(0, total, stride):
+            end = min(start + batch_size - 1, total - 1)
+            sub_doc = pymupdf.open()
+            sub_doc.insert_pdf(doc, from_page=start, to_page=end)
+            batches.append(
+                {
+                    "id": f"batch_p{start + 1:03d}_{end + 1:03d}",
+                    "label": f"p.{start + 1}–{end + 1}",
+                    "pdf_bytes": sub_doc.tobytes(),
+                    "page_start": start + 1,
+                    "page_end": end + 1,
+                    "page_count": end - start + 1,
+                }
+            )
+            sub_doc.close()
+            if end == total - 1:
+                break
 
-    doc.close()
     return batches
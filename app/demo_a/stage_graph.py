@@ -0,0 +1,356 @@
+"""宣言的なステージグラフの実行器
+
+各ステップを「入力名・処理・並行実行クラス」を宣言したノード（Stage）として登録し、
+依存関係から実行順を決めて、互いに独立なノードを並行に実行する。
+
+    graph = StageGraph([
+        Stage("split", split_fn, inputs=("pdf_path",)),
+        Stage("chunk", chunk_fn, inputs=("split",), concurrency=CLASS_LLM),
+        Stage("group", group_fn, inputs=("fields",), concurrency=CLASS_LLM),
+        Stage("search", search_fn, inputs=("chunk", "group"), concurrency=CLASS_LLM),
+    ])
+    outputs = graph.run({"pdf_path": path, "fields": fields}, targets=["search"], cache=cache)
+
+ノードの入力名はほかのノード名か、run() に渡すグラフ入力の名前。処理は入力を同名のキーワード引数で、
+取消トークンを cancel 引数で受け取る。run() の inputs にノード名を渡すと、そのノードは実行済みとして
+値をそのまま使い、上流のノードも実行しない（前段の結果を持っている呼び出し側から途中だけを実行する場合）。
+
+ノードの出力はキャッシュキー（ノード名・バージョン・入力のキーから導出）で StageCache にメモ化する。
+StageCache は件数と、出力が持つバイト列（バッチPDF・コンテキストPDFなど）の合計バイト数で上限を持つ。
+グラフ入力のキーは内容から作る（ファイルはフィンガープリント、それ以外はJSON表現）ため、
+スキーマだけを変えて再実行すると、スキーマに依存しないノードはキャッシュから返り、
+依存するノードだけが再実行される。
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, fields, is_dataclass
+from pathlib import Path
+from typing import Any
+
+from app.demo_a.cancellation import CancelToken, raise_if_cancelled
+from app.demo_a.fingerprint import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 並行実行クラス（クラスごとに同時実行数を制限する）
+CLASS_CPU = "cpu"  # PDF分割・コンテキスト作成など（GILを持つ処理）
+CLASS_IO = "io"  # ファイル変換など外部プロセス・ディスク待ち
+CLASS_LLM = "llm"  # API呼び出し（送信レートはガバナーが別途制御する）
+
+DEFAULT_CONCURRENCY = {CLASS_CPU: 2, CLASS_IO: 2, CLASS_LLM: 4}
+
+# 進捗イベントの種類
+EVENT_START = "start"
+EVENT_DONE = "done"
+EVENT_CACHED = "cached"
+EVENT_FAILED = "failed"
+EVENT_SKIPPED = "skipped"  # 他のノードの失敗・取消で実行しなかった
+
+
+@dataclass(frozen=True)
+class Stage:
+    """グラフの1ノード。
+
+    Args:
+        name: ノード名（他のノードの入力名として参照される）
+        fn: 処理。inputs の値をキーワード引数、取消トークンを cancel 引数で受け取る
+        inputs: 入力名（ノード名またはグラフ入力名）
+        concurrency: 並行実行クラス（CLASS_*）
+        version: 処理内容を変えたら上げる（キャッシュキーに含める）
+        memoize: 出力をキャッシュするか
+    """
+
+    name: str
+    fn: Callable[..., Any]
+    inputs: tuple[str, ...] = ()
+    concurrency: str = CLASS_CPU
+    version: str = "1"
+    memoize: bool = True
+
+
+@dataclass(frozen=True)
+class StageEvent:
+    """進捗イベント。"""
+
+    stage: str
+    status: str  # EVENT_*
+    key: str
+    seconds: float = 0.0
+    error: str | None = None
+
+
+# StageCache が保持する出力の合計バイト数の既定値
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _value_size(value: Any, seen: set[int] | None = None) -> int:
+    """出力が持つバイト列・文字列の合計サイズ（概算）。
+
+    コンテナ・dataclass・属性を持つオブジェクトは中身をたどり、同じオブジェクトは1回だけ数える。
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if value is None or isinstance(value, (int, float, bool, Path, type)):
+        return 0
+
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, dict):
+        return sum(_value_size(v, seen) for v in value.values())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(_value_size(v, seen) for v in value)
+    if is_dataclass(value):
+        return sum(_value_size(getattr(value, f.name), seen) for f in fields(value))
+    if hasattr(value, "__dict__"):
+        return sum(_value_size(v, seen) for v in vars(value).values())
+    return 0
+
+
+class StageCache:
+    """キャッシュキー → ノード出力のメモ（件数・バイト数上限付きのLRU）。
+
+    上限を超える1出力は、実行した呼び出しには返すが保持しない。
+
+    Args:
+        max_entries: 保持する出力の最大数
+        max_bytes: 保持する出力の合計バイト数の上限（_value_size() の概算）
+    """
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = DEFAULT_CACHE_MAX_BYTES) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """(見つかったか, 出力)。"""
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key][0]
+
+    def put(self, key: str, value: Any) -> None:
+        size = _value_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                logger.debug("ステージ出力が上限を超えるため保持しません: %s（%d bytes）", key, size)
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    @property
+    def size(self) -> int:
+        """保持している出力の合計バイト数（概算）。"""
+        with self._lock:
+            return self._bytes
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+def value_key(value: Any) -> str:
+    """グラフ入力の内容から作るキー。
+
+    ファイルパスは内容のフィンガープリント、to_dict() を持つ設定オブジェクトとdataclassは
+    その辞書、それ以外はJSON表現（JSON化できない値は repr）から作る。
+    """
+    if isinstance(value, Path):
+        return f"file:{file_fingerprint(value)}" if value.is_file() else f"path:{value}"
+    if hasattr(value, "to_dict"):
+        value = value.to_dict()
+    elif is_dataclass(value) and not isinstance(value, type):
+        value = asdict(value)
+    text = json.dumps(value, ensure_ascii=False, sort_keys=True, default=repr)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class StageGraph:
+    """ステージの依存グラフと実行器。
+
+    Args:
+        stages: ノードのリスト
+        concurrency: 並行実行クラスごとの同時実行数（省略したクラスは DEFAULT_CONCURRENCY）
+
+    Raises:
+        ValueError: ノード名の重複、または循環依存
+    """
+
+    def __init__(self, stages: list[Stage], concurrency: dict[str, int] | None = None) -> None:
+        self.stages = {s.name: s for s in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("ノード名が重複しています")
+        self.order = self._topological_order()
+        limits = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self._slots = {cls: threading.Semaphore(max(1, n)) for cls, n in limits.items()}
+
+    @property
+    def inputs(self) -> set[str]:
+        """グラフ入力名（どのノード名でもない入力名）。"""
+        return {name for s in self.stages.values() for name in s.inputs if name not in self.stages}
+
+    def _topological_order(self) -> list[str]:
+        order: list[str] = []
+        state: dict[str, str] = {}
+
+        def visit(name: str, path: tuple[str, ...]) -> None:
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"循環依存: {' → '.join(path + (name,))}")
+            state[name] = "visiting"
+            for dep in self.stages[name].inputs:
+                if dep in self.stages:
+                    visit(dep, path + (name,))
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, ())
+        return order
+
+    def _required(self, targets: list[str], provided: set[str] | frozenset[str] = frozenset()) -> list[str]:
+        """targets とその上流のうち、provided（値を渡されたノード）以外のノード（実行順）。"""
+        needed: set[str] = set()
+        stack = [name for name in targets if name not in provided]
+        while stack:
+            name = stack.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            stack.extend(dep for dep in self.stages[name].inputs if dep in self.stages and dep not in provided)
+        return [name for name in self.order if name in needed]
+
+    def keys(self, inputs: dict[str, Any], targets: list[str] | None = None) -> dict[str, str]:
+        """ノードとグラフ入力のキャッシュキー。"""
+        keys = {name: value_key(value) for name, value in inputs.items()}
+        for name in self._required(targets or list(self.stages), set(inputs)):
+            stage = self.stages[name]
+            parts = [name, stage.version, *(f"{dep}={keys[dep]}" for dep in stage.inputs)]
+            keys[name] = hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:32]
+        return keys
+
+    def run(
+        self,
+        inputs: dict[str, Any],
+        targets: list[str] | None = None,
+        cache: StageCache | None = None,
+        on_event: Callable[[StageEvent], None] | None = None,
+        cancel: CancelToken | None = None,
+    ) -> dict[str, Any]:
+        """targets（省略時は全ノード）とその上流を実行し、targets の出力を返す。
+
+        入力がそろったノードから並行に実行する。キャッシュにあるノードは実行しない。
+        あるノードが失敗したら新しいノードは開始せず、実行中のノードの終了を待ってその例外を送出する。
+
+        Args:
+            inputs: グラフ入力（名前 → 値）。ノード名を含めた場合はその値をノードの出力として使う
+            targets: 出力が必要なノード名
+            cache: ノード出力のメモ（Noneならメモ化せず、キャッシュキーも計算しない。
+                進捗イベントの key は空文字になる）
+            on_event: 進捗イベントを受け取るコールバック（ワーカースレッドから呼ばれることがある）
+            cancel: 取消トークン（各ノードに渡す。取り消されたら新しいノードは開始しない）
+
+        Returns:
+            {ノード名: 出力}
+
+        Raises:
+            ValueError: 未知のノード名、またはグラフ入力の不足
+        """
+        targets = targets or list(self.stages)
+        unknown = [t for t in targets if t not in self.stages]
+        if unknown:
+            raise ValueError(f"未知のノード: {unknown}")
+        required = self._required(targets, set(inputs))
+        missing = {dep for name in required for dep in self.stages[name].inputs if dep not in self.stages} - set(inputs)
+        if missing:
+            raise ValueError(f"グラフ入力が不足しています: {sorted(missing)}")
+
+        # PDFバイト列などの大きな入力をキーのためだけにJSON化しないよう、メモ化する場合だけ計算する
+        keys = self.keys(inputs, targets) if cache is not None else dict.fromkeys(required, "")
+        results: dict[str, Any] = dict(inputs)
+        pending = list(required)
+        running: dict[Future, str] = {}
+        error: BaseException | None = None
+
+        def emit(event: StageEvent) -> None:
+            if on_event is not None:
+                on_event(event)
+
+        with ThreadPoolExecutor(max_workers=len(required) or 1, thread_name_prefix="stage") as executor:
+            while pending or running:
+                if error is None:
+                    for name in [n for n in pending if all(d in results for d in self.stages[n].inputs)]:
+                        pending.remove(name)
+                        stage = self.stages[name]
+                        hit, value = cache.get(keys[name]) if cache is not None and stage.memoize else (False, None)
+                        if hit:
+                            results[name] = value
+                            emit(StageEvent(name, EVENT_CACHED, keys[name]))
+                            continue
+                        future = executor.submit(self._run_stage, stage, keys[name], results, emit, cancel)
+                        running[future] = name
+                    # キャッシュから返ったノードで入力がそろったノードがあれば続けて判定する
+                    if not running and any(all(d in results for d in self.stages[n].inputs) for n in pending):
+                        continue
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    stage = self.stages[name]
+                    try:
+                        value, seconds = future.result()
+                    except BaseException as e:
+                        emit(StageEvent(name, EVENT_FAILED, keys[name], error=f"{type(e).__name__}: {e}"))
+                        if error is None:
+                            error = e
+                        continue
+                    results[name] = value
+                    if cache is not None and stage.memoize:
+                        cache.put(keys[name], value)
+                    emit(StageEvent(name, EVENT_DONE, keys[name], seconds=round(seconds, 3)))
+
+        if error is not None:
+            for name in pending:
+                emit(StageEvent(name, EVENT_SKIPPED, keys[name]))
+            raise error
+        return {name: results[name] for name in targets}
+
+    def _run_stage(
+        self,
+        stage: Stage,
+        key: str,
+        results: dict[str, Any],
+        emit: Callable[[StageEvent], None],
+        cancel: CancelToken | None,
+    ) -> tuple[Any, float]:
+        with self._slots.setdefault(stage.concurrency, threading.Semaphore(1)):
+            raise_if_cancelled(cancel)
+            emit(StageEvent(stage.name, EVENT_START, key))
+            t0 = time.perf_counter()
+            value = stage.fn(cancel=cancel, **{name: results[name] for name in stage.inputs})
+            return value, time.perf_counter() - t0
@@ -0,0 +1,157 @@
+"""API呼び出しを行わないスタブLLMクライアント（ローカル動作確認・テスト用）"""
+
+import re
+import time
+from collections.abc import Callable
+from typing import Any
+
+from pydantic import BaseModel
+
+from app.demo_a.cancellation import cancellable_sleep, raise_if_cancelled
+from app.demo_a.hedging import HedgeTracker
+from app.demo_a.llm_client import MODEL, DemoAClient
+from app.demo_a.partial_json import PartialObjectParser
+from app.demo_a.rate_governor import get_governor
+from app.demo_a.schemas import (
+    BatchChunkResult,
+    ChunkScore,
+    ChunkSearchResult,
+    FieldGroup,
+    GroupingResult,
+    SemanticChunk,
+)
+
+# プロンプト中のページ範囲表記（chunker.pyの「この文書はp.21–40」）
+_PAGE_RANGE_RE = re.compile(r"p\.(\d+)–(\d+)")
+# grouper.pyのフィールド一覧行「- name: description」
+_FIELD_LINE_RE = re.compile(r"^- ([^:\n]+): ", re.MULTILINE)
+# searcher.pyのチャンク一覧行「[番号] query」
+_CHUNK_INDEX_RE = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+
+
+class StubClient(DemoAClient):
+    """プロンプトから決定的な応答を組み立てるスタブクライアント。
+
+    パイプラインの全ステップ（チャンク生成・グルーピング・検索・抽出）に対して
+    output_format に合致するインスタンスを返す。set_client() で差し替えて使う。
+    APIクライアント・ガバナーは使わない（ヘッジもしない）が、ステージ別のレイテンシは
+    DemoAClient と同じく hedge_metrics() で参照できる。
+
+    Args:
+        latency: 1呼び出しあたりの擬似レイテンシ（秒）
+        pages_per_chunk: チャンク生成時の1チャンクあたりページ数
+    """
+
+    def __init__(self, latency: float = 0.0, pages_per_chunk: int = 5) -> None:
+        # DemoAClient.__init__ はAPIクライアントを作るため呼ばず、参照される属性だけを用意する
+        self.client = None
+        self.governor = get_governor()
+        self.hedge = False
+        self.hedge_stages: set[str] = set()
+        self.hedge_tracker = HedgeTracker()
+        self.latency = latency
+        self.pages_per_chunk = pages_per_chunk
+        self.calls = 0
+        self.model_calls: dict[str, int] = {}
+
+    @property
+    def identity(self) -> str:
+        return "stub"
+
+    def structured_extract(
+        self,
+        messages: list[dict],
+        output_format: type[BaseModel],
+        **kwargs,
+    ) -> BaseModel:
+        raise_if_cancelled(kwargs.get("cancel"))
+        self.calls += 1
+        model = kwargs.get("model", MODEL)
+        self.model_calls[model] = self.model_calls.get(model, 0) + 1
+        stage = kwargs.get("stage")
+        if stage is not None:
+            self.hedge_tracker.begin_call(stage)
+        start = time.monotonic()
+        if self.latency:
+            cancellable_sleep(self.latency, kwargs.get("cancel"))
+        if stage is not None:
+            self.hedge_tracker.record_latency(stage, time.monotonic() - start)
+
+        text = _prompt_text(messages)
+
+        if output_format is BatchChunkResult:
+            return self._chunks(text)
+        if output_format is GroupingResult:
+            names = _FIELD_LINE_RE.findall(text)
+            return GroupingResult(
+                groups=[FieldGroup(group_name="all", field_names=names, search_query=" ".join(names))]
+            )
+        if output_format is ChunkSearchResult:
+            return ChunkSearchResult(hits=[ChunkScore(index=int(i), score=0.5) for i in _CHUNK_INDEX_RE.findall(text)])
+        return _placeholder(output_format)
+
+    def stream_extract(
+        self,
+        messages: list[dict],
+        output_format: type[BaseModel],
+        on_field: Callable[[str, Any], None],
+        **kwargs,
+    ) -> BaseModel:
+        """structured_extract の結果をJSONにし、数文字ずつ増分パーサに流す。"""
+        latency, self.latency = self.latency, 0.0
+        try:
+            result = self.structured_extract(messages, output_format, **kwargs)
+        finally:
+            self.latency = latency
+
+        text = result.model_dump_json()
+        parser = PartialObjectParser(on_field)
+        step = 8
+        for i in range(0, len(text), step):
+            if self.latency:
+                cancellable_sleep(self.latency * step / len(text), kwargs.get("cancel"))
+            parser.feed(text[i : i + step])
+        return result
+
+    def _chunks(self, text: str) -> BatchChunkResult:
+        match = _PAGE_RANGE_RE.search(text)
+        start, end = (int(match[1]), int(match[2])) if match else (1, 1)
+        chunks = [
+            SemanticChunk(
+                chunk_id=f"stub_{i:03d}",
+                page_start=p,
+                page_end=min(p + self.pages_per_chunk - 1, end),
+                query=f"stub section p.{p}",
+                description=f"スタブチャンク p.{p}-{min(p + self.pages_per_chunk - 1, end)}",
+            )
+            for i, p in enumerate(range(start, end + 1, self.pages_per_chunk), 1)
+        ]
+        return BatchChunkResult(chunks=chunks)
+
+
+def _prompt_text(messages: list[dict]) -> str:
+    """messagesからテキスト部分だけを連結する。"""
+    parts = []
+    for m in messages:
+        content = m["content"]
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block["text"] for block in content if block.get("type") == "text")
+    return "\n".join(parts)
+
+
+def _placeholder(output_format: type[BaseModel]) -> BaseModel:
+    """抽出モデルの各フィールドに型ごとのプレースホルダ値を入れる。"""
+    values = {}
+    for name, info in output_format.model_fields.items():
+        annotation = str(info.annotation)
+        if "float" in annotation:
+            values[name] = 0.0
+        elif "int" in annotation:
+            values[name] = 0
+        elif "bool" in annotation:
+            values[name] = False
+        else:
+            values[name] = f"stub:{name}"
+    return output_format(**values)
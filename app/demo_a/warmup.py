@@ -0,0 +1,67 @@
+"""コールドスタート対策（重いモジュールの事前読み込み）
+
+anthropic / pymupdf / msoffcrypto は初回使用時まで読み込まないため、
+パイプラインやCLIのインポート自体は軽い。その分、最初のリクエストで読み込みと
+クライアント生成の時間がかかるので、UIの初回描画後などに warm_up_in_background() で
+バックグラウンドに前倒しする。
+
+インポート時間の予算と重いモジュールが読み込まれないことは tests/test_import_time.py で検査する。
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import sys
+import threading
+import time
+
+from app.demo_a.llm_client import get_client, load_env
+
+logger = logging.getLogger(__name__)
+
+# 初回使用時まで読み込まない重いモジュール
+HEAVY_MODULES = ("anthropic", "pymupdf", "msoffcrypto")
+
+
+def warm_up() -> dict[str, float]:
+    """重いモジュールを読み込み、共有クライアントを生成する。
+
+    Returns:
+        モジュール名（と "client"）ごとの所要秒数
+    """
+    load_env()
+    timings: dict[str, float] = {}
+    for name in HEAVY_MODULES:
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("事前読み込みに失敗: %s: %s", name, e)
+            continue
+        timings[name] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    get_client()
+    timings["client"] = round(time.perf_counter() - t0, 3)
+    logger.info("ウォームアップ完了: %s", timings)
+    return timings
+
+
+def warm_up_in_background() -> threading.Thread:
+    """warm_up() をバックグラウンドスレッドで開始する。"""
+    thread = threading.Thread(target=warm_up, name="demo-a-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.demo_a.warmup", description="コールドスタートの計測")
+    parser.parse_args(argv)
+
+    print(json.dumps(warm_up(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,9 +3,17 @@
 import sys
 import json
 import logging
+import os
+import queue
 import tempfile
+import threading
+import time
 import traceback
+from collections.abc import Callable
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from pathlib import Path
+from typing import Any
 
 # Streamlit Cloud ではプロジェクトルートが sys.path に含まれないため明示的に追加
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
@@ -14,10 +22,27 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 logging.basicConfig(level=logging.WARNING, format="%(name)s %(levelname)s: %(message)s")
 
 import streamlit as st
-
-from app.demo_a.converter import TextContent, ensure_pdf
-from app.demo_a.pipeline import build_index, extract_with_schema
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.fingerprint import file_fingerprint, schema_fingerprint
+from app.demo_a.index_cache import (
+    STATUS_BUILDING,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_READY,
+    get_index_cache,
+    prewarm_in_background,
+)
+from app.demo_a.llm_client import STAGE_EXTRACT, STAGE_GROUP, STAGE_SEARCH, load_env
+from app.demo_a.model_routing import resolve_model_routing
+from app.demo_a.pipeline import extract_with_schema, prepare_extraction, run_extraction
+from app.demo_a.prefetch import STATE_DONE, STATE_RUNNING, SpeculativePrefetch
 from app.demo_a.presets import get_preset, list_presets
+from app.demo_a.schema_registry import warm_presets_in_background
+from app.demo_a.warmup import warm_up_in_background
+
+load_env()
 
 # --- プリセット文書定義 ---
 RESOURCES_BASE = Path(__file__).parent.parent.parent / "resources" / "PoC見積依頼_実際の業務資料"
@@ -76,12 +101,101 @@ for key, default in {
 }.items():
     if key not in st.session_state:
         st.session_state[key] = default
+# スキーマ選択中のフェーズ2投機実行（セッションごと）
+if "prefetch" not in st.session_state:
+    st.session_state.prefetch = SpeculativePrefetch()
 
 
 def _make_schema_key(fields: list[dict]) -> str:
     """スキーマのフィールド定義からキャッシュキーを生成する。"""
-    parts = tuple((f.get("name", ""), f.get("type", ""), f.get("description", "")) for f in fields)
-    return str(parts)
+    return schema_fingerprint(fields)
+
+
+PREWARM_ENABLED = os.getenv("DEMO_A_PREWARM", "") == "1"
+# スキーマ選択が落ち着いたら Step 5-7 を先行実行する（DEMO_A_SPECULATE=0 で無効）
+SPECULATE_ENABLED = os.getenv("DEMO_A_SPECULATE", "1") != "0"
+# Step 8（構造化抽出）まで先行実行する（選択を変えるたびに抽出のAPI呼び出しが発生する）
+SPECULATE_EXTRACT = os.getenv("DEMO_A_SPECULATE_EXTRACT", "") == "1"
+
+
+@st.cache_resource
+def _start_background_warmup() -> None:
+    """重いモジュールの読み込み・クライアント生成と、プリセットスキーマの
+    モデル・グルーピングの事前計算をプロセスごとに1回だけバックグラウンドで開始する。
+
+    DEMO_A_PREWARM=1 の場合はプリセット文書の変換・インデックス構築も事前に行う。
+    """
+    warm_up_in_background()
+    if PREWARM_ENABLED:
+        prewarm_in_background(list(PRESET_DOCUMENTS.values()))
+    else:
+        warm_presets_in_background()
+
+
+def _speculate(
+    pdf_path: Path, batches: list[dict], chunk_index, field_definitions: list[dict], cancel: CancelToken
+) -> tuple:
+    """投機実行の本体。Step 5-7（設定によっては Step 8-9 も）を実行する。
+
+    Returns:
+        (PreparedExtraction, 抽出結果 or None)
+    """
+    prepared = prepare_extraction(
+        pdf_path, batches, chunk_index, field_definitions, models=resolve_model_routing(), cancel=cancel
+    )
+    if SPECULATE_EXTRACT and not cancel.cancelled:
+        return prepared, run_extraction(prepared, cancel=cancel)
+    return prepared, None
+
+
+# 長い処理の完了を待つ間に画面を更新する間隔（秒）。drain を渡した場合は短い間隔で反映する
+_POLL_SECONDS = 0.5
+_DRAIN_POLL_SECONDS = 0.1
+
+
+def _run_cancellable(fn: Callable[[CancelToken], Any], drain: Callable[[], None] | None = None) -> Any:
+    """fn(cancel) を別スレッドで実行し、経過時間を表示しながら完了を待つ。
+
+    Streamlit は文書の切り替え（rerun）やセッション終了でスクリプト実行を止めるとき、
+    次の画面更新で例外を送出する。待機中も定期的に画面を更新してその例外を受け取り、
+    cancel を取り消して未送信のバッチ・送信中のリクエストを打ち切る。
+
+    fn の内部で起きた途中経過を画面に出す場合は、キューに積んでおき drain で取り出して描画する。
+    drain は待機中と完了時にスクリプトのスレッドで呼ぶ（fn が内部で使うスレッドからの
+    st.* 呼び出しはスクリプト実行のコンテキストを持たず、画面に反映されない）。
+    """
+    cancel = CancelToken()
+    future: Future = Future()
+
+    def _target() -> None:
+        try:
+            future.set_result(fn(cancel))
+        except BaseException as e:
+            future.set_exception(e)
+
+    thread = threading.Thread(target=_target, name="ui-cancellable", daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+
+    elapsed = st.empty()
+    started = time.monotonic()
+    interval = _POLL_SECONDS if drain is None else _DRAIN_POLL_SECONDS
+    try:
+        while True:
+            try:
+                result = future.result(timeout=interval)
+                break
+            except FuturesTimeoutError:
+                elapsed.caption(f"  経過 {time.monotonic() - started:.0f}秒")
+                if drain is not None:
+                    drain()
+        if drain is not None:
+            drain()
+        return result
+    finally:
+        if not future.done():
+            cancel.cancel()
+        elapsed.empty()
 
 
 # ===== サイドバー =====
@@ -101,6 +215,13 @@ with st.sidebar:
             selected_file_path = available_docs[selected_doc_name]
             file_id = f"preset:{selected_file_path}"
             st.caption(f"形式: {selected_file_path.suffix.upper()}")
+
+            if PREWARM_ENABLED:
+                cache = get_index_cache()
+                icons = {STATUS_READY: "✅", STATUS_BUILDING: "⏳", STATUS_QUEUED: "🕒", STATUS_FAILED: "❌"}
+                with st.expander("事前構築の状況"):
+                    for name, path in available_docs.items():
+                        st.caption(f"{icons.get(cache.status(path), '—')} {name}")
     else:
         uploaded_file = st.file_uploader(
             "ファイルをアップロード",
@@ -166,9 +287,9 @@ with st.sidebar:
         st.divider()
         st.header("📊 文書情報")
         _, batches, chunk_index = st.session_state.index_cache
-        if len(batches) == 1:
+        if chunk_index is None:
             st.metric("ページ数", batches[0]["page_count"])
-            st.caption("処理方式: 直接投入（100p以下）")
+            st.caption("処理方式: 直接投入")
         else:
             total_pages = batches[-1]["page_end"]
             st.metric("ページ数", total_pages)
@@ -177,6 +298,12 @@ with st.sidebar:
                 st.metric("チャンク数", len(chunk_index))
             st.caption("処理方式: セマンティックチャンク")
 
+            # ページ → チャンク検索（区間インデックス）
+            if chunk_index:
+                page = st.number_input("ページからチャンクを検索", min_value=1, max_value=total_pages, value=1)
+                for chunk in chunk_index.covering(int(page)):
+                    st.caption(f"{chunk.chunk_id}（p.{chunk.page_start}–{chunk.page_end}）: {chunk.query}")
+
     # 実行ログ（サイドバー下部に常時表示）
     if st.session_state.log_messages:
         st.divider()
@@ -196,38 +323,51 @@ if selected_file_path and field_definitions:
         st.subheader("フェーズ1: インデックス構築")
 
         with st.status("ファイルを処理中...", expanded=True) as status:
-            # Step 1: PDF変換
-            st.write("Step 1: ファイル受付 → PDF化")
-            try:
-                pdf_result = ensure_pdf(selected_file_path, output_dir=Path("output/converted"))
-            except Exception as e:
-                st.error(f"ファイル変換エラー: {e}")
-                with st.expander("トレースバック（詳細）", expanded=True):
-                    st.code(traceback.format_exc(), language="python")
-                st.stop()
-
-            if isinstance(pdf_result, TextContent):
-                st.warning(
-                    "テキストファイルは現在PDFパイプラインに対応していません。PDF/Word/Excelを使用してください。"
-                )
-                st.stop()
-
-            st.write(f"  → PDF変換完了: {pdf_result.name}")
-
-            # Step 2-3: バッチ分割 + チャンク生成
-            st.write("Step 2-3: バッチ分割 + インデックス構築")
-            try:
-                pdf_path, batches, chunk_index = build_index(pdf_result)
-            except Exception as e:
-                st.error(f"インデックス構築エラー: {e}")
-                with st.expander("トレースバック（詳細）", expanded=True):
-                    st.code(traceback.format_exc(), language="python")
-                st.stop()
-
+            cache = get_index_cache()
+            entry = cache.get(selected_file_path)
+            if entry is not None:
+                st.write("Step 1-3: 事前構築済みのインデックスを使用")
+            else:
+                # Step 1-3: PDF変換 → バッチ分割 + チャンク生成（他セッション・事前構築と共有）
+                if cache.status(selected_file_path) in (STATUS_QUEUED, STATUS_BUILDING):
+                    st.write("Step 1-3: 事前構築中のインデックスの完了を待機")
+                else:
+                    st.write("Step 1: ファイル受付 → PDF化")
+                    st.write("Step 2-3: バッチ分割 + インデックス構築")
+                try:
+                    entry = _run_cancellable(
+                        lambda cancel: cache.get_or_build(
+                            selected_file_path, output_dir=Path("output/converted"), cancel=cancel
+                        )
+                    )
+                except ValueError as e:
+                    st.warning(f"{e}。PDF/Word/Excelを使用してください。")
+                    st.stop()
+                except Exception as e:
+                    st.error(f"インデックス構築エラー: {e}")
+                    with st.expander("トレースバック（詳細）", expanded=True):
+                        st.code(traceback.format_exc(), language="python")
+                    st.stop()
+
+            pdf_path, batches, chunk_index = entry.pdf_path, entry.batches, entry.chunk_index
+            index_meta = entry.metadata
+            st.write(f"  → PDF: {pdf_path.name}")
+
+            route = index_meta["route"]
+            st.write(
+                f"  → ルーティング: {'インデックス検索' if route['route'] == 'indexed' else '直接抽出'}"
+                f"（{route['reason']}、約{route['document_tokens']:,}トークン）"
+            )
             if len(batches) == 1:
                 st.write(f"  → {batches[0]['page_count']}ページ（分割不要）")
             else:
                 st.write(f"  → {len(batches)}バッチに分割")
+                if index_meta.get("resumed_batches"):
+                    st.write(f"  → {index_meta['resumed_batches']}バッチは前回の構築結果（チェックポイント）を再利用")
+                if index_meta.get("dedup_pages"):
+                    st.write(f"  → {index_meta['dedup_pages']}ページは類似文書のチャンクを再利用")
+                if index_meta.get("fallback_batches"):
+                    st.write(f"  → {len(index_meta['fallback_batches'])}バッチはテキスト抽出で代替")
                 if chunk_index:
                     st.write(f"  → {len(chunk_index)}個のセマンティックチャンクを生成")
 
@@ -240,25 +380,104 @@ if selected_file_path and field_definitions:
     # --- フェーズ2: 検索→抽出 ---
     st.subheader("フェーズ2: 検索 → 抽出")
 
+    # 抽出ボタンが押される前に、この文書 × スキーマの Step 5-7 を先行実行しておく
+    pdf_path, batches, chunk_index = st.session_state.index_cache
+    prefetch: SpeculativePrefetch = st.session_state.prefetch
+    speculation_key = f"{file_fingerprint(pdf_path)}:{schema_key}"
+    speculate = SPECULATE_ENABLED and (chunk_index is not None or SPECULATE_EXTRACT)
+    if speculate and st.session_state.extraction_results is None:
+        prefetch.request(
+            speculation_key,
+            lambda cancel: _speculate(pdf_path, batches, chunk_index, field_definitions, cancel),
+        )
+
     col1, col2 = st.columns([1, 4])
-    run_extraction = col1.button("▶ 抽出実行", type="primary", use_container_width=True)
+    run_extraction_clicked = col1.button("▶ 抽出実行", type="primary", use_container_width=True)
+    key, state = prefetch.status()
+    if speculate and key == speculation_key and state in (STATE_RUNNING, STATE_DONE):
+        col2.caption("⚡ 先行実行済み" if state == STATE_DONE else "⚡ 検索・コンテキスト統合を先行実行中")
 
-    if run_extraction:
-        pdf_path, batches, chunk_index = st.session_state.index_cache
+    if run_extraction_clicked:
         # ログをクリア
         st.session_state.log_messages = []
-
+        routing = resolve_model_routing()
         with st.status("抽出中...", expanded=True) as status:
-            if chunk_index:
-                st.write("Step 5: フィールドグルーピング")
-                st.write("Step 6: チャンク検索")
+            # 先行実行中ならその完了を待って使う（最初からやり直すより早い）
+            adopted = prefetch.take(speculation_key) if speculate else None
+            prepared, speculative_results = adopted or (None, None)
+
+            if chunk_index and prepared is not None:
+                st.write("Step 5-7: 先行実行済みの検索結果・コンテキストを使用")
+            elif chunk_index:
+                st.write(f"Step 5: フィールドグルーピング（{routing.step(STAGE_GROUP).model}）")
+                st.write(f"Step 6: チャンク検索（{routing.step(STAGE_SEARCH).model}）")
                 st.write("Step 7: コンテキスト統合")
-            st.write("Step 8: 構造化抽出（Sonnet 4.6）")
+            st.write(
+                f"Step 8: 構造化抽出（{routing.step(STAGE_EXTRACT).model}）"
+                + ("（先行実行済み）" if speculative_results is not None else "")
+            )
             st.write(f"  フィールド数: {len(field_definitions)}")
             st.write(f"  フィールド: {', '.join(f['name'] for f in field_definitions)}")
 
+            # 値が確定したフィールドから順に表を埋める（ストリーミング受信）
+            live_table = st.empty()
+            streamed: dict[str, object] = {}
+
+            def _render_live_table() -> None:
+                live_table.dataframe(
+                    [
+                        {
+                            "項目": f["name"],
+                            "抽出値": ("—" if streamed[f["name"]] is None else str(streamed[f["name"]]))
+                            if f["name"] in streamed
+                            else "⏳",
+                        }
+                        for f in field_definitions
+                    ],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
+            # on_field は抽出ステージのスレッドから呼ばれるので、キューに積んでスクリプトのスレッドで描画する
+            field_events: queue.Queue[tuple[str, object]] = queue.Queue()
+
+            def _drain_fields() -> None:
+                updated = False
+                while True:
+                    try:
+                        name, value = field_events.get_nowait()
+                    except queue.Empty:
+                        break
+                    streamed[name] = value
+                    updated = True
+                if updated:
+                    _render_live_table()
+
+            def _on_field(name: str, value: object) -> None:
+                field_events.put((name, value))
+
+            def _extract(cancel: CancelToken) -> list:
+                if prepared is not None:
+                    return run_extraction(prepared, on_field=_on_field, cancel=cancel)
+                return extract_with_schema(
+                    pdf_path,
+                    batches,
+                    chunk_index,
+                    field_definitions,
+                    on_field=_on_field,
+                    models=routing,
+                    cancel=cancel,
+                )
+
+            _render_live_table()
+
+            # 表の更新中にスクリプト実行が止められた場合（文書の切り替え・セッション終了）、
+            # _run_cancellable が並列に実行中の残りの抽出リクエストも打ち切る
             try:
-                results = extract_with_schema(pdf_path, batches, chunk_index, field_definitions)
+                if speculative_results is not None:
+                    results = speculative_results
+                else:
+                    results = _run_cancellable(_extract, drain=_drain_fields)
             except Exception as e:
                 status.update(label="抽出失敗", state="error", expanded=True)
                 st.error(f"抽出エラー: {e}")
@@ -269,11 +488,10 @@ if selected_file_path and field_definitions:
                     st.code(tb, language="python")
 
                 # スキーマ情報表示
-                from app.demo_a.schema_builder import build_extraction_schema
+                from app.demo_a.schema_registry import get_registry
 
                 try:
-                    debug_model = build_extraction_schema(field_definitions)
-                    schema_json = debug_model.model_json_schema()
+                    schema_json = get_registry().compile(field_definitions).json_schema
                     with st.expander("送信スキーマ（JSON Schema）", expanded=True):
                         st.json(schema_json)
                 except Exception:
@@ -283,6 +501,7 @@ if selected_file_path and field_definitions:
 
                 st.stop()
 
+            live_table.empty()
             st.session_state.extraction_results = results
             status.update(label="抽出完了", state="complete", expanded=False)
 
@@ -330,3 +549,6 @@ elif not selected_file_path:
     st.info("サイドバーから文書を選択してください。")
 elif not field_definitions:
     st.info("サイドバーでスキーマを定義してください。")
+
+# 初回描画の後に、最初の処理で必要になる読み込み・計算を前倒しする
+_start_background_warmup()
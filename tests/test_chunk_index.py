@@ -0,0 +1,107 @@
+"""ChunkIndex（区間検索）と reconcile_batch_chunks（バッチ境界の調停）のテスト"""
+
+import random
+
+import pytest
+
+from app.demo_a.chunk_index import ChunkIndex, reconcile_batch_chunks
+from app.demo_a.schemas import SemanticChunk
+
+
+def _chunk(chunk_id: str, start: int, end: int, description: str = "") -> SemanticChunk:
+    return SemanticChunk(
+        chunk_id=chunk_id, page_start=start, page_end=end, query=chunk_id, description=description or chunk_id
+    )
+
+
+def _random_chunks(seed: int, count: int = 200, pages: int = 300) -> list[SemanticChunk]:
+    rng = random.Random(seed)
+    chunks = []
+    for i in range(count):
+        start = rng.randint(1, pages)
+        chunks.append(_chunk(f"c{i}", start, min(pages, start + rng.choice((0, 1, 3, 10, 40)))))
+    return chunks
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_overlapping_matches_linear_scan(seed: int) -> None:
+    chunks = _random_chunks(seed)
+    index = ChunkIndex(chunks)
+    rng = random.Random(seed + 100)
+    for _ in range(100):
+        lo = rng.randint(0, 310)
+        hi = lo + rng.randint(0, 20)
+        expected = sorted(
+            (c for c in chunks if c.page_start <= hi and lo <= c.page_end), key=lambda c: (c.page_start, c.page_end)
+        )
+        assert [c.chunk_id for c in index.overlapping(lo, hi)] == [c.chunk_id for c in expected]
+
+
+def test_sequence_access_and_lookup() -> None:
+    index = ChunkIndex([_chunk("b", 5, 9), _chunk("a", 1, 4)])
+    assert len(index) == 2
+    assert [c.chunk_id for c in index] == ["a", "b"]
+    assert index[1].chunk_id == "b"
+    assert [c.chunk_id for c in index[:1]] == ["a"]
+    assert index.get("b").page_start == 5
+    assert index.get("missing") is None
+    assert [c.chunk_id for c in index.covering(4)] == ["a"]
+    assert ChunkIndex([]).overlapping(1, 10) == []
+
+
+def test_reconcile_drops_contained_duplicates_and_renumbers() -> None:
+    batches = [{"page_start": 1, "page_end": 20}, {"page_start": 19, "page_end": 38}]
+    result = reconcile_batch_chunks(
+        [
+            [_chunk("x", 1, 10), _chunk("y", 11, 18)],
+            [_chunk("z", 12, 16), _chunk("w", 21, 38)],
+        ],
+        batches,
+    )
+    assert [(c.page_start, c.page_end) for c in result] == [(1, 10), (11, 18), (21, 38)]
+    assert len({c.chunk_id for c in result}) == 3
+
+
+def test_reconcile_merges_section_cut_at_batch_end() -> None:
+    batches = [{"page_start": 1, "page_end": 20}, {"page_start": 19, "page_end": 38}]
+    result = reconcile_batch_chunks(
+        [
+            [_chunk("a", 1, 14), _chunk("b", 15, 20, "短い説明")],
+            [_chunk("c", 19, 30, "長い説明"), _chunk("d", 31, 38)],
+        ],
+        batches,
+    )
+    assert [(c.page_start, c.page_end) for c in result] == [(1, 14), (15, 30), (31, 38)]
+    # ページ数の多い側の説明を採る
+    assert result[1].description == "長い説明"
+
+
+def test_reconcile_truncates_partial_overlap_with_closed_section() -> None:
+    batches = [{"page_start": 1, "page_end": 20}, {"page_start": 19, "page_end": 38}]
+    result = reconcile_batch_chunks([[_chunk("a", 1, 19)], [_chunk("b", 19, 30), _chunk("c", 31, 38)]], batches)
+    assert [(c.page_start, c.page_end) for c in result] == [(1, 19), (20, 30), (31, 38)]
+
+
+def test_merged_section_does_not_overlap_closed_section() -> None:
+    batches = [{"page_start": 1, "page_end": 20}, {"page_start": 19, "page_end": 38}]
+    result = reconcile_batch_chunks(
+        [
+            [_chunk("a", 1, 19), _chunk("b", 20, 20)],
+            [_chunk("c", 18, 25), _chunk("d", 26, 38)],
+        ],
+        batches,
+    )
+    assert [(c.page_start, c.page_end) for c in result] == [(1, 19), (20, 25), (26, 38)]
+
+
+def test_merge_is_skipped_when_other_boundary_chunks_cover_it() -> None:
+    batches = [{"page_start": 1, "page_end": 20}, {"page_start": 19, "page_end": 38}]
+    result = reconcile_batch_chunks(
+        [
+            [_chunk("a", 1, 9), _chunk("x", 10, 20), _chunk("y", 19, 20)],
+            [_chunk("z", 9, 20), _chunk("w", 21, 38)],
+        ],
+        batches,
+    )
+    assert all(c.page_start <= c.page_end for c in result)
+    assert [(c.page_start, c.page_end) for c in result] == [(1, 9), (10, 20), (19, 20), (21, 38)]
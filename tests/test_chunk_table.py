@@ -0,0 +1,96 @@
+"""ChunkTable（列指向ファイルの書き出し・mmap読み出し・文書/ページ範囲での絞り込み）のテスト"""
+
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from app.demo_a.chunk_table import ChunkTable, main
+from app.demo_a.schemas import SemanticChunk
+
+
+def _chunk(chunk_id: str, start: int, end: int) -> SemanticChunk:
+    return SemanticChunk(
+        chunk_id=chunk_id, page_start=start, page_end=end, query=f"{chunk_id}の検索語", description=f"説明 {chunk_id}"
+    )
+
+
+def _entries(seed: int = 0) -> list[tuple[str, list[SemanticChunk]]]:
+    rng = random.Random(seed)
+    entries = []
+    for d, document in enumerate(("b.pdf", "a.pdf", "契約書.pdf")):
+        chunks = []
+        for i in range(50):
+            start = rng.randint(1, 200)
+            chunks.append(_chunk(f"d{d}_{i}", start, start + rng.randint(0, 15)))
+        entries.append((document, chunks))
+    return entries
+
+
+@pytest.fixture
+def table(tmp_path: Path):
+    path = ChunkTable.from_chunks(_entries()).write(tmp_path / "chunks.dct")
+    table = ChunkTable.open(path)
+    yield table
+    table.close()
+
+
+def test_round_trip_keeps_every_chunk(table: ChunkTable) -> None:
+    assert len(table) == 150
+    for document, chunks in _entries():
+        expected = sorted(chunks, key=lambda c: (c.page_start, c.page_end))
+        assert [(c.page_start, c.page_end) for c in table.chunks(document)] == [
+            (c.page_start, c.page_end) for c in expected
+        ]
+        assert {c.chunk_id: c for c in table.chunks(document)} == {c.chunk_id: c for c in chunks}
+
+
+@pytest.mark.parametrize("document", [None, "a.pdf", "契約書.pdf"])
+def test_select_matches_linear_scan(table: ChunkTable, document: str | None) -> None:
+    rng = random.Random(1)
+    for _ in range(50):
+        first = rng.randint(0, 220)
+        last = first + rng.randint(0, 30)
+        for page_start, page_end in ((first, last), (first, None), (None, last)):
+            expected = [
+                row
+                for row in range(len(table))
+                if (document is None or table.document_of(row) == document)
+                and (page_start is None or table.page_end[row] >= page_start)
+                and (page_end is None or table.page_start[row] <= page_end)
+            ]
+            assert table.select(document, page_start, page_end) == expected
+
+
+def test_unknown_document_selects_nothing(table: ChunkTable) -> None:
+    assert table.document_rows("missing.pdf") == range(0)
+    assert table.select("missing.pdf", 1, 10) == []
+    assert table.chunks("missing.pdf") == []
+
+
+def test_close_releases_mapping(tmp_path: Path) -> None:
+    path = ChunkTable.from_chunks(_entries()).write(tmp_path / "chunks.dct")
+    table = ChunkTable.open(path)
+    table.close()
+    table.close()
+    # 閉じた後もファイルを置き換えられる
+    ChunkTable.from_chunks(_entries(seed=1)).write(path)
+    reopened = ChunkTable.open(path)
+    assert len(reopened) == 150
+    reopened.close()
+
+
+def test_cli_packs_logs_and_queries_pages(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    log = tmp_path / "contract_chunk_index.json"
+    chunks = [_chunk("c1", 1, 10), _chunk("c2", 11, 30), _chunk("c3", 31, 40)]
+    log.write_text(
+        json.dumps({"source_pdf": "contract.pdf", "chunks": [c.model_dump() for c in chunks]}), encoding="utf-8"
+    )
+    table_path = tmp_path / "chunks.dct"
+
+    assert main(["pack", str(log), "-o", str(table_path)]) == 0
+    capsys.readouterr()
+    assert main(["query", str(table_path), "--document", "contract.pdf", "--pages", "20-31"]) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r["document"], r["chunk_id"]) for r in records] == [("contract.pdf", "c2"), ("contract.pdf", "c3")]
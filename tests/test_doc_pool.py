@@ -0,0 +1,111 @@
+"""DocumentPool（オープン済み文書の共有・ロックの外での読み込み）のテスト"""
+
+import threading
+from pathlib import Path
+
+import pymupdf
+import pytest
+
+from app.demo_a.doc_pool import DocumentPool
+
+
+def _write_pdf(path: Path, pages: int) -> Path:
+    doc = pymupdf.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"page {i + 1}")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+@pytest.fixture
+def pdfs(tmp_path: Path) -> tuple[Path, Path]:
+    return _write_pdf(tmp_path / "a.pdf", 2), _write_pdf(tmp_path / "b.pdf", 3)
+
+
+def test_open_document_is_reused_until_file_changes(pdfs: tuple[Path, Path]) -> None:
+    a, _ = pdfs
+    pool = DocumentPool()
+    with pool.borrow(a) as first:
+        pass
+    with pool.borrow(a) as second:
+        assert second is first
+    assert (pool.hits, pool.misses) == (1, 1)
+
+    _write_pdf(a, 4)
+    with pool.borrow(a) as reopened:
+        assert reopened.page_count == 4
+    assert first.is_closed
+
+
+def test_slow_open_does_not_block_other_borrowers(pdfs: tuple[Path, Path], monkeypatch: pytest.MonkeyPatch) -> None:
+    a, b = pdfs
+    pool = DocumentPool()
+    with pool.borrow(b):
+        pass
+
+    opening = threading.Event()
+    release = threading.Event()
+    real_open = pymupdf.open
+
+    def _slow_open(path, *args, **kwargs):
+        if Path(path) == a:
+            opening.set()
+            assert release.wait(5)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(pymupdf, "open", _slow_open)
+
+    def _borrow_a() -> None:
+        with pool.borrow(a):
+            pass
+
+    borrowed_b = threading.Event()
+
+    def _borrow_b() -> None:
+        with pool.borrow(b):
+            borrowed_b.set()
+
+    threads = [threading.Thread(target=_borrow_a), threading.Thread(target=_borrow_b)]
+    threads[0].start()
+    try:
+        assert opening.wait(5)
+        # a を開いている最中でも、開いてある b はすぐに借りられる
+        threads[1].start()
+        assert borrowed_b.wait(2)
+    finally:
+        release.set()
+        for t in threads:
+            t.join(5)
+
+
+def test_racing_opens_keep_one_document(pdfs: tuple[Path, Path], monkeypatch: pytest.MonkeyPatch) -> None:
+    a, _ = pdfs
+    pool = DocumentPool()
+    barrier = threading.Barrier(2, timeout=5)
+    opened: list[pymupdf.Document] = []
+    real_open = pymupdf.open
+
+    def _racing_open(path, *args, **kwargs):
+        doc = real_open(path, *args, **kwargs)
+        opened.append(doc)
+        barrier.wait()
+        return doc
+
+    monkeypatch.setattr(pymupdf, "open", _racing_open)
+    borrowed: list[pymupdf.Document] = []
+
+    def _borrow() -> None:
+        with pool.borrow(a) as doc:
+            borrowed.append(doc)
+
+    threads = [threading.Thread(target=_borrow) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    assert len(opened) == 2
+    assert borrowed[0] is borrowed[1]
+    # 競争に負けた側が開いた文書は閉じられている
+    assert sum(doc.is_closed for doc in opened) == 1
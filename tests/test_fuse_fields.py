@@ -0,0 +1,43 @@
+"""fuse_field_definitions（複数スキーマのフィールド統合・改名）のテスト"""
+
+from app.demo_a.pipeline import fuse_field_definitions
+
+
+def _field(name: str, type_: str = "str", description: str = "") -> dict:
+    return {"name": name, "type": type_, "description": description or name}
+
+
+def test_identical_fields_are_shared_and_conflicts_renamed() -> None:
+    fused, mappings = fuse_field_definitions(
+        [
+            {"name": "引合", "fields": [_field("件名"), _field("金額", "int")]},
+            {"name": "契約", "fields": [_field("件名"), _field("金額", "str")]},
+        ]
+    )
+    assert [f["name"] for f in fused] == ["件名", "金額", "金額_2"]
+    assert mappings == [{"件名": "件名", "金額": "金額"}, {"件名": "件名", "金額": "金額_2"}]
+
+
+def test_renamed_field_does_not_collide_with_real_field_of_later_schema() -> None:
+    fused, mappings = fuse_field_definitions(
+        [
+            {"name": "a", "fields": [_field("金額", "int")]},
+            {"name": "b", "fields": [_field("金額", "str")]},
+            {"name": "c", "fields": [_field("金額_2", "str", "金額")]},
+        ]
+    )
+    # b の改名先は c が元から持つ "金額_2" を避ける
+    assert mappings[1]["金額"] != "金額_2"
+    assert mappings[2] == {"金額_2": "金額_2"}
+    assert len({f["name"] for f in fused}) == len(fused) == 3
+
+
+def test_renamed_field_does_not_collide_with_real_field_of_earlier_schema() -> None:
+    fused, mappings = fuse_field_definitions(
+        [
+            {"name": "a", "fields": [_field("金額", "int"), _field("金額_2", "str", "金額")]},
+            {"name": "b", "fields": [_field("金額", "str", "金額")]},
+        ]
+    )
+    assert mappings[1]["金額"] not in ("金額", "金額_2")
+    assert len(fused) == 3
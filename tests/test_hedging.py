@@ -0,0 +1,104 @@
+"""ヘッジリクエスト（HedgeTracker の統計と DemoAClient._hedged_send の精算・記録）のテスト"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.demo_a.hedging import MIN_SAMPLES, HedgeTracker
+from app.demo_a.llm_client import DemoAClient
+from app.demo_a.rate_governor import PRIORITY_NORMAL, RateGovernor, estimate_input_tokens
+
+STAGE = "chunk"
+PARAMS = {"messages": [{"role": "user", "content": "x" * 1000}]}
+
+
+class _FakeStream:
+    """delay 秒後に完了するストリーム。close() されたら中断のエラーで終わる。"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self._closed = threading.Event()
+
+    def __enter__(self) -> "_FakeStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def until_done(self) -> None:
+        if self._closed.wait(self.delay):
+            raise RuntimeError("stream closed")
+
+    def get_final_message(self) -> SimpleNamespace:
+        return SimpleNamespace(parsed_output="ok", usage=SimpleNamespace(input_tokens=10))
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+def _client(delays: list[float], tpm: int = 100_000) -> DemoAClient:
+    """送信ごとに delays の順で応答する偽のAPIクライアントを持つ DemoAClient。"""
+    client = DemoAClient(api_key="test", governor=RateGovernor(rpm=0, tpm=tpm), hedge=True, hedge_stages={STAGE})
+    remaining = list(delays)
+    client.client = SimpleNamespace(messages=SimpleNamespace(stream=lambda **params: _FakeStream(remaining.pop(0))))
+    return client
+
+
+def _seed(tracker: HedgeTracker, seconds: float, calls: int) -> None:
+    for _ in range(MIN_SAMPLES):
+        tracker.record_latency(STAGE, seconds)
+    for _ in range(calls):
+        tracker.begin_call(STAGE)
+
+
+def test_threshold_needs_min_samples() -> None:
+    tracker = HedgeTracker(quantile=0.9)
+    for i in range(MIN_SAMPLES - 1):
+        tracker.record_latency(STAGE, float(i))
+    assert tracker.threshold(STAGE) is None
+    tracker.record_latency(STAGE, 100.0)
+    assert tracker.threshold(STAGE) == 100.0
+
+
+def test_hedges_are_capped_by_ratio() -> None:
+    tracker = HedgeTracker(max_hedge_ratio=0.1)
+    for _ in range(10):
+        tracker.begin_call(STAGE)
+    assert tracker.try_acquire_hedge(STAGE)
+    assert not tracker.try_acquire_hedge(STAGE)
+    assert tracker.metrics()[STAGE]["hedges"] == 1
+
+
+def test_hedge_win_records_end_to_end_latency_and_charges_loser() -> None:
+    client = _client([5.0, 0.0])
+    _seed(client.hedge_tracker, 0.05, calls=10)
+    estimated = estimate_input_tokens(PARAMS["messages"])
+
+    response = client._hedged_send(PARAMS, PRIORITY_NORMAL, STAGE)
+
+    assert response.parsed_output == "ok"
+    metrics = client.hedge_metrics()[STAGE]
+    assert metrics["hedges"] == 1
+    assert metrics["hedge_wins"] == 1
+    # ヘッジ自身の所要時間ではなく、プライマリの送信からの時間を記録する
+    assert client.hedge_tracker._stages[STAGE].latencies[-1] >= 0.05
+    # 中断したプライマリは見積もり分を消費したものとして精算する（返却しない）
+    deadline = time.monotonic() + 5
+    while client.governor.stats()["actual_tokens"] < estimated + 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.governor.stats()["actual_tokens"] == estimated + 10
+
+
+def test_slow_primary_is_recorded_as_tail_when_hedge_cap_is_hit() -> None:
+    client = _client([0.2])
+    # 呼び出し数0ではヘッジ上限に達しているため、ヘッジせずにプライマリを待つ
+    _seed(client.hedge_tracker, 0.05, calls=0)
+
+    client._hedged_send(PARAMS, PRIORITY_NORMAL, STAGE)
+
+    stats = client.hedge_tracker._stages[STAGE]
+    assert stats.hedges == 0
+    assert list(stats.tail) == [pytest.approx(stats.latencies[-1])]
+    assert stats.latencies[-1] >= 0.2
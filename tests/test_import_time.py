@@ -0,0 +1,54 @@
+"""エントリモジュールのインポート時間の検査（コールドスタート対策の回帰防止）
+
+新しいインタプリタでエントリモジュールを読み込み、重いモジュール（anthropic / pymupdf /
+msoffcrypto）が sys.modules に入らないことを確認する。
+所要時間の検査は負荷の高いCI環境では不安定なため、環境変数 DEMO_A_IMPORT_BUDGET（秒）を
+指定したときだけ実行する。
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app.demo_a.warmup import HEAVY_MODULES
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ENTRY_MODULES = ("app.demo_a.pipeline", "app.demo_a.cli", "app.demo_a.server")
+
+IMPORT_BUDGET = os.getenv("DEMO_A_IMPORT_BUDGET")
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _probe(modules: tuple[str, ...]) -> dict:
+    probe = _PROBE.format(modules=modules, heavy=HEAVY_MODULES)
+    completed = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_probe_covers_sdk_and_pdf_library() -> None:
+    assert {"anthropic", "pymupdf"} <= set(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize("module", ENTRY_MODULES)
+def test_entry_module_does_not_load_heavy_modules(module: str) -> None:
+    assert _probe((module,))["loaded"] == []
+
+
+@pytest.mark.skipif(IMPORT_BUDGET is None, reason="DEMO_A_IMPORT_BUDGET（秒）を指定したときだけ実行する")
+def test_entry_modules_import_within_budget() -> None:
+    budget = float(IMPORT_BUDGET)
+    result = _probe(ENTRY_MODULES)
+    assert result["seconds"] <= budget, f"インポート時間が予算超過: {result['seconds']:.3f}s > {budget:.3f}s"
@@ -0,0 +1,180 @@
+"""JobManager（インデックス枠の制限・依存・取消・終了ジョブの破棄）のテスト"""
+
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from app.demo_a.cancellation import raise_if_cancelled
+from app.demo_a.jobs import JOB_EXTRACT, JOB_INDEX, Job, JobManager
+from app.demo_a.server import JobService
+
+
+def _wait_done(manager: JobManager, job: Job, timeout: float = 5.0) -> Job:
+    deadline = time.monotonic() + timeout
+    while not job.done:
+        assert time.monotonic() < deadline, f"ジョブ {job.job_id} が終わらない（{job.status}）"
+        manager.wait_for_update(job, job.version, timeout=0.05)
+    return job
+
+
+@pytest.fixture
+def gate() -> threading.Event:
+    return threading.Event()
+
+
+def _manager(gate: threading.Event, **kwargs) -> tuple[JobManager, list[str]]:
+    """gate が開くまでインデックスジョブが終わらないマネージャと、ジョブの開始順。"""
+    started: list[str] = []
+
+    def _index(job: Job) -> str:
+        started.append(job.params["name"])
+        while not gate.wait(0.01):
+            raise_if_cancelled(job.cancel)
+        return job.params["name"]
+
+    def _extract(job: Job) -> str:
+        started.append(job.params["name"])
+        return job.params["name"]
+
+    manager = JobManager({JOB_INDEX: _index, JOB_EXTRACT: _extract}, **kwargs)
+    return manager, started
+
+
+def test_extract_runs_while_index_jobs_fill_their_slots(gate: threading.Event) -> None:
+    manager, started = _manager(gate, max_workers=2)
+    try:
+        first = manager.submit(JOB_INDEX, {"name": "index-1"})
+        second = manager.submit(JOB_INDEX, {"name": "index-2"})
+        extract = manager.submit(JOB_EXTRACT, {"name": "extract"})
+
+        # インデックスは max_workers - 1 件までなので、抽出用の1枠が空いている
+        assert _wait_done(manager, extract).status == "succeeded"
+        assert second.status == "queued"
+        gate.set()
+        assert _wait_done(manager, first).result == "index-1"
+        assert _wait_done(manager, second).result == "index-2"
+    finally:
+        gate.set()
+        manager.shutdown()
+
+
+def test_dependent_job_waits_and_fails_with_its_dependency(gate: threading.Event) -> None:
+    manager, started = _manager(gate, max_workers=2)
+    try:
+        index = manager.submit(JOB_INDEX, {"name": "index"})
+        extract = manager.submit(JOB_EXTRACT, {"name": "extract"}, depends_on=index)
+        time.sleep(0.05)
+        assert extract.status == "queued"
+
+        assert manager.cancel(index.job_id)
+        assert _wait_done(manager, index).status == "cancelled"
+        assert _wait_done(manager, extract).status == "failed"
+        assert "extract" not in started
+    finally:
+        gate.set()
+        manager.shutdown()
+
+
+def test_cancel_queued_job_never_runs(gate: threading.Event) -> None:
+    manager, started = _manager(gate, max_workers=2)
+    try:
+        running = manager.submit(JOB_INDEX, {"name": "running"})
+        queued = manager.submit(JOB_INDEX, {"name": "queued"})
+        assert manager.cancel(queued.job_id)
+        assert queued.status == "cancelled"
+        gate.set()
+        _wait_done(manager, running)
+        assert started == ["running"]
+        assert not manager.cancel(running.job_id)
+    finally:
+        gate.set()
+        manager.shutdown()
+
+
+def test_finished_jobs_are_evicted_by_count_and_ttl(gate: threading.Event) -> None:
+    gate.set()
+    evicted: list[str] = []
+    manager, _ = _manager(
+        gate, max_workers=1, max_retained_jobs=2, job_ttl=None, on_evict=lambda j: evicted.append(j.job_id)
+    )
+    try:
+        jobs = [_wait_done(manager, manager.submit(JOB_EXTRACT, {"name": str(i)})) for i in range(4)]
+        assert [j.job_id for j in manager.list_jobs()] == [j.job_id for j in jobs[2:]]
+        assert evicted == [j.job_id for j in jobs[:2]]
+
+        manager.job_ttl = 0.0
+        jobs[-1].finished_at -= 1
+        manager.submit(JOB_EXTRACT, {"name": "new"})
+        assert manager.get(jobs[-1].job_id) is None
+    finally:
+        manager.shutdown()
+
+
+def test_job_needed_by_unfinished_job_is_kept(gate: threading.Event) -> None:
+    jobs: dict[str, Job] = {}
+    evicted: list[tuple[str, bool]] = []
+    manager, _ = _manager(
+        gate,
+        max_workers=1,
+        max_retained_jobs=1,
+        job_ttl=None,
+        on_evict=lambda j: evicted.append((j.params["name"], jobs["dependent"].done)),
+    )
+    try:
+        jobs["source"] = manager.submit(JOB_INDEX, {"name": "source"})
+        jobs["dependent"] = manager.submit(JOB_EXTRACT, {"name": "dependent"}, depends_on=jobs["source"])
+        gate.set()
+        assert _wait_done(manager, jobs["dependent"]).status == "succeeded"
+        # 保持数を超えていても、未完了の dependent が依存している間は source を捨てない
+        assert evicted == [("source", True)]
+    finally:
+        gate.set()
+        manager.shutdown()
+
+
+@pytest.mark.parametrize("priority", ["high", 1.5, True])
+def test_non_int_priority_is_rejected_without_leaving_a_job(gate: threading.Event, priority: object) -> None:
+    gate.set()
+    manager, _ = _manager(gate, max_workers=1)
+    try:
+        with pytest.raises(ValueError, match="優先度"):
+            manager.submit(JOB_EXTRACT, {"name": "bad"}, priority)
+        assert manager.list_jobs() == []
+        # ワーカーは生きていて、続くジョブを実行できる
+        assert _wait_done(manager, manager.submit(JOB_EXTRACT, {"name": "next"})).status == "succeeded"
+    finally:
+        manager.shutdown()
+
+
+def test_server_rejects_non_int_priority(tmp_path: Path) -> None:
+    document = tmp_path / "doc.pdf"
+    document.write_bytes(b"%PDF-1.4")
+    service = JobService(max_workers=1, output_dir=tmp_path)
+    try:
+        with pytest.raises(ValueError, match="priority"):
+            service.submit({"type": JOB_INDEX, "path": str(document), "priority": "high"})
+        assert service.manager.list_jobs() == []
+    finally:
+        service.manager.shutdown()
+
+
+def test_worker_survives_error_while_picking_next_job(gate: threading.Event, monkeypatch: pytest.MonkeyPatch) -> None:
+    gate.set()
+    manager, _ = _manager(gate, max_workers=1)
+    original = manager._next_runnable
+    failures = iter([RuntimeError("broken heap")])
+
+    def _flaky() -> Job | None:
+        for error in failures:
+            raise error
+        return original()
+
+    monkeypatch.setattr(manager, "_next_runnable", _flaky)
+    try:
+        with manager._cond:
+            manager._cond.notify_all()
+        assert _wait_done(manager, manager.submit(JOB_EXTRACT, {"name": "after"})).status == "succeeded"
+    finally:
+        manager.shutdown()
@@ -0,0 +1,103 @@
+"""ページ重複検出（署名の一致判定・LSH検索・再利用区間の計画・チャンクのページ写像）のテスト"""
+
+import random
+from pathlib import Path
+
+import pytest
+
+from app.demo_a.model_routing import StepModel
+from app.demo_a.page_dedup import (
+    MIN_PAGE_CHARS,
+    PageDedup,
+    PageSignature,
+    SignatureIndex,
+    page_signature,
+)
+from app.demo_a.schemas import SemanticChunk
+
+STEP = StepModel("test-model")
+_WORDS = [(10.0 * i, 20.0 * (i % 7), 10.0 * i + 8, 20.0 * (i % 7) + 10, "w") for i in range(40)]
+
+
+def _page_text(seed: int) -> str:
+    rng = random.Random(seed)
+    return " ".join("".join(rng.choice("あいうえおかきくけこさしすせそ") for _ in range(6)) for _ in range(60))
+
+
+def _signatures(seeds: list[int | None]) -> list[PageSignature]:
+    """seed ごとのページ（None は白紙ページ）の署名。"""
+    return [page_signature("", []) if s is None else page_signature(_page_text(s), _WORDS) for s in seeds]
+
+
+def _chunk(chunk_id: str, start: int, end: int) -> SemanticChunk:
+    return SemanticChunk(chunk_id=chunk_id, page_start=start, page_end=end, query=chunk_id, description=chunk_id)
+
+
+@pytest.fixture
+def dirs(tmp_path: Path) -> tuple[SignatureIndex, Path]:
+    return SignatureIndex(tmp_path / "signatures"), tmp_path / "chunks"
+
+
+def test_signature_matches_same_text_and_rejects_other_text() -> None:
+    a, same, other = _signatures([1, 1, 2])
+    assert a.matches(same)
+    assert not a.matches(other)
+    assert a.similarity(other) < 0.5
+
+
+def test_short_page_has_no_minhash() -> None:
+    sig = page_signature("x" * (MIN_PAGE_CHARS - 1), [])
+    assert not sig.has_text
+    assert sig.similarity(sig) == 0.0
+
+
+def test_index_persists_and_finds_candidates(dirs: tuple[SignatureIndex, Path], tmp_path: Path) -> None:
+    index, _ = dirs
+    index.register("source", _signatures([1, 2, 3]))
+
+    reloaded = SignatureIndex(tmp_path / "signatures")
+    [query] = _signatures([2])
+    assert [(fp, page) for fp, page, _ in reloaded.candidates(query, exclude="other")] == [("source", 2)]
+    assert reloaded.candidates(query, exclude="source") == []
+
+
+def test_plan_reuses_shifted_pages_from_registered_document(dirs: tuple[SignatureIndex, Path]) -> None:
+    index, chunk_dir = dirs
+    source = PageDedup("source", _signatures([1, 2, 3, 4, 5]), STEP, index, "client", chunk_dir)
+    source.register([_chunk("c1", 1, 2), _chunk("c2", 3, 5)])
+
+    # 先頭に新しいページが2枚入り、source の p.2-5 が p.3-6 にずれた文書
+    target = PageDedup("target", _signatures([10, 11, 2, 3, 4, 5]), STEP, index, "client", chunk_dir)
+    segments = target.plan({"page_start": 1, "page_end": 6})
+
+    assert [(s.page_start, s.page_end, s.source) for s in segments] == [(1, 2, None), (3, 6, "source")]
+    reused = segments[1].chunks
+    assert [(c.chunk_id, c.page_start, c.page_end) for c in reused] == [("c1", 3, 3), ("c2", 4, 6)]
+
+
+def test_blank_page_between_matches_is_reused(dirs: tuple[SignatureIndex, Path]) -> None:
+    index, chunk_dir = dirs
+    PageDedup("source", _signatures([1, None, 3]), STEP, index, "client", chunk_dir).register([_chunk("c", 1, 3)])
+
+    target = PageDedup("target", _signatures([1, None, 3]), STEP, index, "client", chunk_dir)
+    segments = target.plan({"page_start": 1, "page_end": 3})
+    assert [(s.page_start, s.page_end, s.source) for s in segments] == [(1, 3, "source")]
+
+
+def test_chunks_from_other_client_or_model_are_not_reused(dirs: tuple[SignatureIndex, Path]) -> None:
+    index, chunk_dir = dirs
+    PageDedup("source", _signatures([1, 2, 3]), STEP, index, "stub", chunk_dir).register([_chunk("c", 1, 3)])
+
+    for step, client_id in ((STEP, "api"), (StepModel("other-model"), "stub")):
+        target = PageDedup("target", _signatures([1, 2, 3]), step, index, client_id, chunk_dir)
+        segments = target.plan({"page_start": 1, "page_end": 3})
+        assert [(s.page_start, s.page_end, s.chunks) for s in segments] == [(1, 3, None)]
+
+
+def test_single_matching_page_is_generated(dirs: tuple[SignatureIndex, Path]) -> None:
+    index, chunk_dir = dirs
+    PageDedup("source", _signatures([1, 2]), STEP, index, "client", chunk_dir).register([_chunk("c", 1, 2)])
+
+    target = PageDedup("target", _signatures([1, 20, 21]), STEP, index, "client", chunk_dir)
+    segments = target.plan({"page_start": 1, "page_end": 3})
+    assert [(s.page_start, s.page_end, s.chunks) for s in segments] == [(1, 3, None)]
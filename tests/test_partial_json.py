@@ -0,0 +1,63 @@
+"""PartialObjectParser（ストリーミング中の部分JSONからのフィールド確定）のテスト"""
+
+import json
+
+import pytest
+
+from app.demo_a.partial_json import PartialObjectParser
+
+_OBJECT = {
+    "title": '見積書 "A-1" \\ 第2版',
+    "amount": 12500,
+    "items": [{"name": "作業, 一式", "tags": ["}", "]"]}, {"name": "交通費"}],
+    "meta": {"approved": True, "note": None},
+    "rate": 0.1,
+}
+
+
+def _collect() -> tuple[PartialObjectParser, list[tuple[str, object]]]:
+    fields: list[tuple[str, object]] = []
+    return PartialObjectParser(lambda key, value: fields.append((key, value))), fields
+
+
+@pytest.mark.parametrize("step", [1, 3, 7, 1000])
+def test_fields_are_reported_in_order_regardless_of_chunking(step: int) -> None:
+    parser, fields = _collect()
+    text = json.dumps(_OBJECT, ensure_ascii=False, indent=1)
+    for i in range(0, len(text), step):
+        parser.feed(text[i : i + step])
+    assert fields == list(_OBJECT.items())
+    assert parser.fields == _OBJECT
+
+
+def test_field_is_reported_once_its_value_ends() -> None:
+    parser, fields = _collect()
+    parser.feed('{"a": "first", "b": 4')
+    assert fields == [("a", "first")]
+    # 数値は続きが届く可能性があるので、区切りが来るまで確定しない
+    parser.feed("2")
+    assert fields == [("a", "first")]
+    parser.feed("}")
+    assert fields == [("a", "first"), ("b", 42)]
+
+
+def test_incomplete_nested_value_is_not_reported() -> None:
+    parser, fields = _collect()
+    parser.feed('{"items": [{"name": "x"}, {"name": "y, z"')
+    assert fields == []
+    assert parser.fields == {}
+
+
+def test_reset_starts_over() -> None:
+    parser, fields = _collect()
+    parser.feed('{"a": 1, "b": "cut')
+    parser.reset()
+    parser.feed('{"a": 2}')
+    assert fields == [("a", 1), ("a", 2)]
+    assert parser.fields == {"a": 2}
+
+
+def test_parser_without_callback_still_collects_fields() -> None:
+    parser = PartialObjectParser()
+    parser.feed('{"a": [1, 2], "b": {}}')
+    assert parser.fields == {"a": [1, 2], "b": {}}
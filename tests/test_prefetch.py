@@ -0,0 +1,84 @@
+"""SpeculativePrefetch（デバウンス・キーの切り替えによる取消・結果の採用）のテスト"""
+
+import threading
+import time
+
+from app.demo_a.cancellation import CancelToken
+from app.demo_a.prefetch import STATE_DONE, STATE_FAILED, SpeculativePrefetch
+
+
+def _wait_state(prefetch: SpeculativePrefetch, state: str, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while prefetch.status()[1] != state:
+        assert time.monotonic() < deadline, f"状態が {state} にならない（{prefetch.status()}）"
+        time.sleep(0.005)
+
+
+def test_take_starts_waiting_speculation_immediately() -> None:
+    prefetch = SpeculativePrefetch(debounce=60)
+    prefetch.request("a", lambda cancel: "result-a")
+    t0 = time.monotonic()
+    assert prefetch.take("a", timeout=5) == "result-a"
+    assert time.monotonic() - t0 < 5
+
+
+def test_take_with_other_key_returns_none() -> None:
+    prefetch = SpeculativePrefetch(debounce=0)
+    prefetch.request("a", lambda cancel: "result-a")
+    _wait_state(prefetch, STATE_DONE)
+    assert prefetch.take("b") is None
+    assert prefetch.take("a") == "result-a"
+
+
+def test_request_for_same_key_is_not_rerun() -> None:
+    calls: list[str] = []
+    prefetch = SpeculativePrefetch(debounce=0)
+    prefetch.request("a", lambda cancel: calls.append("a"))
+    _wait_state(prefetch, STATE_DONE)
+    prefetch.request("a", lambda cancel: calls.append("a"))
+    assert calls == ["a"]
+
+
+def test_new_key_cancels_running_speculation() -> None:
+    started = threading.Event()
+    tokens: list[CancelToken] = []
+
+    def _slow(cancel: CancelToken) -> str:
+        tokens.append(cancel)
+        started.set()
+        cancel.sleep(30)
+        return "never"
+
+    prefetch = SpeculativePrefetch(debounce=0)
+    prefetch.request("a", _slow)
+    assert started.wait(5)
+    prefetch.request("b", lambda cancel: "result-b")
+
+    assert tokens[0].cancelled
+    assert prefetch.take("a") is None
+    assert prefetch.take("b", timeout=5) == "result-b"
+
+
+def test_key_changed_during_debounce_is_never_run() -> None:
+    calls: list[str] = []
+    prefetch = SpeculativePrefetch(debounce=60)
+    prefetch.request("a", lambda cancel: calls.append("a"))
+    prefetch.request("b", lambda cancel: calls.append("b") or "result-b")
+    assert prefetch.take("b", timeout=5) == "result-b"
+    assert calls == ["b"]
+
+
+def test_failed_speculation_can_be_requested_again() -> None:
+    prefetch = SpeculativePrefetch(debounce=0)
+
+    def _fail(cancel: CancelToken) -> None:
+        raise RuntimeError("boom")
+
+    prefetch.request("a", _fail)
+    _wait_state(prefetch, STATE_FAILED)
+    assert prefetch.take("a") is None
+    prefetch.request("a", lambda cancel: "retry")
+    assert prefetch.take("a", timeout=5) == "retry"
+
+    prefetch.cancel()
+    assert prefetch.status() == (None, None)
@@ -0,0 +1,113 @@
+"""RateGovernor（送信枠の払い出し・usage補正・優先度順の待機・取消・429適応）のテスト"""
+
+import threading
+import time
+
+import pytest
+
+from app.demo_a.cancellation import CancelToken, OperationCancelledError
+from app.demo_a.rate_governor import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    RateGovernor,
+    estimate_input_tokens,
+)
+
+
+def _wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "タイムアウト"
+        time.sleep(0.005)
+
+
+def test_estimate_input_tokens_counts_text_and_pdf() -> None:
+    text_only = estimate_input_tokens([{"role": "user", "content": "a" * 250}])
+    with_pdf = estimate_input_tokens(
+        [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "a" * 250},
+                    {"type": "document", "source": {"type": "base64", "data": "A" * 4000}},
+                ],
+            }
+        ]
+    )
+    assert text_only == 101
+    assert with_pdf == text_only + 150
+
+
+def test_settle_refunds_failed_request_and_charges_actual_usage() -> None:
+    governor = RateGovernor(rpm=0, tpm=1000)
+    ticket = governor.acquire(400)
+    governor.settle(ticket, None)
+    assert governor._tokens.level == pytest.approx(1000, abs=1)
+
+    ticket = governor.acquire(400)
+    governor.settle(ticket, 600)
+    assert governor._tokens.level == pytest.approx(400, abs=1)
+    # 実トークン数が見積もりより多ければ、以降の見積もりを大きくする
+    assert governor.stats()["estimate_ratio"] > 1.0
+
+
+def test_waiters_are_admitted_in_priority_order() -> None:
+    # 100トークン/秒で補充されるバケットを空にしてから、優先度の違う2件を待たせる
+    governor = RateGovernor(rpm=0, tpm=6000)
+    governor.acquire(6000)
+    order: list[str] = []
+
+    def _acquire(name: str, priority: int) -> None:
+        governor.acquire(20, priority=priority)
+        order.append(name)
+
+    background = threading.Thread(target=_acquire, args=("background", PRIORITY_BACKGROUND))
+    background.start()
+    _wait_until(lambda: governor.stats()["waiting"] == 1)
+    interactive = threading.Thread(target=_acquire, args=("interactive", PRIORITY_INTERACTIVE))
+    interactive.start()
+    background.join(timeout=5)
+    interactive.join(timeout=5)
+
+    assert order == ["interactive", "background"]
+
+
+def test_cancel_interrupts_waiting_acquire() -> None:
+    governor = RateGovernor(rpm=0, tpm=60)
+    governor.acquire(60)
+    cancel = CancelToken()
+    errors: list[BaseException] = []
+
+    def _acquire() -> None:
+        try:
+            governor.acquire(60, cancel=cancel)
+        except OperationCancelledError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=_acquire)
+    thread.start()
+    _wait_until(lambda: governor.stats()["waiting"] == 1)
+    cancel.cancel()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert governor.stats()["waiting"] == 0
+
+
+def test_rate_limit_cools_down_and_recovers_gradually() -> None:
+    governor = RateGovernor(rpm=0, tpm=0)
+    delay = governor.on_rate_limited(attempt=0, retry_after=0.2)
+    stats = governor.stats()
+    assert delay >= 0.2
+    assert governor.cooling_down
+    assert stats["rate_factor"] == 0.5
+    assert stats["rate_limited"] == 1
+
+    governor.on_success()
+    assert governor.stats()["rate_factor"] == 0.55
+
+    # クールダウン中の送信はクールダウン明けまで待たされる
+    t0 = time.monotonic()
+    governor.acquire(1)
+    assert time.monotonic() - t0 >= 0.15
@@ -0,0 +1,42 @@
+"""SchemaRegistry（グルーピング結果のキャッシュ・永続化）のテスト"""
+
+from pathlib import Path
+
+import pytest
+
+from app.demo_a import schema_registry
+from app.demo_a.model_routing import StepModel
+from app.demo_a.schema_registry import SchemaRegistry
+from app.demo_a.schemas import FieldGroup, GroupingResult
+
+STEP = StepModel("test-model")
+FIELDS = [{"name": "件名", "type": "str"}, {"name": "金額", "type": "int"}]
+
+
+@pytest.fixture
+def calls(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """group_fields を差し替え、呼ばれるたびにモデル名を記録する。"""
+    calls: list[str] = []
+
+    def _group_fields(field_definitions, step, cancel=None) -> GroupingResult:
+        calls.append(step.model)
+        names = [f["name"] for f in field_definitions]
+        return GroupingResult(groups=[FieldGroup(group_name=f"g{len(calls)}", field_names=names, search_query="q")])
+
+    monkeypatch.setattr(schema_registry, "group_fields", _group_fields)
+    return calls
+
+
+def test_grouping_is_computed_once_and_persisted(tmp_path: Path, calls: list[str]) -> None:
+    first = SchemaRegistry(tmp_path).grouping(FIELDS, STEP, client_id="api")
+    assert SchemaRegistry(tmp_path).grouping(FIELDS, STEP, client_id="api") == first
+    assert calls == ["test-model"]
+
+
+def test_groupings_from_other_clients_are_not_reused(tmp_path: Path, calls: list[str]) -> None:
+    registry = SchemaRegistry(tmp_path)
+    stub = registry.grouping(FIELDS, STEP, client_id="stub")
+    api = SchemaRegistry(tmp_path).grouping(FIELDS, STEP, client_id="api")
+    assert len(calls) == 2
+    assert stub.groups[0].group_name != api.groups[0].group_name
+    assert len(list(tmp_path.glob("*.grouping.json"))) == 2
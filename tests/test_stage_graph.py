@@ -0,0 +1,150 @@
+"""StageGraph（依存順・並行実行・メモ化・途中からの実行・失敗・取消）のテスト"""
+
+import threading
+import time
+
+import pytest
+
+from app.demo_a.cancellation import CancelToken, OperationCancelledError
+from app.demo_a.stage_graph import (
+    CLASS_LLM,
+    EVENT_CACHED,
+    EVENT_DONE,
+    EVENT_SKIPPED,
+    Stage,
+    StageCache,
+    StageEvent,
+    StageGraph,
+)
+
+
+def _graph(calls: list[str], **fns) -> StageGraph:
+    """doc → parse、schema → plan、(parse, plan) → answer のグラフ。fns で処理を差し替える。"""
+
+    def _record(name: str, fn):
+        def _run(cancel=None, **kwargs):
+            calls.append(name)
+            return fn(**kwargs)
+
+        return _run
+
+    parse = fns.get("parse", lambda doc: f"parsed({doc})")
+    plan = fns.get("plan", lambda schema: f"plan({schema})")
+    answer = fns.get("answer", lambda parse, plan: f"{parse}+{plan}")
+    return StageGraph(
+        [
+            Stage("answer", _record("answer", answer), inputs=("parse", "plan")),
+            Stage("parse", _record("parse", parse), inputs=("doc",)),
+            Stage("plan", _record("plan", plan), inputs=("schema",), concurrency=CLASS_LLM),
+        ]
+    )
+
+
+def test_runs_dependencies_in_order() -> None:
+    calls: list[str] = []
+    outputs = _graph(calls).run({"doc": "d", "schema": "s"}, targets=["answer"])
+    assert outputs == {"answer": "parsed(d)+plan(s)"}
+    assert calls[-1] == "answer"
+    assert sorted(calls[:2]) == ["parse", "plan"]
+
+
+def test_independent_stages_run_concurrently() -> None:
+    barrier = threading.Barrier(2, timeout=5)
+
+    def _wait(**kwargs) -> str:
+        barrier.wait()
+        return "ok"
+
+    graph = _graph([], parse=lambda doc: _wait(), plan=lambda schema: _wait())
+    assert graph.run({"doc": "d", "schema": "s"}, targets=["parse", "plan"]) == {"parse": "ok", "plan": "ok"}
+
+
+def test_only_stages_depending_on_changed_input_rerun() -> None:
+    calls: list[str] = []
+    graph = _graph(calls)
+    cache = StageCache()
+    events: list[StageEvent] = []
+
+    graph.run({"doc": "d", "schema": "s1"}, cache=cache)
+    calls.clear()
+    outputs = graph.run({"doc": "d", "schema": "s2"}, targets=["answer"], cache=cache, on_event=events.append)
+
+    assert outputs["answer"] == "parsed(d)+plan(s2)"
+    assert sorted(calls) == ["answer", "plan"]
+    assert ("parse", EVENT_CACHED) in [(e.stage, e.status) for e in events]
+
+
+def test_stage_output_in_inputs_skips_its_upstream() -> None:
+    calls: list[str] = []
+    events: list[StageEvent] = []
+    outputs = _graph(calls).run({"parse": "given", "schema": "s"}, targets=["answer"], on_event=events.append)
+
+    assert outputs == {"answer": "given+plan(s)"}
+    assert "parse" not in calls
+    # メモ化しない場合はキャッシュキーを計算しない
+    assert {e.key for e in events} == {""}
+
+
+def test_missing_input_and_unknown_target_are_rejected() -> None:
+    graph = _graph([])
+    with pytest.raises(ValueError, match="schema"):
+        graph.run({"doc": "d"}, targets=["answer"])
+    with pytest.raises(ValueError, match="nope"):
+        graph.run({"doc": "d", "schema": "s"}, targets=["nope"])
+
+
+def test_cycle_is_rejected() -> None:
+    with pytest.raises(ValueError, match="循環依存"):
+        StageGraph([Stage("a", lambda b, cancel: b, inputs=("b",)), Stage("b", lambda a, cancel: a, inputs=("a",))])
+
+
+def test_failure_skips_downstream_and_raises() -> None:
+    calls: list[str] = []
+    events: list[StageEvent] = []
+
+    def _fail(doc: str) -> str:
+        raise RuntimeError("parse failed")
+
+    with pytest.raises(RuntimeError, match="parse failed"):
+        _graph(calls, parse=_fail).run({"doc": "d", "schema": "s"}, on_event=events.append)
+    assert "answer" not in calls
+    assert ("answer", EVENT_SKIPPED) in [(e.stage, e.status) for e in events]
+
+
+def test_cancel_stops_before_next_stage() -> None:
+    cancel = CancelToken()
+    calls: list[str] = []
+
+    def _parse(doc: str) -> str:
+        cancel.cancel()
+        return "parsed"
+
+    graph = _graph(calls, parse=_parse, plan=lambda schema: time.sleep(0.05) or "plan")
+    with pytest.raises(OperationCancelledError):
+        graph.run({"doc": "d", "schema": "s"}, targets=["answer"], cancel=cancel)
+    assert "answer" not in calls
+
+
+def test_events_report_done_with_duration() -> None:
+    events: list[StageEvent] = []
+    _graph([]).run({"doc": "d", "schema": "s"}, targets=["parse"], on_event=events.append)
+    done = [e for e in events if e.status == EVENT_DONE]
+    assert [e.stage for e in done] == ["parse"]
+    assert done[0].seconds >= 0
+
+
+def test_cache_is_bounded_by_output_bytes() -> None:
+    cache = StageCache(max_bytes=1000)
+    cache.put("a", {"pdf_bytes": b"x" * 400})
+    cache.put("b", [{"pdf_bytes": b"y" * 400}])
+    cache.get("a")
+    cache.put("c", {"pdf_bytes": b"z" * 400})
+
+    # 最近使われていない b から捨てる
+    assert [cache.get(k)[0] for k in ("a", "b", "c")] == [True, False, True]
+    assert cache.size == 800
+
+    # 上限を超える1出力は保持しない
+    cache.put("huge", b"h" * 2000)
+    assert not cache.get("huge")[0]
+    assert len(cache) == 2